@@ -3,6 +3,14 @@ ASGI config for aams_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serves the normal API plus the asynchronous Server-Sent Events endpoint
+/api/events/ (core/event_stream.py), e.g.:
+
+    uvicorn aams_backend.asgi:application --workers 4
+
+With more than one worker set EVENTS_BACKEND=core.events.PostgresBackend so
+events reach clients connected to every worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
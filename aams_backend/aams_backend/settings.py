@@ -139,9 +139,59 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'core.User'
 
+# Cache
+# 'permissions' ใช้เก็บ effective permissions ของผู้ใช้ (core/permission_cache.py)
+# ค่าเริ่มต้นเป็น local-memory ถ้ารันหลาย process ควรเปลี่ยนเป็น backend ที่แชร์กันได้ เช่น Redis
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'permissions': {
+        'BACKEND': config('PERMISSION_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('PERMISSION_CACHE_LOCATION', default='aams-permissions'),
+    },
+}
+
+AAMS_PERMISSION_CACHE_ALIAS = 'permissions'
+AAMS_PERMISSION_CACHE_TIMEOUT = config('PERMISSION_CACHE_TIMEOUT', default=300, cast=int)  # วินาที
+# version ของ permissions อยู่ในฐานข้อมูล (core_permission_version) และ cache ไว้ตามเวลานี้
+# ถ้า cache 'permissions' เป็น local-memory การเปลี่ยนสิทธิ์จะมีผลกับ process อื่นภายในเวลานี้
+AAMS_PERMISSION_VERSION_CACHE_TIMEOUT = config('PERMISSION_VERSION_CACHE_TIMEOUT', default=10, cast=int)  # วินาที
+
+# อายุ cache ของสถิติหน้า Dashboard (core/dashboard.py) เก็บใน cache 'default'
+AAMS_DASHBOARD_CACHE_TIMEOUT = config('DASHBOARD_CACHE_TIMEOUT', default=30, cast=int)  # วินาที
+
+# ขนาดหน้าของ keyset pagination (core/pagination.py)
+AAMS_PAGE_SIZE = config('API_PAGE_SIZE', default=50, cast=int)
+AAMS_MAX_PAGE_SIZE = 500
+# อนุญาต ?paginate=false เพื่อดึงรายการทั้งหมด (สำหรับหน้าจอเดิมที่ยังไม่รองรับ cursor)
+AAMS_ALLOW_UNPAGINATED_LISTS = config('ALLOW_UNPAGINATED_LISTS', default=True, cast=bool)
+
+# ?updated_since= ของรายการ (core/delta_sync.py)
+AAMS_SYNC_MAX_CHANGES = 1000  # จำนวนบันทึกสูงสุดต่อ response
+AAMS_SYNC_SETTLE_SECONDS = 2  # ไม่ส่งบันทึกที่ใหม่กว่านี้ (รอ INSERT ของ process อื่น commit)
+AAMS_CHANGE_LOG_RETENTION_DAYS = config('CHANGE_LOG_RETENTION_DAYS', default=30, cast=int)
+
+# event แบบ real-time ของ /api/events/ (core/events.py)
+# ใช้ core.events.PostgresBackend เมื่อรันหลาย process (ส่ง event ข้าม process ผ่าน LISTEN/NOTIFY)
+AAMS_EVENTS_BACKEND = config('EVENTS_BACKEND', default='core.events.LocalBackend')
+AAMS_EVENTS_QUEUE_SIZE = 100  # event ที่ค้างได้ต่อการเชื่อมต่อ เกินนี้จะส่ง resync แทน
+AAMS_EVENTS_HEARTBEAT_SECONDS = 20
+AAMS_EVENTS_TICKET_SECONDS = 30  # อายุ ticket สำหรับเปิด /api/events/ (ใช้ได้ครั้งเดียว)
+
+# ซิงค์ Role กับ Django Group หลัง commit ด้วย thread ใน process (core/group_sync.py)
+# ถ้าปิด ต้องตั้ง cron เรียก `python manage.py drain_group_sync`
+AAMS_GROUP_SYNC_WORKER = config('GROUP_SYNC_WORKER', default=True, cast=bool)
+
+# จำนวนรายการสูงสุดต่อครั้งของ POST /api/permissions/check/
+AAMS_PERMISSION_CHECK_MAX_ITEMS = 10000
+
+# จำนวนผู้ใช้สูงสุดต่อครั้งของ POST /api/user-roles/bulk/
+AAMS_BULK_ROLE_MAX_USERS = 10000
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated', # บังคับให้ต้อง Login ก่อนเสมอ
@@ -186,14 +236,22 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
     
     # การตั้งค่า Response
-    'TOKEN_OBTAIN_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenObtainPairSerializer',
-    'TOKEN_REFRESH_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenRefreshSerializer',
+    'TOKEN_OBTAIN_SERIALIZER': 'core.tokens.PermissionClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'core.tokens.PermissionClaimsTokenRefreshSerializer',
     'TOKEN_VERIFY_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenVerifySerializer',
     'TOKEN_BLACKLIST_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenBlacklistSerializer',
     'SLIDING_TOKEN_OBTAIN_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer',
     'SLIDING_TOKEN_REFRESH_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer',
 }
 
+# ฝัง roles/permissions และ permission version ลงใน access token (ดู core/tokens.py)
+# permission classes จะตรวจสอบสิทธิ์จาก token ได้โดยไม่ต้อง query ฐานข้อมูล
+AAMS_JWT_PERMISSION_CLAIMS = config('JWT_PERMISSION_CLAIMS', default=False, cast=bool)
+
+# เมื่อ token มี claims ระบบจะไม่โหลด User จากฐานข้อมูลทุก request
+# ผู้ใช้ที่ถูกปิดการใช้งานจะถูกปฏิเสธภายในเวลานี้ (วินาที)
+AAMS_DEACTIVATED_USER_CACHE_TTL = config('DEACTIVATED_USER_CACHE_TTL', default=30, cast=int)
+
 # ระบุว่าอนุญาตให้ Origin ไหนเรียกเข้ามาได้บ้าง
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # ลงทะเบียน signals สำหรับล้าง cache ของ permissions
+        from . import signals  # noqa: F401
@@ -0,0 +1,143 @@
+# aams_backend/core/authentication.py
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+from .tokens import (
+    PERMISSION_VERSION_CLAIM, PERMISSIONS_CLAIM, USERNAME_CLAIM, current_permission_version
+)
+
+# ฟิลด์ของ User ที่สร้างได้จาก claims ใน token ฟิลด์อื่นจะถูกโหลดจากฐานข้อมูลเมื่อมีการใช้งาน
+CLAIM_USER_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+class DeactivatedUserCache:
+    """
+    Cache ในหน่วยความจำของ process สำหรับ id ของผู้ใช้ที่ถูกปิดการใช้งาน
+    โหลดใหม่จากฐานข้อมูลทุก AAMS_DEACTIVATED_USER_CACHE_TTL วินาที
+    (signals จะอัปเดตทันทีเมื่อผู้ใช้ถูกปิด/เปิดใน process เดียวกัน)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._user_ids = frozenset()
+        self._expires_at = 0
+
+    def _get_ttl(self):
+        return getattr(settings, 'AAMS_DEACTIVATED_USER_CACHE_TTL', 30)
+
+    def _reload(self):
+        self._user_ids = frozenset(
+            User.objects.filter(is_active=False).values_list('id', flat=True)
+        )
+        self._expires_at = time.monotonic() + self._get_ttl()
+
+    def contains(self, user_id):
+        if time.monotonic() >= self._expires_at:
+            with self._lock:
+                if time.monotonic() >= self._expires_at:
+                    self._reload()
+        return user_id in self._user_ids
+
+    def add(self, user_id):
+        with self._lock:
+            self._user_ids = self._user_ids | {user_id}
+
+    def discard(self, user_id):
+        with self._lock:
+            self._user_ids = self._user_ids - {user_id}
+
+    def clear(self):
+        with self._lock:
+            self._user_ids = frozenset()
+            self._expires_at = 0
+
+
+deactivated_users = DeactivatedUserCache()
+
+
+def build_user_from_claims(validated_token):
+    """
+    สร้าง User จาก claims ใน token โดยไม่ query ฐานข้อมูล
+    ฟิลด์ที่ไม่มีใน token เป็น deferred field และจะถูกโหลดทั้งหมดในครั้งเดียวเมื่อมีการเข้าถึง
+    """
+    claims = {
+        'id': validated_token[api_settings.USER_ID_CLAIM],
+        'username': validated_token[USERNAME_CLAIM],
+        'is_active': True,
+        'is_staff': validated_token['is_staff'],
+        'is_superuser': validated_token['is_superuser'],
+    }
+    # from_db รับค่าตามลำดับฟิลด์ของ model ไม่ใช่ตามลำดับของ field_names
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in CLAIM_USER_FIELDS]
+    user = User.from_db(DEFAULT_DB_ALIAS, field_names, [claims[name] for name in field_names])
+    user._from_token_claims = True
+    return user
+
+
+class PermissionClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication ที่รองรับ permission claims ใน access token (ดู core/tokens.py)
+
+    - ถ้า token มี perm_ver แต่ไม่ตรงกับ version ปัจจุบัน จะตอบ 401 เพื่อให้ client refresh token
+    - ถ้า token ถูกต้อง จะเก็บชุด permission ไว้ที่ user.permission_claims
+      เพื่อให้ permission classes ตรวจสอบได้โดยไม่ต้อง query ฐานข้อมูล
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is None:
+            return None
+
+        user, validated_token = result
+        if PERMISSIONS_CLAIM in validated_token:
+            user.permission_claims = frozenset(validated_token[PERMISSIONS_CLAIM])
+
+        return user, validated_token
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+
+        token_version = validated_token.get(PERMISSION_VERSION_CLAIM)
+        if token_version is not None:
+            user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+            # version ใน cache ของ process นี้อาจเก่ากว่า token ที่ process อื่นเพิ่งออก
+            # จึงตรวจสอบกับฐานข้อมูลอีกครั้งก่อนปฏิเสธ
+            if (token_version != current_permission_version(user_id)
+                    and token_version != current_permission_version(user_id, refresh=True)):
+                raise InvalidToken({
+                    'detail': 'สิทธิ์ของผู้ใช้มีการเปลี่ยนแปลง กรุณาขอ token ใหม่',
+                    'code': 'permission_version_stale',
+                })
+
+        return validated_token
+
+
+class StatelessJWTAuthentication(PermissionClaimsJWTAuthentication):
+    """
+    Authentication ที่สร้าง user จาก claims ใน token แทนการ SELECT core_user ทุก request
+
+    - ใช้ได้กับ token ที่ออกโดยเปิด AAMS_JWT_PERMISSION_CLAIMS ถ้า token ไม่มี claims จะโหลด user ตามปกติ
+    - ผู้ใช้ที่ถูกปิดการใช้งานจะถูกปฏิเสธภายในเวลา AAMS_DEACTIVATED_USER_CACHE_TTL
+    """
+
+    def get_user(self, validated_token):
+        if USERNAME_CLAIM not in validated_token or 'is_staff' not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if deactivated_users.contains(user_id):
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        return build_user_from_claims(validated_token)
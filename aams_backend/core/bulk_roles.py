@@ -0,0 +1,168 @@
+# aams_backend/core/bulk_roles.py
+
+"""
+งานแบบ bulk ของ roles:
+- กำหนด/ยกเลิก role ให้ผู้ใช้หลายคนในครั้งเดียว (POST /api/user-roles/bulk/)
+- แทนที่ permissions ทั้งหมดของ role (PUT /api/roles/{id}/permissions/) ดู replace_role_permissions()
+
+ทำใน transaction เดียวด้วยจำนวน query คงที่ไม่ขึ้นกับจำนวนผู้ใช้:
+- assign: upsert UserRole ด้วย INSERT ... ON CONFLICT (user, role) DO UPDATE
+  และเพิ่มผู้ใช้เข้า Django Group ของ role ด้วย INSERT เดียว
+- revoke: ปิด UserRole ด้วย UPDATE เดียว และลบผู้ใช้ออกจาก Django Group ด้วย DELETE เดียว
+bulk operations ไม่ผ่าน signals จึงอัปเดตตัวนับ, change log, effective permissions และ cache เอง
+(ด้วยฟังก์ชันเดียวกับ core/upserts.py)
+
+ผลลัพธ์ของผู้ใช้แต่ละคน:
+    assign: assigned (ใหม่), reactivated (เคยถูกยกเลิก), updated (เปลี่ยน expires_at), unchanged
+    revoke: revoked, not_assigned
+    not_found: ไม่มีผู้ใช้ id นี้
+"""
+
+from django.db import transaction
+
+from . import upserts
+from .models import Role, RolePermission, User, UserRole
+
+ASSIGN = 'assign'
+REVOKE = 'revoke'
+OPERATIONS = (ASSIGN, REVOKE)
+
+
+def assign_role(role, user_ids, assigned_by=None, expires_at=None):
+    """กำหนด role ให้ผู้ใช้ทุกคนใน user_ids คืนค่า {user_id: ผลลัพธ์}"""
+    results = {}
+    with transaction.atomic():
+        existing = {
+            user_id: (is_active, current_expires_at)
+            for user_id, is_active, current_expires_at in UserRole.objects.filter(
+                role=role, user_id__in=user_ids
+            ).values_list('user_id', 'is_active', 'expires_at')
+        }
+        for user_id in user_ids:
+            if user_id not in existing:
+                results[user_id] = 'assigned'
+            elif not existing[user_id][0]:
+                results[user_id] = 'reactivated'
+            elif existing[user_id][1] != expires_at:
+                results[user_id] = 'updated'
+            else:
+                results[user_id] = 'unchanged'
+
+        changed_ids = [user_id for user_id, result in results.items() if result != 'unchanged']
+        if not changed_ids:
+            return results
+
+        UserRole.objects.bulk_create(
+            [
+                UserRole(user_id=user_id, role=role, assigned_by=assigned_by,
+                         expires_at=expires_at, is_active=True)
+                for user_id in changed_ids
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'role'],
+            update_fields=['is_active', 'assigned_by', 'expires_at'],
+        )
+        if role.django_group_id:
+            memberships = User.groups.through
+            memberships.objects.bulk_create(
+                [memberships(user_id=user_id, group_id=role.django_group_id) for user_id in changed_ids],
+                ignore_conflicts=True
+            )
+
+        user_role_ids = UserRole.objects.filter(
+            role=role, user_id__in=changed_ids
+        ).values_list('id', flat=True)
+        upserts.user_roles_written([role.pk], user_role_ids, changed_ids)
+    return results
+
+
+def revoke_role(role, user_ids):
+    """ยกเลิก role ของผู้ใช้ทุกคนใน user_ids คืนค่า {user_id: ผลลัพธ์}"""
+    with transaction.atomic():
+        active = dict(
+            UserRole.objects.select_for_update()
+            .filter(role=role, user_id__in=user_ids, is_active=True)
+            .values_list('user_id', 'id')
+        )
+        results = {
+            user_id: 'revoked' if user_id in active else 'not_assigned'
+            for user_id in user_ids
+        }
+        if not active:
+            return results
+
+        revoked_ids = list(active)
+        UserRole.objects.filter(id__in=active.values()).update(is_active=False)
+        if role.django_group_id:
+            User.groups.through.objects.filter(
+                group_id=role.django_group_id, user_id__in=revoked_ids
+            ).delete()
+        upserts.user_roles_written([role.pk], list(active.values()), revoked_ids)
+    return results
+
+
+def apply(operation, role, user_ids, assigned_by=None, expires_at=None):
+    """
+    ทำ operation (assign/revoke) กับผู้ใช้ใน user_ids
+    คืนค่า {user_id: ผลลัพธ์} ตามลำดับของ user_ids (id ที่ไม่มีผู้ใช้จะได้ not_found)
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    found = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    found_ids = [user_id for user_id in user_ids if user_id in found]
+    if operation == ASSIGN:
+        results = assign_role(role, found_ids, assigned_by=assigned_by, expires_at=expires_at)
+    else:
+        results = revoke_role(role, found_ids)
+    return {user_id: results.get(user_id, 'not_found') for user_id in user_ids}
+
+
+def replace_role_permissions(role, permission_ids, granted_by=None):
+    """
+    ทำให้ permissions ที่ active ของ role ตรงกับ permission_ids พอดีใน transaction เดียว
+    (เพิ่ม/เปิดใช้ใหม่ด้วย upsert เดียว ปิดส่วนที่เหลือด้วย UPDATE เดียว)
+    คืนค่า (id ที่เพิ่ม, id ที่ถูกนำออก) ของ permissions
+    """
+    desired = set(permission_ids)
+    with transaction.atomic():
+        # ล็อก role ไว้ไม่ให้การแก้ไข permissions ของ role เดียวกันทำพร้อมกัน
+        list(Role.objects.select_for_update().filter(pk=role.pk).values_list('id', flat=True))
+        current = {
+            permission_id: (role_permission_id, is_active)
+            for role_permission_id, permission_id, is_active in RolePermission.objects.filter(
+                role=role
+            ).values_list('id', 'permission_id', 'is_active')
+        }
+        added = sorted(
+            permission_id for permission_id in desired
+            if permission_id not in current or not current[permission_id][1]
+        )
+        removed = sorted(
+            permission_id for permission_id, (_, is_active) in current.items()
+            if is_active and permission_id not in desired
+        )
+        if not added and not removed:
+            return added, removed
+
+        if added:
+            RolePermission.objects.bulk_create(
+                [
+                    RolePermission(role=role, permission_id=permission_id, granted_by=granted_by, is_active=True)
+                    for permission_id in added
+                ],
+                update_conflicts=True,
+                unique_fields=['role', 'permission'],
+                update_fields=['is_active', 'granted_by'],
+            )
+        if removed:
+            RolePermission.objects.filter(
+                id__in=[current[permission_id][0] for permission_id in removed]
+            ).update(is_active=False)
+
+        # bulk operations ไม่ผ่าน signals จึงอัปเดตข้อมูลที่ role_permission_changed ทำให้เอง
+        upserts.role_permissions_written(
+            role,
+            RolePermission.objects.filter(role=role, permission_id__in=added + removed).values_list('id', flat=True),
+            granted=added,
+            revoked=removed,
+        )
+    return added, removed
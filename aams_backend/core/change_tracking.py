@@ -0,0 +1,98 @@
+# aams_backend/core/change_tracking.py
+
+"""
+ติดตามการเปลี่ยนแปลงของตารางหลัก
+
+- version ของตาราง (TableVersion) ใช้สร้าง ETag ใน core/conditional.py
+- บันทึกรายแถว (ChangeLog) ใช้ตอบ ?updated_since= ใน core/delta_sync.py
+- event แบบ real-time ให้ client ที่เชื่อมต่อ /api/events/ (core/events.py)
+
+- signals (core/signals.py) เรียก mark_changed() ทุกครั้งที่มีการบันทึก/ลบแถว
+  งานแบบ bulk ที่ใช้ update()/delete() โดยตรงต้องเรียก mark_changed() เอง
+- ChangeLog และ version ถูกเขียนหลัง commit (on_commit) ด้วยคำสั่งสั้นๆ นอก transaction ของการเปลี่ยนข้อมูล
+  - transaction ที่เขียนพร้อมกันจึงไม่ต้องรอล็อกแถว version เดียวกันจนจบ transaction และไม่เกิด deadlock
+    ระหว่าง transaction ที่แก้หลายตารางคนละลำดับ (ผู้อ่านอาจได้ ETag เดิมในช่วงสั้นๆ ระหว่าง commit กับ UPDATE)
+  - id ของ ChangeLog เรียงตามลำดับการ commit cursor ของ ?updated_since= จึงไม่ข้ามการเปลี่ยนแปลง
+    ของ transaction ที่ใช้เวลานาน
+  - ถ้า process หยุดทำงานระหว่าง commit กับการบันทึก การเปลี่ยนแปลงนั้นจะไม่ถูกส่งให้ client
+    จนกว่าแถวจะเปลี่ยนอีกครั้ง (client ที่ต้องการข้อมูลครบแน่นอนให้ดึงรายการทั้งหมดใหม่เป็นระยะ)
+- เก็บในฐานข้อมูล (ไม่ใช่ cache) เพื่อให้ทุก process เห็นค่าเดียวกัน
+"""
+
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import events
+from .models import ChangeLog, TableVersion
+
+
+def table_name(model):
+    return model._meta.db_table
+
+
+def _initial_version():
+    # เริ่มจากเวลาปัจจุบัน เพื่อไม่ให้ version ซ้ำกับค่าเก่าถ้าตารางถูกล้าง
+    return int(time.time() * 1000)
+
+
+def bump(*models):
+    """เพิ่ม version ของตารางของ models ที่ระบุทันที (mark_changed เรียกหลัง commit)"""
+    tables = sorted({table_name(model) for model in models})
+    if not tables:
+        return
+    versions = TableVersion.objects.filter(table__in=tables)
+    if versions.update(version=F('version') + 1, updated_at=timezone.now()) < len(tables):
+        TableVersion.objects.bulk_create(
+            [TableVersion(table=table, version=_initial_version()) for table in tables],
+            ignore_conflicts=True
+        )
+
+
+def mark_changed(model, ids, deleted=False, audience=None):
+    """
+    บันทึกว่าแถว ids ของ model ถูกเปลี่ยน (หรือถูกลบ) เพิ่ม version ของตาราง และส่ง event
+    (audience ดู events.publish)
+    """
+    mark_many_changed([(model, ids, audience)], deleted=deleted)
+
+
+def mark_many_changed(changes, deleted=False):
+    """
+    mark_changed() ของหลายตารางพร้อมกัน: changes เป็น list ของ (model, ids, audience)
+    บันทึกหลัง transaction ปัจจุบัน commit (ทันทีถ้าไม่ได้อยู่ใน transaction) ดู _record_changes
+    """
+    changed = []
+    for model, ids, audience in changes:
+        ids = sorted({pk for pk in ids if pk is not None})
+        if ids:
+            changed.append((model, ids, audience))
+    if changed:
+        transaction.on_commit(lambda: _record_changes(changed, deleted))
+
+
+def _record_changes(changed, deleted):
+    """
+    เขียน ChangeLog ด้วย INSERT เดียว เพิ่ม version ของทุกตารางด้วย UPDATE เดียว แล้วส่ง event
+
+    ทำหลัง commit ด้วยคำสั่งสั้นๆ id และ changed_at ของ ChangeLog จึงเรียงตามเวลาที่ข้อมูล commit
+    (transaction ที่ใช้เวลานานจะไม่ได้ id ที่น้อยกว่า cursor ที่ client ได้ไปแล้ว ดู core/delta_sync.py)
+    """
+    now = timezone.now()
+    ChangeLog.objects.bulk_create([
+        ChangeLog(table=table_name(model), object_id=pk, deleted=deleted, changed_at=now)
+        for model, ids, _ in changed
+        for pk in ids
+    ])
+    bump(*[model for model, _, _ in changed])
+    for model, ids, audience in changed:
+        events.publish(model, ids, deleted=deleted, audience=audience)
+
+
+def get_versions(models):
+    """ดึง version ของตารางของ models ที่ระบุ (query เดียว) คืนค่า list ของ (table, version)"""
+    tables = sorted({table_name(model) for model in models})
+    versions = dict(TableVersion.objects.filter(table__in=tables).values_list('table', 'version'))
+    return [(table, versions.get(table, 0)) for table in tables]
@@ -0,0 +1,91 @@
+# aams_backend/core/conditional.py
+
+"""
+Conditional GET (ETag / If-None-Match) สำหรับ viewsets ของ core
+
+ETag คำนวณจาก version ของตารางที่ข้อมูลของ endpoint ขึ้นอยู่กับ (core/change_tracking.py)
+version ของ permissions ของผู้ใช้ (core/permission_cache.py) และ URL ของ request
+จึงตอบ 304 Not Modified ได้ด้วย query เดียวโดยไม่ต้องดึงและ serialize ข้อมูลจริง
+
+viewsets ที่มี DeltaSyncMixin ต้องวาง DeltaSyncMixin ไว้ก่อน ConditionalGetMixin
+(ผลของ ?updated_since= ขึ้นกับเวลาด้วย จึงใช้ ETag จาก version ของตารางไม่ได้)
+
+version ถูกอ่านก่อนดึงข้อมูล ถ้าข้อมูลเปลี่ยนระหว่างนั้น ETag ที่ส่งไปจะเก่ากว่าข้อมูล
+และ request ถัดไปจะได้ข้อมูลใหม่ (ไม่มีทางที่ข้อมูลเก่าจะได้ ETag ใหม่)
+"""
+
+import functools
+import hashlib
+
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import change_tracking, permission_cache
+
+
+def get_etag(request, models):
+    parts = [
+        request.get_full_path(),
+        getattr(request.accepted_renderer, 'format', ''),
+        str(request.user.pk),
+        *(str(version) for version in permission_cache.get_versions(request.user.pk)),
+    ]
+    parts.extend(f'{table}:{version}' for table, version in change_tracking.get_versions(models))
+    return '"%s"' % hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # GZipMiddleware และ proxy อาจเปลี่ยน ETag เป็นแบบ weak (W/"...")
+    return etag in (tag.removeprefix('W/') for tag in parse_etags(header))
+
+
+def _patch_headers(response, etag):
+    response['ETag'] = etag
+    # ข้อมูลขึ้นกับผู้ใช้: ให้ browser เก็บไว้ได้แต่ต้องถามเซิร์ฟเวอร์ทุกครั้ง
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def conditional_get(view_method):
+    """
+    decorator สำหรับ method ของ viewset ที่ตอบ GET
+    ใช้ตารางจาก etag_models ของ viewset และตอบ 304 ถ้า If-None-Match ตรงกับ ETag ปัจจุบัน
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_method(self, request, *args, **kwargs)
+
+        etag = get_etag(request, self.etag_models)
+        if etag_matches(request, etag):
+            return _patch_headers(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            _patch_headers(response, etag)
+        return response
+    return wrapper
+
+
+class ConditionalGetMixin:
+    """
+    เพิ่ม ETag ให้ list และ retrieve ของ viewset
+    viewset ต้องระบุ etag_models เป็น models ทั้งหมดที่ข้อมูลของ response ขึ้นอยู่กับ
+    """
+    etag_models = ()
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
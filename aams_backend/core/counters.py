@@ -0,0 +1,236 @@
+# aams_backend/core/counters.py
+
+"""
+ตัวนับสรุปที่ถูกอัปเดตทีละรายการ (แทนการ COUNT ทุกครั้งที่อ่าน)
+
+- Role.user_count        = UserRole ที่ active ของผู้ใช้ที่ active
+- Role.permission_count  = RolePermission ที่ active ของ permission ที่ active
+- Project.user_count     = AgentProjectAssignment ที่ active ของผู้ใช้ที่ active
+- DepartmentSummary      = จำนวนผู้ใช้ทั้งหมด/ที่ active ในแต่ละแผนก
+
+signals (core/signals.py) เรียกฟังก์ชัน apply_* ด้วยค่าเดิมและค่าใหม่ของแถวที่เปลี่ยน
+ซึ่งอัปเดตด้วย F() ภายใน transaction เดียวกับการบันทึก
+งานแบบ bulk ที่ใช้ update() ต้องเรียก refresh_* เอง และ reconcile() ใช้ตรวจ/แก้ค่าที่คลาดเคลื่อน
+แถวที่ตัวนับเปลี่ยนจะถูกบันทึกใน core/change_tracking.py ด้วย (สำหรับ ETag และ ?updated_since=)
+"""
+
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import change_tracking
+from .models import (
+    AgentProjectAssignment, DepartmentSummary, Permission, Project, Role, RolePermission, User, UserRole
+)
+
+
+def _add(queryset, field, delta):
+    # ไม่ให้ค่าติดลบ ถ้าคลาดเคลื่อน reconcile() จะแก้ให้
+    ids = list(queryset.values_list('pk', flat=True))
+    if ids:
+        queryset.model.objects.filter(pk__in=ids).update(**{field: Greatest(F(field) + delta, Value(0))})
+        change_tracking.mark_changed(queryset.model, ids)
+
+
+def _active_user_exists(user_id):
+    return Exists(User.objects.filter(pk=user_id, is_active=True))
+
+
+def apply_user_role_change(old, new):
+    """old/new คือ (user_id, role_id, is_active) ก่อนและหลังบันทึก (None ถ้าไม่มี)"""
+    if old == new:
+        return
+    for values, delta in ((old, -1), (new, 1)):
+        if values and values[2] and values[0] is not None:
+            user_id, role_id, _ = values
+            _add(Role.objects.filter(_active_user_exists(user_id), pk=role_id), 'user_count', delta)
+
+
+def apply_role_permission_change(old, new):
+    """old/new คือ (role_id, permission_id, is_active) ก่อนและหลังบันทึก (None ถ้าไม่มี)"""
+    if old == new:
+        return
+    for values, delta in ((old, -1), (new, 1)):
+        if values and values[2]:
+            role_id, permission_id, _ = values
+            active_permission = Exists(Permission.objects.filter(pk=permission_id, is_active=True))
+            _add(Role.objects.filter(active_permission, pk=role_id), 'permission_count', delta)
+
+
+def apply_project_assignment_change(old, new):
+    """old/new คือ (agent_id, project_id, is_active) ก่อนและหลังบันทึก (None ถ้าไม่มี)"""
+    if old == new:
+        return
+    for values, delta in ((old, -1), (new, 1)):
+        if values and values[2] and values[0] is not None:
+            agent_id, project_id, _ = values
+            _add(Project.objects.filter(_active_user_exists(agent_id), pk=project_id), 'user_count', delta)
+
+
+def _add_department(department, total_delta, active_delta):
+    department = department or ''
+    DepartmentSummary.objects.bulk_create([DepartmentSummary(department=department)], ignore_conflicts=True)
+    summary = DepartmentSummary.objects.filter(department=department)
+    if total_delta:
+        _add(summary, 'total_users', total_delta)
+    if active_delta:
+        _add(summary, 'active_users', active_delta)
+
+
+def apply_user_change(old, new):
+    """old/new คือ (is_active, department) ของผู้ใช้ก่อนและหลังบันทึก (None ถ้าไม่มี)"""
+    if old == new:
+        return
+    for values, delta in ((old, -1), (new, 1)):
+        if values:
+            is_active, department = values
+            _add_department(department, delta, delta if is_active else 0)
+
+
+def apply_user_activation(user_id, is_active):
+    """ผู้ใช้ถูกเปิด/ปิดการใช้งาน: ปรับตัวนับของ roles และโครงการที่ผู้ใช้อยู่"""
+    delta = 1 if is_active else -1
+    _add(
+        Role.objects.filter(user_roles__user_id=user_id, user_roles__is_active=True),
+        'user_count', delta
+    )
+    _add(
+        Project.objects.filter(agent_assignments__agent_id=user_id, agent_assignments__is_active=True),
+        'user_count', delta
+    )
+
+
+def apply_permission_activation(permission_id, is_active):
+    """permission ถูกเปิด/ปิดการใช้งาน: ปรับ permission_count ของ roles ที่มี permission นี้"""
+    _add(
+        Role.objects.filter(role_permissions__permission_id=permission_id, role_permissions__is_active=True),
+        'permission_count', 1 if is_active else -1
+    )
+
+
+def _count(queryset, outer_field):
+    """subquery นับจำนวนแถวของ queryset ที่ outer_field ตรงกับแถวภายนอก"""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{outer_field: OuterRef('pk')})
+            .order_by().values(outer_field)
+            .annotate(count=Count('*')).values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def role_user_count():
+    return _count(UserRole.objects.filter(is_active=True, user__is_active=True), 'role_id')
+
+
+def role_permission_count():
+    return _count(RolePermission.objects.filter(is_active=True, permission__is_active=True), 'role_id')
+
+
+def project_user_count():
+    return _count(AgentProjectAssignment.objects.filter(is_active=True, agent__is_active=True), 'project_id')
+
+
+def refresh_role_counts(role_ids=None):
+    """นับตัวนับของ roles ใหม่จากข้อมูลจริง (ใช้หลัง bulk update ที่ไม่ผ่าน signals)"""
+    if role_ids is None:
+        role_ids = Role.objects.values_list('id', flat=True)
+    role_ids = list(role_ids)
+    update_role_counts(role_ids)
+    change_tracking.mark_changed(Role, role_ids)
+
+
+def update_role_counts(role_ids):
+    """
+    นับตัวนับของ roles ใหม่โดยไม่บันทึก change log (ผู้เรียกต้องเรียก mark_changed ของ Role เอง
+    เช่น รวมกับตารางอื่นใน change_tracking.mark_many_changed)
+    """
+    Role.objects.filter(id__in=role_ids).update(
+        user_count=role_user_count(), permission_count=role_permission_count()
+    )
+
+
+def refresh_project_counts(project_ids=None):
+    """นับตัวนับของโครงการใหม่จากข้อมูลจริง"""
+    if project_ids is None:
+        project_ids = Project.objects.values_list('id', flat=True)
+    project_ids = list(project_ids)
+    Project.objects.filter(id__in=project_ids).update(user_count=project_user_count())
+    change_tracking.mark_changed(Project, project_ids)
+
+
+def _department_counts():
+    rows = User.objects.order_by().values('department').annotate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True))
+    ).values_list('department', 'total', 'active')
+    counts = {}
+    for department, total, active in rows:
+        # None และ '' นับรวมกัน
+        previous_total, previous_active = counts.get(department or '', (0, 0))
+        counts[department or ''] = (previous_total + total, previous_active + active)
+    return counts
+
+
+def reconcile(apply=True):
+    """
+    เทียบตัวนับทั้งหมดกับข้อมูลจริงด้วย aggregate แบบ bulk
+    คืนค่า list ของ (ประเภท, ชื่อ, ฟิลด์, ค่าที่เก็บไว้, ค่าจริง) ที่ไม่ตรงกัน
+    ถ้า apply=True จะแก้ค่าที่ไม่ตรงกันด้วย
+    """
+    drift = []
+
+    roles = Role.objects.annotate(
+        actual_user_count=role_user_count(),
+        actual_permission_count=role_permission_count()
+    ).values_list('id', 'name', 'user_count', 'actual_user_count', 'permission_count', 'actual_permission_count')
+    drifted_role_ids = []
+    for role_id, name, user_count, actual_users, permission_count, actual_permissions in roles:
+        if user_count != actual_users:
+            drift.append(('role', name, 'user_count', user_count, actual_users))
+        if permission_count != actual_permissions:
+            drift.append(('role', name, 'permission_count', permission_count, actual_permissions))
+        if user_count != actual_users or permission_count != actual_permissions:
+            drifted_role_ids.append(role_id)
+
+    projects = Project.objects.annotate(
+        actual_user_count=project_user_count()
+    ).values_list('id', 'name', 'user_count', 'actual_user_count')
+    drifted_project_ids = []
+    for project_id, name, user_count, actual_users in projects:
+        if user_count != actual_users:
+            drift.append(('project', name, 'user_count', user_count, actual_users))
+            drifted_project_ids.append(project_id)
+
+    actual_departments = _department_counts()
+    stored_departments = {
+        department: (total, active)
+        for department, total, active in DepartmentSummary.objects.values_list(
+            'department', 'total_users', 'active_users'
+        )
+    }
+    for department in sorted(actual_departments.keys() | stored_departments.keys()):
+        stored = stored_departments.get(department, (0, 0))
+        actual = actual_departments.get(department, (0, 0))
+        for field, stored_value, actual_value in zip(('total_users', 'active_users'), stored, actual):
+            if stored_value != actual_value:
+                drift.append(('department', department, field, stored_value, actual_value))
+
+    if apply and drift:
+        if drifted_role_ids:
+            refresh_role_counts(drifted_role_ids)
+        if drifted_project_ids:
+            refresh_project_counts(drifted_project_ids)
+        DepartmentSummary.objects.bulk_create(
+            [
+                DepartmentSummary(department=department, total_users=total, active_users=active)
+                for department, (total, active) in actual_departments.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['department'],
+            update_fields=['total_users', 'active_users'],
+        )
+        DepartmentSummary.objects.exclude(department__in=actual_departments.keys()).delete()
+
+    return drift
@@ -0,0 +1,107 @@
+# aams_backend/core/dashboard.py
+
+"""
+สถิติสำหรับหน้า Dashboard (จำนวนผู้ใช้, โครงการ และผู้ใช้ตาม role)
+
+- คำนวณด้วย aggregate/GROUP BY 3 queries ไม่ว่าข้อมูลจะมีขนาดเท่าใด
+  (staff: จำนวนผู้ใช้และรายแผนกอ่านจากตาราง DepartmentSummary ที่ signals อัปเดตไว้)
+- เก็บใน cache อายุสั้นแยกตามขอบเขตของผู้เรียก (staff เห็นทั้งหมด ผู้ใช้ทั่วไปเห็นเฉพาะของตัวเอง)
+- single-flight: เมื่อ cache หมดอายุ มีเพียง request เดียวที่คำนวณใหม่ request อื่นรอผลจาก cache
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import project_access
+from .models import DepartmentSummary, Project, User, UserRole
+
+STATS_KEY = 'dashboard:stats:{scope}'
+LOCK_KEY = 'dashboard:stats:{scope}:lock'
+LOCK_TIMEOUT = 10  # วินาที
+WAIT_INTERVAL = 0.05
+
+
+def _get_timeout():
+    return getattr(settings, 'AAMS_DASHBOARD_CACHE_TIMEOUT', 30)
+
+
+def get_scope(user):
+    return 'all' if user.is_superuser or user.is_staff else f'user:{user.pk}'
+
+
+def compute_stats(user):
+    """คำนวณสถิติตามขอบเขตเดียวกับ UserViewSet และ ProjectViewSet"""
+    users = User.objects.all()
+    projects = Project.objects.all()
+    department_stats = None
+    if user.is_superuser or user.is_staff:
+        department_stats = {
+            summary.department: {'total': summary.total_users, 'active': summary.active_users}
+            for summary in DepartmentSummary.objects.filter(total_users__gt=0)
+        }
+        user_counts = {
+            'total': sum(stats['total'] for stats in department_stats.values()),
+            'active': sum(stats['active'] for stats in department_stats.values()),
+        }
+    else:
+        users = users.filter(id=user.pk)
+        projects = projects.filter(project_access.accessible_projects_filter(user))
+        user_counts = users.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(is_active=True))
+        )
+    project_counts = projects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True))
+    )
+    role_counts = (
+        UserRole.objects.filter(is_active=True, role__is_active=True, user__in=users)
+        .order_by()
+        .values_list('role__name')
+        .annotate(count=Count('id'))
+    )
+
+    stats = {
+        'total_users': user_counts['total'],
+        'active_users': user_counts['active'],
+        'inactive_users': user_counts['total'] - user_counts['active'],
+        'total_projects': project_counts['total'],
+        'active_projects': project_counts['active'],
+        'inactive_projects': project_counts['total'] - project_counts['active'],
+        'role_stats': dict(role_counts),
+    }
+    if department_stats is not None:
+        stats['department_stats'] = department_stats
+    return stats
+
+
+def get_stats(user):
+    """ดึงสถิติจาก cache ถ้าไม่มีจะคำนวณใหม่ (ครั้งละ request เดียวต่อขอบเขต)"""
+    scope = get_scope(user)
+    key = STATS_KEY.format(scope=scope)
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    lock_key = LOCK_KEY.format(scope=scope)
+    if cache.add(lock_key, True, LOCK_TIMEOUT):
+        try:
+            stats = compute_stats(user)
+            cache.set(key, stats, _get_timeout())
+        finally:
+            cache.delete(lock_key)
+        return stats
+
+    # มี request อื่นกำลังคำนวณอยู่ รอผลจาก cache (ถ้าเกินเวลาให้คำนวณเอง)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        stats = cache.get(key)
+        if stats is not None:
+            return stats
+        if cache.get(lock_key) is None:
+            break
+    return compute_stats(user)
@@ -0,0 +1,146 @@
+# aams_backend/core/delta_sync.py
+
+"""
+?updated_since= สำหรับรายการของ viewsets ใน core: ส่งเฉพาะแถวที่เปลี่ยนหลังจุดที่ระบุ
+(อ่านจากตาราง core_change_log ที่ signals เขียนไว้ ดู core/change_tracking.py)
+
+updated_since เป็น cursor (next_cursor จาก response ก่อนหน้า) หรือเวลาแบบ ISO 8601
+response:
+    {
+        "results": [...แถวที่เปลี่ยนและผู้ใช้ยังเห็นได้...],
+        "deleted": [...id ของแถวที่ถูกลบ หรือผู้ใช้ไม่เห็นแล้ว เช่น ถูกปิดการใช้งาน...],
+        "next_cursor": "1234",
+        "has_more": false
+    }
+client เก็บข้อมูลไว้เองแล้วเรียกซ้ำด้วย next_cursor (ถ้า has_more เป็น true ให้เรียกต่อทันที)
+updated_since=latest คืนค่าเฉพาะ next_cursor ของปัจจุบัน ให้ client ขอก่อนดึงรายการครั้งแรก
+ถ้าได้ 410 แปลว่า cursor เก่ากว่าบันทึกที่เก็บไว้ ต้องดึงรายการทั้งหมดใหม่
+
+บันทึกถูกเขียนหลังข้อมูล commit แล้ว (ไม่ขึ้นกับความยาวของ transaction ที่แก้ข้อมูล)
+บันทึกที่อายุน้อยกว่า AAMS_SYNC_SETTLE_SECONDS จะยังไม่ถูกส่ง เพื่อไม่ให้ cursor
+ข้าม INSERT ของ process อื่นที่ได้ id ก่อนแต่ commit ทีหลังเล็กน้อย
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.response import Response
+
+from .change_tracking import table_name
+from .models import ChangeLog
+
+
+def _get_settings():
+    return (
+        getattr(settings, 'AAMS_SYNC_MAX_CHANGES', 1000),
+        getattr(settings, 'AAMS_SYNC_SETTLE_SECONDS', 2),
+        getattr(settings, 'AAMS_CHANGE_LOG_RETENTION_DAYS', 30),
+    )
+
+
+def parse_updated_since(value):
+    """คืนค่า (cursor, เวลา) ตัวใดตัวหนึ่งเป็น None, ValueError ถ้ารูปแบบไม่ถูกต้อง"""
+    if value.isdigit():
+        return int(value), None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return None, parsed
+
+
+def is_expired(cursor, since, retention_days):
+    """cursor/เวลาเก่ากว่าบันทึกที่ยังเก็บไว้ (ถูก prune_change_log ลบไปแล้ว)"""
+    if since is not None:
+        return since < timezone.now() - timedelta(days=retention_days)
+    oldest_id = ChangeLog.objects.aggregate(oldest=Min('id'))['oldest']
+    return oldest_id is not None and cursor < oldest_id - 1
+
+
+def get_latest_cursor():
+    """id ของบันทึกล่าสุดที่พ้นช่วง settle แล้ว (ทุกตารางใช้ลำดับ id เดียวกัน)"""
+    _, settle_seconds, _ = _get_settings()
+    latest_id = ChangeLog.objects.filter(
+        changed_at__lte=timezone.now() - timedelta(seconds=settle_seconds)
+    ).aggregate(latest=Max('id'))['latest']
+    return latest_id or 0
+
+
+def get_changes(model, cursor=None, since=None):
+    """
+    ดึงสถานะล่าสุดของแต่ละแถวที่เปลี่ยน คืนค่า ({object_id: deleted}, id ของบันทึกล่าสุด, has_more)
+    """
+    limit, settle_seconds, _ = _get_settings()
+    entries = ChangeLog.objects.filter(
+        table=table_name(model),
+        changed_at__lte=timezone.now() - timedelta(seconds=settle_seconds)
+    )
+    if cursor is not None:
+        entries = entries.filter(id__gt=cursor)
+    else:
+        entries = entries.filter(changed_at__gt=since)
+
+    rows = list(entries.order_by('id').values_list('id', 'object_id', 'deleted')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for _, object_id, deleted in rows:
+        latest[object_id] = deleted
+    last_id = rows[-1][0] if rows else None
+    return latest, last_id, has_more
+
+
+def delta_response(view, updated_since):
+    if updated_since == 'latest':
+        return Response({
+            'results': [],
+            'deleted': [],
+            'next_cursor': str(get_latest_cursor()),
+            'has_more': False,
+        })
+    try:
+        cursor, since = parse_updated_since(updated_since)
+    except ValueError:
+        return Response(
+            {'error': 'updated_since ต้องเป็น cursor (ตัวเลข) หรือเวลาในรูปแบบ ISO 8601'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    _, _, retention_days = _get_settings()
+    if is_expired(cursor, since, retention_days):
+        return Response(
+            {'error': 'updated_since เก่าเกินไป กรุณาดึงรายการทั้งหมดใหม่'},
+            status=status.HTTP_410_GONE
+        )
+
+    queryset = view.filter_queryset(view.get_queryset())
+    latest, last_id, has_more = get_changes(queryset.model, cursor, since)
+
+    changed_ids = [object_id for object_id, deleted in latest.items() if not deleted]
+    rows = list(queryset.filter(pk__in=changed_ids)) if changed_ids else []
+    visible_ids = {row.pk for row in rows}
+    # แถวที่เปลี่ยนแต่ไม่อยู่ใน queryset ของผู้ใช้แล้ว (ถูกปิดการใช้งาน/หมดสิทธิ์) ส่งเป็น tombstone
+    deleted_ids = sorted(object_id for object_id in latest if object_id not in visible_ids)
+
+    return Response({
+        'results': view.get_serializer(rows, many=True).data,
+        'deleted': deleted_ids,
+        'next_cursor': str(last_id) if last_id is not None else updated_since,
+        'has_more': has_more,
+    })
+
+
+class DeltaSyncMixin:
+    """เพิ่ม ?updated_since= ให้ list ของ viewset (ดูรูปแบบ response ด้านบน)"""
+
+    def list(self, request, *args, **kwargs):
+        updated_since = request.query_params.get('updated_since')
+        if updated_since is None:
+            return super().list(request, *args, **kwargs)
+        return delta_response(self, updated_since)
@@ -0,0 +1,124 @@
+# aams_backend/core/effective_permissions.py
+
+"""
+ดูแลตาราง core_effective_permission (user, permission, source_role, expires_at)
+
+ฟังก์ชัน refresh_* จะลบแถวในขอบเขตที่ระบุ แล้วสร้างใหม่ด้วย INSERT ... SELECT คำสั่งเดียว
+(set-based SQL) จาก core_user_role, core_role, core_role_closure, core_role_permission และ core_permission
+permissions ที่สืบทอดจาก role แม่จะมี source_role เป็น role ที่ผู้ใช้ได้รับโดยตรง
+
+เมื่อ permissions ของ role เปลี่ยน (RolePermission) ใช้ grant_/revoke_role_permissions ซึ่งแตะเฉพาะแถว
+ของ permissions ที่เปลี่ยน ไม่ต้องสร้างแถวของสมาชิกทุกคนใน roles ที่สืบทอดใหม่ทั้งหมด
+"""
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import EffectivePermission
+
+INSERT_EFFECTIVE_PERMISSIONS_SQL = """
+    INSERT INTO core_effective_permission (user_id, permission_id, source_role_id, expires_at)
+    SELECT DISTINCT ur.user_id, rp.permission_id, ur.role_id, ur.expires_at
+    FROM core_user_role ur
+    INNER JOIN core_role r ON r.id = ur.role_id
+    INNER JOIN core_role_closure c ON c.descendant_id = ur.role_id
+    INNER JOIN core_role ar ON ar.id = c.ancestor_id
+    INNER JOIN core_role_permission rp ON rp.role_id = c.ancestor_id
+    INNER JOIN core_permission p ON p.id = rp.permission_id
+    WHERE ur.is_active = %s
+      AND r.is_active = %s
+      AND ar.is_active = %s
+      AND rp.is_active = %s
+      AND p.is_active = %s
+      AND (ur.expires_at IS NULL OR ur.expires_at > %s)
+      {scope}
+    ON CONFLICT (user_id, permission_id, source_role_id) DO NOTHING
+"""
+
+
+REVOKE_ROLE_PERMISSIONS_SQL = """
+    DELETE FROM core_effective_permission
+    WHERE permission_id IN ({placeholders})
+      AND source_role_id IN (SELECT descendant_id FROM core_role_closure WHERE ancestor_id = %s)
+      AND NOT EXISTS (
+          SELECT 1
+          FROM core_role_closure c
+          INNER JOIN core_role ar ON ar.id = c.ancestor_id
+          INNER JOIN core_role_permission rp ON rp.role_id = c.ancestor_id
+          WHERE c.descendant_id = core_effective_permission.source_role_id
+            AND rp.permission_id = core_effective_permission.permission_id
+            AND ar.is_active = %s
+            AND rp.is_active = %s
+      )
+"""
+
+
+def _in(column, ids):
+    return f"AND {column} IN ({', '.join(['%s'] * len(ids))})"
+
+
+# ON CONFLICT: transaction อื่นที่คำนวณผู้ใช้คนเดียวกันพร้อมกันอาจ commit แถวเดียวกันไปแล้ว
+# หลังจาก DELETE ของเราเริ่มทำงาน (เช่น admin สองคนกำหนด role คนละตัวให้ผู้ใช้คนเดียวกัน)
+def _insert(scope='', scope_params=()):
+    params = [True, True, True, True, True, timezone.now(), *scope_params]
+    with connection.cursor() as cursor:
+        cursor.execute(INSERT_EFFECTIVE_PERMISSIONS_SQL.format(scope=scope), params)
+
+
+def _refresh(filter_field, scope_column, ids):
+    ids = list(set(ids))
+    if not ids:
+        return
+    with transaction.atomic():
+        EffectivePermission.objects.filter(**{f'{filter_field}__in': ids}).delete()
+        _insert(_in(scope_column, ids), ids)
+
+
+def refresh_users(user_ids):
+    """คำนวณ effective permissions ของผู้ใช้ที่ระบุใหม่"""
+    _refresh('user_id', 'ur.user_id', user_ids)
+
+
+def refresh_roles(role_ids):
+    """
+    คำนวณ effective permissions ที่มาจาก roles ที่ระบุใหม่
+    (ถ้า permissions ของ role แม่เปลี่ยน ต้องส่ง id ของ roles ที่สืบทอดมาด้วย)
+    """
+    _refresh('source_role_id', 'ur.role_id', role_ids)
+
+
+def refresh_permissions(permission_ids):
+    """คำนวณ effective permissions ของ permissions ที่ระบุใหม่"""
+    _refresh('permission_id', 'rp.permission_id', permission_ids)
+
+
+def grant_role_permissions(role_id, permission_ids):
+    """
+    เพิ่มแถวของ permissions ที่เพิ่งกำหนดให้ role ให้กับสมาชิกของ role และ roles ที่สืบทอดจาก role นี้
+    (แถวที่มีอยู่แล้วจากการสืบทอดทางอื่นถูกข้ามด้วย ON CONFLICT)
+    """
+    permission_ids = list(set(permission_ids))
+    if permission_ids:
+        _insert(f"AND rp.role_id = %s {_in('rp.permission_id', permission_ids)}", [role_id, *permission_ids])
+
+
+def revoke_role_permissions(role_id, permission_ids):
+    """
+    ลบแถวของ permissions ที่ถูกนำออกจาก role สำหรับ role และ roles ที่สืบทอดจาก role นี้
+    ยกเว้นแถวที่ source_role ยังได้รับ permission เดียวกันจาก role แม่ตัวอื่นที่ active
+    """
+    permission_ids = list(set(permission_ids))
+    if permission_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                REVOKE_ROLE_PERMISSIONS_SQL.format(placeholders=', '.join(['%s'] * len(permission_ids))),
+                [*permission_ids, role_id, True, True]
+            )
+
+
+def rebuild_all():
+    """สร้างตาราง core_effective_permission ใหม่ทั้งหมด คืนค่าจำนวนแถว"""
+    with transaction.atomic():
+        EffectivePermission.objects.all().delete()
+        _insert()
+    return EffectivePermission.objects.count()
@@ -0,0 +1,164 @@
+# aams_backend/core/event_stream.py
+
+"""
+GET /api/events/ : Server-Sent Events ของการเปลี่ยนแปลง roles, permissions, ผู้ใช้, การมอบหมาย และโปรเจค
+
+- ต้องรันผ่าน ASGI (aams_backend/asgi.py เช่น uvicorn หรือ daphne) แต่ละการเชื่อมต่อใช้เพียง
+  coroutine หนึ่งตัวที่รอ queue อยู่ ไม่มีการ query ฐานข้อมูลระหว่างรอ
+- EventSource ของ browser ส่ง header ไม่ได้ จึงขอ ticket จาก POST /api/events/ticket/ ก่อน
+  แล้วเชื่อมต่อด้วย ?ticket= (ไม่ส่ง access token ใน URL ซึ่งจะถูกบันทึกใน access log ของ proxy/server)
+  ticket ใช้ได้ครั้งเดียว อายุ AAMS_EVENTS_TICKET_SECONDS วินาที และใช้เรียก API อื่นไม่ได้
+  client อื่นที่ส่ง header ได้ใช้ Authorization: Bearer <access token> ได้เหมือนเดิม
+- การเชื่อมต่อจะถูกปิดเมื่อ access token (ที่ใช้ขอ ticket) หมดอายุ client ต้องเชื่อมต่อใหม่ด้วย ticket ใหม่
+- รูปแบบ event:
+    event: change
+    data: {"resource": "roles", "type": "changed", "ids": [1, 2]}
+  type เป็น changed, deleted หรือ resync (ให้ดึงข้อมูลทั้งหมดใหม่)
+  client ใช้ ?updated_since= ของ resource นั้นดึงเฉพาะส่วนที่เปลี่ยน (core/delta_sync.py)
+"""
+
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import permissions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import Token
+
+from .events import Subscriber, broadcaster, get_backend
+from .models import User
+
+# เวลาหมดอายุ (epoch) ของการเชื่อมต่อที่เปิดด้วย ticket = exp ของ access token ที่ใช้ขอ ticket
+STREAM_EXP_CLAIM = 'stream_exp'
+USED_TICKET_KEY = 'events:ticket:{jti}'
+
+
+def _get_settings():
+    return (
+        getattr(settings, 'AAMS_EVENTS_QUEUE_SIZE', 100),
+        getattr(settings, 'AAMS_EVENTS_HEARTBEAT_SECONDS', 20),
+    )
+
+
+class StreamTicket(Token):
+    """
+    ticket อายุสั้นสำหรับเปิด GET /api/events/ เท่านั้น
+    (token_type ไม่ใช่ access จึงใช้ยืนยันตัวตนกับ API อื่นไม่ได้)
+    """
+    token_type = 'event_stream'
+    lifetime = timedelta(seconds=getattr(settings, 'AAMS_EVENTS_TICKET_SECONDS', 30))
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def event_ticket(request):
+    """
+    ออก ticket สำหรับเชื่อมต่อ /api/events/?ticket= (ใช้ได้ครั้งเดียว)
+    """
+    ticket = StreamTicket.for_user(request.user)
+    if request.auth is not None and 'exp' in request.auth:
+        ticket[STREAM_EXP_CLAIM] = request.auth['exp']
+    else:
+        ticket[STREAM_EXP_CLAIM] = int(time.time() + jwt_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+    return Response({'ticket': str(ticket), 'expires_in': int(StreamTicket.lifetime.total_seconds())})
+
+
+def authenticate(raw_token):
+    """
+    ตรวจสอบ access token ด้วย authentication class ของ API
+    คืนค่า (user, เวลาหมดอายุของการเชื่อมต่อ)
+    """
+    authenticator = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+    validated_token = authenticator.get_validated_token(raw_token.encode())
+    return authenticator.get_user(validated_token), validated_token['exp']
+
+
+def authenticate_ticket(raw_ticket):
+    """
+    ตรวจสอบ ticket (ลายเซ็น, อายุ, ชนิด) และทำเครื่องหมายว่าใช้แล้ว
+    คืนค่า (user, เวลาหมดอายุของการเชื่อมต่อ)
+    """
+    ticket = StreamTicket(raw_ticket)
+    # cache.add ไม่เขียนทับ key ที่มีอยู่ ticket เดิมจึงเปิดการเชื่อมต่อได้ครั้งเดียว
+    if not cache.add(USED_TICKET_KEY.format(jti=ticket[jwt_settings.JTI_CLAIM]), True, StreamTicket.lifetime.total_seconds()):
+        raise InvalidToken('ticket นี้ถูกใช้ไปแล้ว')
+    try:
+        user = User.objects.get(**{jwt_settings.USER_ID_FIELD: ticket[jwt_settings.USER_ID_CLAIM]})
+    except User.DoesNotExist:
+        raise AuthenticationFailed('ไม่พบผู้ใช้')
+    if not user.is_active:
+        raise AuthenticationFailed('ผู้ใช้ถูกปิดการใช้งาน')
+    return user, ticket[STREAM_EXP_CLAIM]
+
+
+def format_event(event):
+    data = {key: value for key, value in event.items() if key != 'audience'}
+    return f"event: change\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_events(subscriber, expires_at, heartbeat):
+    # ลงทะเบียนเมื่อเริ่มส่ง stream จริงเท่านั้น ถ้า client ตัดการเชื่อมต่อก่อน generator เริ่มทำงาน
+    # จะไม่มี subscriber ค้างอยู่ (unsubscribe อยู่ใน finally ของ generator นี้)
+    broadcaster.subscribe(subscriber)
+    try:
+        # ส่ง comment แรกทันทีเพื่อให้ proxy/browser เริ่มรับ stream
+        yield 'retry: 5000\n: connected\n\n'
+        while True:
+            timeout = min(heartbeat, expires_at - time.time())
+            if timeout <= 0:
+                # token หมดอายุ ให้ client เชื่อมต่อใหม่ด้วย token ใหม่
+                yield 'event: token_expired\ndata: {}\n\n'
+                return
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def event_stream(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if not hasattr(request, 'scope'):
+        return JsonResponse({'error': '/api/events/ ต้องรันผ่าน ASGI (aams_backend.asgi)'}, status=501)
+
+    header = request.headers.get('Authorization', '')
+    raw_ticket = request.GET.get('ticket')
+    try:
+        if header.startswith('Bearer '):
+            user, expires_at = await sync_to_async(authenticate)(header[len('Bearer '):])
+        elif raw_ticket:
+            user, expires_at = await sync_to_async(authenticate_ticket)(raw_ticket)
+        else:
+            return JsonResponse({'error': 'ต้องระบุ ticket หรือ access token'}, status=401)
+    except (InvalidToken, AuthenticationFailed, TokenError) as e:
+        return JsonResponse({'error': str(e)}, status=401)
+
+    queue_size, heartbeat = _get_settings()
+    await sync_to_async(get_backend().start)()
+    subscriber = Subscriber(
+        (user.pk, user.is_staff or user.is_superuser),
+        asyncio.get_running_loop(),
+        asyncio.Queue(maxsize=queue_size)
+    )
+
+    response = StreamingHttpResponse(
+        stream_events(subscriber, expires_at, heartbeat),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # ปิด buffering ของ nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,246 @@
+# aams_backend/core/events.py
+
+"""
+กระจาย event การเปลี่ยนแปลงข้อมูลไปยัง client ที่เชื่อมต่อ /api/events/ ไว้ (core/event_stream.py)
+
+- change_tracking.mark_changed() เรียก publish() ทุกครั้งที่มีแถวเปลี่ยน event จะถูกส่งหลัง commit
+- Broadcaster ในแต่ละ process ส่ง event เข้า queue (จำกัดขนาด) ของ client แต่ละราย
+  ถ้า client อ่านไม่ทัน queue จะถูกล้างและแทนด้วย event "resync" ให้ client ดึงข้อมูลใหม่ทั้งหมด
+- backend สำหรับส่ง event ข้าม process เลือกได้ด้วย settings.AAMS_EVENTS_BACKEND
+    core.events.LocalBackend     ส่งภายใน process เดียว (ค่าเริ่มต้น, ใช้ตอนพัฒนา/ทดสอบ)
+    core.events.PostgresBackend  ส่งผ่าน PostgreSQL LISTEN/NOTIFY ให้ทุก process ที่เชื่อมต่อฐานข้อมูลเดียวกัน
+- event มี audience เป็น id ของผู้ใช้ที่เห็นข้อมูลนั้นได้ (None = ผู้ใช้ที่ login ทุกคน)
+  staff และ superuser ได้รับทุก event
+- event ที่ใหญ่เกิน MAX_EVENT_BYTES ถูกแทนด้วย {"resource": ..., "type": "refetch"} (ไม่มี ids/audience)
+  ให้ client ดึงข้อมูลของ resource นั้นใหม่ทั้งหมด
+"""
+
+import json
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from .models import AgentProjectAssignment, Permission, Project, Role, RolePermission, User, UserRole
+
+logger = logging.getLogger(__name__)
+
+# ชื่อ resource ใน event ตรงกับ path ของ API
+RESOURCES = {
+    Role: 'roles',
+    Permission: 'permissions',
+    RolePermission: 'role-permissions',
+    UserRole: 'user-roles',
+    User: 'users',
+    Project: 'projects',
+    AgentProjectAssignment: 'project-assignments',
+}
+
+# จำนวน id สูงสุดต่อ event
+MAX_IDS_PER_EVENT = 200
+# ขนาดสูงสุดของ event หลังแปลงเป็น JSON (payload ของ NOTIFY ต้องไม่เกิน 8000 bytes)
+# event ที่ใหญ่กว่านี้ (เช่น audience ของ Project คือ agents จำนวนมาก) ถูกแทนด้วย event "refetch"
+MAX_EVENT_BYTES = 7500
+
+
+def get_audience(model, ids):
+    """id ของผู้ใช้ที่เห็นแถวเหล่านี้ได้ (None = ทุกคน) ใช้เมื่อผู้เรียกไม่ได้ระบุเอง"""
+    if model is User:
+        return list(ids)
+    if model is UserRole:
+        return list(UserRole.objects.filter(id__in=ids).values_list('user_id', flat=True).distinct())
+    if model is AgentProjectAssignment:
+        return list(
+            AgentProjectAssignment.objects.filter(id__in=ids).values_list('agent_id', flat=True).distinct()
+        )
+    if model is Project:
+        return list(
+            AgentProjectAssignment.objects.filter(project_id__in=ids, is_active=True)
+            .values_list('agent_id', flat=True).distinct()
+        )
+    return None
+
+
+def can_receive(user_info, event):
+    """user_info คือ (user_id, is_staff) ของผู้เชื่อมต่อ"""
+    user_id, is_staff = user_info
+    audience = event.get('audience')
+    return is_staff or audience is None or user_id in audience
+
+
+class Subscriber:
+    """client หนึ่งรายที่เชื่อมต่ออยู่ (อ่าน event จาก queue ใน event loop ของตัวเอง)"""
+
+    def __init__(self, user_info, loop, queue):
+        self.user_info = user_info
+        self.loop = loop
+        self.queue = queue
+
+    def offer(self, event):
+        # ทำงานใน event loop ของ subscriber (ผ่าน call_soon_threadsafe)
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {'resource': None, 'type': 'resync'}
+        self.queue.put_nowait(event)
+
+
+class Broadcaster:
+    """รายชื่อ subscribers ของ process นี้"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def dispatch(self, event):
+        """ส่ง event ให้ subscribers ที่มีสิทธิ์เห็น (เรียกได้จากทุก thread)"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if can_receive(subscriber.user_info, event):
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+                except RuntimeError:
+                    # event loop ของ subscriber ถูกปิดไปแล้ว
+                    self.unsubscribe(subscriber)
+
+
+broadcaster = Broadcaster()
+
+
+class LocalBackend:
+    """ส่ง event ให้ subscribers ใน process เดียวกันเท่านั้น"""
+
+    def publish(self, event):
+        broadcaster.dispatch(event)
+
+    def start(self):
+        pass
+
+
+class PostgresBackend:
+    """
+    ส่ง event ผ่าน PostgreSQL NOTIFY และรับด้วย LISTEN ใน thread แยกของแต่ละ process
+    (ทดสอบได้กับ PostgreSQL ในเครื่อง: เปิดหลาย process แล้วเชื่อม /api/events/ คนละ process)
+    """
+
+    channel = 'aams_events'
+    reconnect_delay = 5  # วินาที
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def publish(self, event):
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, encode_event(event)])
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen_forever, name='aams-events', daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        params = connections['default'].get_connection_params()
+        params.pop('cursor_factory', None)
+        conn = psycopg2.connect(**params)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        return conn
+
+    def _listen_forever(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                # อาจพลาด event ระหว่างที่ขาดการเชื่อมต่อ ให้ client ดึงข้อมูลใหม่
+                broadcaster.dispatch({'resource': None, 'type': 'resync'})
+                while True:
+                    if select.select([conn], [], [], self.reconnect_delay) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        broadcaster.dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception('การรับ event ผ่าน LISTEN/NOTIFY ล้มเหลว จะเชื่อมต่อใหม่')
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.reconnect_delay)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'AAMS_EVENTS_BACKEND', 'core.events.LocalBackend')
+        _backend = import_string(backend_path)()
+    return _backend
+
+
+def encode_event(event):
+    return json.dumps(event, separators=(',', ':'))
+
+
+def send(backend, event):
+    """ส่ง event หลัง commit ข้อมูลถูกบันทึกไปแล้ว ความผิดพลาดตรงนี้จึงไม่ควรทำให้ request ล้มเหลว"""
+    try:
+        backend.publish(event)
+    except Exception:
+        logger.exception('ส่ง event %s ของ %s ไม่สำเร็จ', event.get('type'), event.get('resource'))
+
+
+def publish(model, ids, deleted=False, audience=None):
+    """
+    ส่ง event ว่าแถว ids ของ model เปลี่ยน หลัง transaction ปัจจุบัน commit
+    audience เป็น None จะคำนวณจากข้อมูลในฐานข้อมูล (ต้องระบุเองถ้าแถวถูกลบไปแล้ว)
+    """
+    resource = RESOURCES.get(model)
+    ids = list(ids)
+    if resource is None or not ids:
+        return
+
+    events = []
+    for start in range(0, len(ids), MAX_IDS_PER_EVENT):
+        chunk = ids[start:start + MAX_IDS_PER_EVENT]
+        chunk_audience = get_audience(model, chunk) if audience is None else audience
+        if chunk_audience is not None:
+            chunk_audience = sorted({user_id for user_id in chunk_audience if user_id is not None})
+        event = {
+            'resource': resource,
+            'type': 'deleted' if deleted else 'changed',
+            'ids': chunk,
+            'audience': chunk_audience,
+        }
+        if len(encode_event(event).encode()) > MAX_EVENT_BYTES:
+            # ส่งไม่ได้ทั้งหมด ให้ทุกคนดึง resource นี้ใหม่ครั้งเดียวแทน
+            events = [{'resource': resource, 'type': 'refetch'}]
+            break
+        events.append(event)
+
+    backend = get_backend()
+    for event in events:
+        transaction.on_commit(lambda event=event: send(backend, event))
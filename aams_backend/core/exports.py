@@ -0,0 +1,122 @@
+# aams_backend/core/exports.py
+
+"""
+ส่งออกรายชื่อผู้ใช้เป็น CSV (stream ทีละแถว) หรือ XLSX (xlsxwriter แบบ constant_memory)
+
+ข้อมูลถูกอ่านด้วย server-side cursor (QuerySet.iterator) ทีละ EXPORT_CHUNK_SIZE แถว
+และชื่อ roles ของผู้ใช้ถูกรวมใน query เดียวกันด้วย aggregate (ไม่มี query ต่อผู้ใช้)
+"""
+
+import csv
+import tempfile
+
+from django.db.models import Aggregate, CharField, Q
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_COLUMNS = [
+    ('Name', 'full_name'),
+    ('Username', 'username'),
+    ('Email', 'email'),
+    ('Employee ID', 'employee_id'),
+    ('Role', 'role_names'),
+    ('Status', 'is_active'),
+    ('Department', 'department'),
+    ('Position', 'position'),
+    ('Date Joined', 'date_joined'),
+]
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+class StringAgg(Aggregate):
+    """
+    รวมข้อความของหลายแถวคั่นด้วย ', ' (STRING_AGG ใน PostgreSQL, GROUP_CONCAT ใน SQLite)
+    """
+    function = 'STRING_AGG'
+    template = "%(function)s(%(expressions)s, ', ')"
+    output_field = CharField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='GROUP_CONCAT', **extra_context)
+
+
+def export_rows(queryset):
+    """
+    อ่านข้อมูลผู้ใช้สำหรับส่งออก คืนค่า iterator ของ dict (ไม่โหลดทั้งตารางเข้าหน่วยความจำ)
+    """
+    fields = [
+        'id', 'username', 'first_name', 'last_name', 'email', 'employee_id',
+        'is_active', 'department', 'position', 'date_joined',
+    ]
+    rows = queryset.order_by('-date_joined', 'id').values(*fields).annotate(
+        role_names=StringAgg(
+            'user_roles__role__name',
+            filter=Q(user_roles__is_active=True, user_roles__role__is_active=True)
+        )
+    )
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        date_joined = row['date_joined']
+        yield {
+            **row,
+            'full_name': f"{row['first_name'] or ''} {row['last_name'] or ''}".strip(),
+            'is_active': 'Active' if row['is_active'] else 'Inactive',
+            'date_joined': timezone.localtime(date_joined).date().isoformat() if date_joined else '',
+        }
+
+
+# ข้อความที่ขึ้นต้นด้วยอักขระเหล่านี้ Excel/LibreOffice จะตีความเป็นสูตร (CSV injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_cell(value):
+    """ใส่ ' หน้าข้อความที่ผู้ใช้กรอกเองซึ่งจะถูกตีความเป็นสูตรเมื่อเปิดใน spreadsheet"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class Echo:
+    """buffer ที่คืนค่าที่เขียนทันที สำหรับใช้กับ csv.writer ใน StreamingHttpResponse"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    # BOM ให้ Excel อ่านภาษาไทยได้ถูกต้อง
+    yield '\ufeff' + writer.writerow([header for header, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow([escape_cell(row[key] or '') for _, key in EXPORT_COLUMNS])
+
+
+def csv_response(queryset, filename):
+    response = StreamingHttpResponse(stream_csv(export_rows(queryset)), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def xlsx_response(queryset, filename):
+    """
+    สร้างไฟล์ XLSX แบบ constant_memory (เขียนทีละแถวลงไฟล์ชั่วคราว) แล้วส่งไฟล์แบบ stream
+    รูปแบบ XLSX เป็น zip ที่ต้องเขียนให้ครบก่อนส่ง จึง stream ระหว่างอ่านข้อมูลแบบ CSV ไม่ได้
+    (หน่วยความจำคงที่ แต่ใช้พื้นที่ดิสก์ตามขนาดไฟล์) ต้องติดตั้ง xlsxwriter
+    """
+    import xlsxwriter
+
+    output = tempfile.TemporaryFile()
+    # strings_to_formulas=False: เขียนข้อความที่ขึ้นต้นด้วย = เป็นข้อความ ไม่ใช่สูตร
+    workbook = xlsxwriter.Workbook(
+        output, {'constant_memory': True, 'in_memory': False, 'strings_to_formulas': False}
+    )
+    worksheet = workbook.add_worksheet('Users')
+    worksheet.write_row(0, 0, [header for header, _ in EXPORT_COLUMNS])
+    for row_number, row in enumerate(export_rows(queryset), start=1):
+        worksheet.write_row(row_number, 0, [row[key] or '' for _, key in EXPORT_COLUMNS])
+    workbook.close()
+
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=f'{filename}.xlsx', content_type=XLSX_CONTENT_TYPE)
@@ -0,0 +1,118 @@
+# aams_backend/core/group_sync.py
+
+"""
+ซิงค์ Role กับ Django Group แบบหน่วงเวลา (ไม่ทำใน request ที่แก้ไข permissions)
+
+- request_tree_sync(role) บันทึกงานลงตาราง core_group_sync_job (หนึ่งแถวต่อ role)
+  ใน transaction เดียวกับการแก้ไขข้อมูล การขอซิงค์ role เดิมหลายครั้งจึงรวมเป็นงานเดียว
+  (อัปเดต requested_at เป็นเวลาของคำขอล่าสุด) และงานไม่หายแม้ process จะหยุดก่อนประมวลผล
+- หลัง commit จะปลุก worker thread ใน process (AAMS_GROUP_SYNC_WORKER) ให้ประมวลผล
+  ถ้าปิด worker ไว้ ให้ตั้ง cron เรียก `python manage.py drain_group_sync`
+- drain() ล็อกงานด้วย SELECT ... FOR UPDATE SKIP LOCKED จึงรันพร้อมกันหลาย process ได้
+  และซิงค์ตามข้อมูลล่าสุดตอนประมวลผล (core.permissions.sync_roles_with_django_groups)
+  งานที่ถูกขอซ้ำระหว่างซิงค์ (requested_at ใหม่กว่าที่อ่านไว้) จะไม่ถูกลบ และถูกซิงค์อีกรอบ
+"""
+
+import logging
+import threading
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import role_hierarchy
+from .models import GroupSyncJob, Role
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def request_sync(role_ids):
+    """
+    บันทึกงานซิงค์ของ role_ids และปลุก worker หลัง commit
+    งานที่มีอยู่แล้วจะถูกรวม โดยเลื่อน requested_at เป็นเวลาปัจจุบัน (ON CONFLICT DO UPDATE)
+    """
+    role_ids = sorted(set(role_ids))
+    if not role_ids:
+        return
+    requested_at = timezone.now()
+    GroupSyncJob.objects.bulk_create(
+        [GroupSyncJob(role_id=role_id, requested_at=requested_at) for role_id in role_ids],
+        update_conflicts=True,
+        unique_fields=['role'],
+        update_fields=['requested_at'],
+    )
+    if getattr(settings, 'AAMS_GROUP_SYNC_WORKER', True):
+        transaction.on_commit(worker.wake)
+
+
+def request_tree_sync(role):
+    """ขอซิงค์ role และทุก role ที่สืบทอดจาก role นี้"""
+    request_sync(role_hierarchy.get_descendant_ids([role.pk]))
+
+
+def drain_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """ประมวลผลงานหนึ่งชุด คืนค่าจำนวน roles ที่ซิงค์"""
+    from .permissions import sync_roles_with_django_groups
+
+    with transaction.atomic():
+        jobs = list(
+            GroupSyncJob.objects.select_for_update(skip_locked=True)
+            .order_by('requested_at')
+            .values_list('id', 'role_id', 'requested_at')[:batch_size]
+        )
+        if not jobs:
+            return 0
+        role_ids = [role_id for _, role_id, _ in jobs]
+        roles = Role.objects.filter(id__in=role_ids).select_related('django_group')
+        sync_roles_with_django_groups(roles)
+        # ลบเฉพาะงานที่ไม่ถูกขอซ้ำหลังอ่าน คำขอที่เข้ามาระหว่างซิงค์อาจแก้ข้อมูลที่ซิงค์ไปแล้ว
+        GroupSyncJob.objects.filter(reduce(or_, (
+            Q(id=job_id, requested_at__lte=requested_at) for job_id, _, requested_at in jobs
+        ))).delete()
+    return len(jobs)
+
+
+def drain(batch_size=DEFAULT_BATCH_SIZE):
+    """ประมวลผลงานจนหมดคิว คืนค่าจำนวน roles ที่ซิงค์"""
+    total = 0
+    while True:
+        synced = drain_batch(batch_size)
+        if not synced:
+            return total
+        total += synced
+
+
+class Worker:
+    """thread ที่ประมวลผลคิวเมื่อถูกปลุก (หนึ่งตัวต่อ process)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='aams-group-sync', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                drain()
+            except Exception:
+                logger.exception('การซิงค์ Django Group ล้มเหลว งานยังอยู่ในคิว')
+            finally:
+                # thread นี้มีการเชื่อมต่อฐานข้อมูลของตัวเอง
+                connection.close()
+
+
+worker = Worker()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from core import group_sync
+from core.models import GroupSyncJob
+
+
+class Command(BaseCommand):
+    help = 'ซิงค์ roles ที่รออยู่ในคิว (core_group_sync_job) กับ Django Group จนหมดคิว'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=group_sync.DEFAULT_BATCH_SIZE,
+            help='จำนวน roles ต่อ transaction',
+        )
+
+    def handle(self, *args, **options):
+        pending = GroupSyncJob.objects.count()
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('✅ ไม่มี role ที่รอซิงค์'))
+            return
+        self.stdout.write(f'🔍 พบ role ที่รอซิงค์ {pending} รายการ')
+        synced = group_sync.drain(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✅ ซิงค์ Django Group แล้ว {synced} roles'))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = 'ลบบันทึกการเปลี่ยนแปลง (core_change_log) ที่เก่ากว่าระยะเวลาที่กำหนด (ควรตั้ง cron ให้รันวันละครั้ง)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'AAMS_CHANGE_LOG_RETENTION_DAYS', 30),
+            help='เก็บบันทึกย้อนหลังกี่วัน',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = ChangeLog.objects.filter(changed_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'✅ ลบบันทึกการเปลี่ยนแปลงที่เก่ากว่า {options["days"]} วันแล้ว {deleted} รายการ'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from core import effective_permissions, permission_cache
+
+
+class Command(BaseCommand):
+    help = 'สร้างตาราง core_effective_permission ใหม่ทั้งหมดด้วย set-based SQL'
+
+    def handle(self, *args, **options):
+        self.stdout.write('กำลังสร้าง effective permissions ใหม่...')
+
+        row_count = effective_permissions.rebuild_all()
+        permission_cache.invalidate_all()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ สร้าง effective permissions เรียบร้อยแล้ว {row_count} รายการ')
+        )
@@ -0,0 +1,28 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from core import effective_permissions, permission_cache, permission_index, role_hierarchy
+
+
+class Command(BaseCommand):
+    help = 'สร้างตาราง core_role_closure ของลำดับชั้น role ใหม่ทั้งหมด และคำนวณ permissions ที่สืบทอดใหม่'
+
+    def handle(self, *args, **options):
+        self.stdout.write('กำลังสร้าง closure ของลำดับชั้น role ใหม่...')
+
+        try:
+            closure_count = role_hierarchy.rebuild_closure()
+        except ValidationError as e:
+            self.stdout.write(self.style.ERROR(f'❌ {e.messages[0]}'))
+            return
+
+        permission_index.rebuild_role_masks()
+        permission_index.invalidate_user_masks()
+        row_count = effective_permissions.rebuild_all()
+        permission_cache.invalidate_all()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ สร้าง closure เรียบร้อยแล้ว {closure_count} รายการ '
+                f'และ effective permissions {row_count} รายการ'
+            )
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core import counters
+
+
+class Command(BaseCommand):
+    help = 'นับตัวนับของ roles, โครงการ และแผนกใหม่ทั้งหมดจากข้อมูลจริง และรายงานค่าที่คลาดเคลื่อน'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='แสดงค่าที่คลาดเคลื่อนโดยไม่ทำการแก้ไข',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = counters.reconcile(apply=not options['dry_run'])
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('✅ ตัวนับทั้งหมดตรงกับข้อมูลจริง'))
+            return
+
+        for kind, name, field, stored, actual in drift:
+            self.stdout.write(f'⚠️ {kind} "{name}" {field}: เก็บไว้ {stored} ค่าจริง {actual}')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'🔍 พบตัวนับที่คลาดเคลื่อน {len(drift)} รายการ (ยังไม่ได้แก้ไข)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✅ แก้ไขตัวนับที่คลาดเคลื่อนแล้ว {len(drift)} รายการ'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from core.role_expiry import DEFAULT_BATCH_SIZE, expired_user_roles, sweep_expired_roles
+
+
+class Command(BaseCommand):
+    help = 'ปิดการใช้งาน UserRole ที่หมดอายุแล้ว (ควรตั้ง cron ให้รันทุกนาที)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='จำนวน UserRole ที่ปิดต่อหนึ่ง transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='แสดงจำนวน UserRole ที่หมดอายุโดยไม่ทำการเปลี่ยนแปลง',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = expired_user_roles().count()
+            self.stdout.write(f'🔍 พบ UserRole ที่หมดอายุ {count} รายการ')
+            return
+
+        role_count, user_count = sweep_expired_roles(batch_size=options['batch_size'])
+
+        if role_count:
+            self.stdout.write(
+                self.style.SUCCESS(f'✅ ปิดการใช้งาน UserRole ที่หมดอายุ {role_count} รายการ ของผู้ใช้ {user_count} คน')
+            )
+        else:
+            self.stdout.write('ไม่มี UserRole ที่หมดอายุ')
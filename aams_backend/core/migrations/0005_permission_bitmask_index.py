@@ -0,0 +1,61 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_bitmask_index(apps, schema_editor):
+    """กำหนด bit_position ให้ permissions เดิม (เรียงตาม id) และคำนวณ bitmask ของทุก role"""
+    Permission = apps.get_model('core', 'Permission')
+    Role = apps.get_model('core', 'Role')
+    RolePermission = apps.get_model('core', 'RolePermission')
+
+    for position, permission in enumerate(Permission.objects.order_by('id')):
+        permission.bit_position = position
+        permission.save(update_fields=['bit_position'])
+
+    masks = {}
+    role_permissions = RolePermission.objects.filter(
+        is_active=True,
+        permission__is_active=True,
+    ).values_list('role_id', 'permission__bit_position')
+    for role_id, bit_position in role_permissions:
+        masks[role_id] = masks.get(role_id, 0) | (1 << bit_position)
+
+    for role in Role.objects.all():
+        mask = masks.get(role.id, 0)
+        role.permission_mask = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+        role.save(update_fields=['permission_mask'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_user_termination_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPermissionMask',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='permission_mask', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('mask', models.BinaryField(default=b'')),
+                ('valid_until', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'core_user_permission_mask',
+            },
+        ),
+        migrations.AddField(
+            model_name='permission',
+            name='bit_position',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='role',
+            name='permission_mask',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(build_bitmask_index, migrations.RunPython.noop),
+    ]
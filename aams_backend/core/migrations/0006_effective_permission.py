@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+POPULATE_EFFECTIVE_PERMISSIONS_SQL = """
+    INSERT INTO core_effective_permission (user_id, permission_id, source_role_id, expires_at)
+    SELECT ur.user_id, rp.permission_id, ur.role_id, ur.expires_at
+    FROM core_user_role ur
+    INNER JOIN core_role r ON r.id = ur.role_id
+    INNER JOIN core_role_permission rp ON rp.role_id = ur.role_id
+    INNER JOIN core_permission p ON p.id = rp.permission_id
+    WHERE ur.is_active = %s AND r.is_active = %s AND rp.is_active = %s AND p.is_active = %s
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_permission_bitmask_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePermission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('permission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_permissions', to='core.permission')),
+                ('source_role', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_permissions', to='core.role')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_permissions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'core_effective_permission',
+                'indexes': [models.Index(fields=['permission', 'user'], name='effective_perm_permission_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'permission', 'source_role'), name='unique_effective_permission')],
+            },
+        ),
+        migrations.RunSQL(
+            sql=[(POPULATE_EFFECTIVE_PERMISSIONS_SQL, [True, True, True, True])],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
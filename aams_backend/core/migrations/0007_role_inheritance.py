@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_effective_permission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='role',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='core.role'),
+        ),
+        migrations.CreateModel(
+            name='RoleClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='core.role')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='core.role')),
+            ],
+            options={
+                'db_table': 'core_role_closure',
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='role_closure_descendant_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_role_closure')],
+            },
+        ),
+        # ทุก role มีแถวของตัวเองใน closure (ยังไม่มี role ใดมี parent)
+        migrations.RunSQL(
+            sql='INSERT INTO core_role_closure (ancestor_id, descendant_id, depth) SELECT id, id, 0 FROM core_role',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_role_inheritance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userrole',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='user_role_expiring_idx'),
+        ),
+    ]
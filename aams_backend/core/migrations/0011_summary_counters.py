@@ -0,0 +1,73 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+# ค่าเริ่มต้นของตัวนับ (หลังจากนี้ signals อัปเดตเอง ดู core/counters.py)
+POPULATE_COUNTERS_SQL = [
+    """
+    UPDATE core_role SET
+        user_count = (
+            SELECT COUNT(*) FROM core_user_role ur
+            INNER JOIN core_user u ON u.id = ur.user_id
+            WHERE ur.role_id = core_role.id AND ur.is_active = TRUE AND u.is_active = TRUE
+        ),
+        permission_count = (
+            SELECT COUNT(*) FROM core_role_permission rp
+            INNER JOIN core_permission p ON p.id = rp.permission_id
+            WHERE rp.role_id = core_role.id AND rp.is_active = TRUE AND p.is_active = TRUE
+        )
+    """,
+    """
+    UPDATE core_project SET
+        user_count = (
+            SELECT COUNT(*) FROM core_agent_project_assignment a
+            INNER JOIN core_user u ON u.id = a.agent_id
+            WHERE a.project_id = core_project.id AND a.is_active = TRUE AND u.is_active = TRUE
+        )
+    """,
+    """
+    INSERT INTO core_department_summary (department, total_users, active_users)
+    SELECT COALESCE(department, ''), COUNT(*), SUM(CASE WHEN is_active = TRUE THEN 1 ELSE 0 END)
+    FROM core_user
+    GROUP BY COALESCE(department, '')
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_user_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department', models.CharField(max_length=100, unique=True)),
+                ('total_users', models.PositiveIntegerField(default=0)),
+                ('active_users', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_department_summary',
+                'ordering': ['department'],
+            },
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='user_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='role',
+            name='permission_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='role',
+            name='user_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(sql=POPULATE_COUNTERS_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_table_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'core_change_log',
+                'indexes': [models.Index(fields=['table', 'id'], name='change_log_table_id_idx'), models.Index(fields=['table', 'changed_at'], name='change_log_table_time_idx'), models.Index(fields=['changed_at'], name='change_log_changed_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupSyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('role', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='group_sync_job', to='core.role')),
+            ],
+            options={
+                'db_table': 'core_group_sync_job',
+            },
+        ),
+    ]
@@ -1,11 +1,26 @@
 # D:\AAMS\aams_backend\core\models.py
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import AbstractUser, Group
 from django.utils import timezone
 from django.contrib.auth.models import Permission as DjangoPermission
 from django.contrib.contenttypes.models import ContentType
 
+def without_counter_fields(instance, kwargs, counter_fields):
+    """
+    ตัวนับถูกอัปเดตด้วย F() โดย signals (ดู core/counters.py) และค่าที่คำนวณจากตารางอื่น
+    (เช่น Role.permission_mask) ถูกเขียนด้วย bulk_update
+    save() ของแถวที่มีอยู่แล้วต้องไม่เขียนค่าเก่าในหน่วยความจำทับ จึงตัดฟิลด์เหล่านี้ออกจาก update_fields
+    """
+    if instance._state.adding or kwargs.get('force_insert') or kwargs.get('update_fields') is not None:
+        return kwargs
+    kwargs['update_fields'] = [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in counter_fields
+    ]
+    return kwargs
+
 # เราจะขยายความสามารถของ User Model ที่มีอยู่แล้วของ Django
 # เพื่อเพิ่มฟิลด์ที่เราต้องการ เช่น employee_id, position
 class User(AbstractUser):
@@ -17,6 +32,7 @@ class User(AbstractUser):
     date_of_birth = models.DateField(blank=True, null=True)
     hire_date = models.DateField(blank=True, null=True)
     termination_date = models.DateField(blank=True, null=True)  # วันลาออก
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'core_user'
@@ -27,6 +43,17 @@ class User(AbstractUser):
                 name='unique_employee_id_when_not_null'
             )
         ]
+        indexes = [
+            # ลำดับของ keyset pagination ใน UserViewSet
+            models.Index(fields=['-date_joined', 'id'], name='user_date_joined_id_idx'),
+            # ตัวกรองของรายการผู้ใช้ (filter_users ใน views.py)
+            # การค้นหา ?q= ใช้ pg_trgm GIN index ที่สร้างใน migration 0010
+            models.Index(fields=['is_active', '-date_joined', 'id'], name='user_active_joined_idx'),
+            models.Index(fields=['department', 'is_active'], name='user_department_active_idx'),
+            models.Index(fields=['position', 'is_active'], name='user_position_active_idx'),
+            models.Index(fields=['hire_date'], name='user_hire_date_idx'),
+            models.Index(fields=['termination_date'], name='user_termination_date_idx'),
+        ]
 
     def __str__(self):
         return self.get_full_name() or self.username
@@ -46,11 +73,11 @@ class User(AbstractUser):
         # Django built-in permissions
         permissions.update(super().get_all_permissions())
         
-        # Custom permissions จาก Role
-        for user_role in self.user_roles.filter(is_active=True, role__is_active=True):
-            if not user_role.is_expired:
-                for role_perm in user_role.role.role_permissions.filter(is_active=True):
-                    permissions.add(f"{role_perm.permission.category}.{role_perm.permission.name}")
+        # Custom permissions จาก Role (อ่านจากตาราง core_effective_permission ใน query เดียว)
+        role_permissions = self.effective_permissions.filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now())
+        ).values_list('permission__category', 'permission__name').distinct()
+        permissions.update(f"{category}.{name}" for category, name in role_permissions)
         
         return permissions
 
@@ -58,7 +85,9 @@ class User(AbstractUser):
         """
         ตรวจสอบว่าผู้ใช้มี role นี้หรือไม่
         """
+        # role ที่ไม่มี permission จะไม่มีแถวใน core_effective_permission จึงยังอ่านจาก core_user_role
         return self.user_roles.filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now()),
             role__name=role_name,
             is_active=True,
             role__is_active=True
@@ -101,6 +130,25 @@ class User(AbstractUser):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        """
+        User ที่สร้างจาก token claims (core/authentication.py) มีข้อมูลแค่บางฟิลด์
+        เมื่อมีการเข้าถึงฟิลด์อื่นให้โหลดฟิลด์ที่เหลือทั้งหมดใน query เดียว
+        """
+        if fields is not None and getattr(self, '_from_token_claims', False):
+            deferred_fields = self.get_deferred_fields()
+            if deferred_fields and set(fields) <= deferred_fields:
+                fields = list(deferred_fields)
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
+ROLE_CYCLE_MESSAGE = 'ไม่สามารถสืบทอดจาก role นี้ได้ เนื่องจากจะเกิดวงจรในลำดับชั้นของ role'
+
+class RoleCycleError(Exception):
+    """
+    Role.save() ถูกเรียกด้วย parent ที่จะทำให้เกิดวงจรในลำดับชั้นของ role
+    (views แปลงเป็น 400 ส่วน forms/serializers ตรวจสอบก่อนด้วย clean() และ validate_parent)
+    """
+
 class Role(models.Model):
     """โมเดลสำหรับเก็บข้อมูล Role/Badge ต่างๆ"""
     name = models.CharField(max_length=100, unique=True)
@@ -118,6 +166,25 @@ class Role(models.Model):
         blank=True,
         related_name='custom_roles'
     )
+
+    # role แม่ที่ role นี้สืบทอด permissions มา (เช่น Team Lead -> Agent -> Basic User)
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='children'
+    )
+
+    # bitmask ของ permissions ที่ active ใน role นี้ รวมที่สืบทอดมา (ดู core/permission_index.py)
+    permission_mask = models.BinaryField(default=b'')
+
+    # ตัวนับที่อัปเดตโดย signals (ดู core/counters.py): ผู้ใช้ที่ active และ permissions ที่ active
+    user_count = models.PositiveIntegerField(default=0, editable=False)
+    permission_count = models.PositiveIntegerField(default=0, editable=False)
+    COUNTER_FIELDS = ('user_count', 'permission_count')
+    # ฟิลด์ที่ save() ของ role ไม่เขียนทับ: ตัวนับ และ permission_mask (ดูแลโดย core/permission_index.py)
+    DERIVED_FIELDS = COUNTER_FIELDS + ('permission_mask',)
     
     class Meta:
         db_table = 'core_role'
@@ -126,24 +193,55 @@ class Role(models.Model):
     def __str__(self):
         return self.name
 
+    def would_create_cycle(self, parent):
+        """
+        ตรวจสอบว่าถ้าตั้ง parent นี้จะเกิดวงจรในลำดับชั้นของ role หรือไม่
+        """
+        if parent is None or self.pk is None:
+            return False
+        parent_id = getattr(parent, 'pk', parent)
+        return parent_id == self.pk or RoleClosure.objects.filter(
+            ancestor_id=self.pk,
+            descendant_id=parent_id
+        ).exists()
+
+    def clean(self):
+        super().clean()
+        if self.would_create_cycle(self.parent_id):
+            raise ValidationError({'parent': ROLE_CYCLE_MESSAGE})
+
+    def save(self, *args, **kwargs):
+        if self.parent_id and self.would_create_cycle(self.parent_id):
+            raise RoleCycleError(ROLE_CYCLE_MESSAGE)
+        super().save(*args, **without_counter_fields(self, kwargs, self.DERIVED_FIELDS))
+
     def sync_with_django_group(self):
         """
-        สร้างหรืออัปเดต Django Group ให้ตรงกับ Role นี้
+        สร้างหรืออัปเดต Django Group ให้ตรงกับ Role นี้ (ดู core.permissions.sync_role_with_django_group)
         """
-        if not self.django_group:
-            self.django_group, created = Group.objects.get_or_create(name=f"role_{self.name}")
-        
-        # อัปเดต permissions ใน Django Group
-        self.django_group.permissions.clear()
-        for role_perm in self.role_permissions.filter(is_active=True):
-            # สร้าง Django Permission ถ้ายังไม่มี
-            content_type = ContentType.objects.get_for_model(self)
-            django_perm, created = DjangoPermission.objects.get_or_create(
-                codename=role_perm.permission.name,
-                content_type=content_type,
-                defaults={'name': role_perm.permission.description or role_perm.permission.name}
-            )
-            self.django_group.permissions.add(django_perm)
+        from .permissions import sync_role_with_django_group
+        return sync_role_with_django_group(self)
+
+class RoleClosure(models.Model):
+    """
+    Transitive closure ของลำดับชั้น role: descendant สืบทอด permissions ของ ancestor
+    (ทุก role มีแถวของตัวเองที่ depth = 0) ดูแลโดย core/role_hierarchy.py
+    """
+    ancestor = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_role_closure'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_role_closure')
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'ancestor'], name='role_closure_descendant_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
 
 class Permission(models.Model):
     """โมเดลสำหรับเก็บข้อมูล Permission/Skill ต่างๆ"""
@@ -153,6 +251,8 @@ class Permission(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # ตำแหน่ง bit ของ permission นี้ใน bitmask (กำหนดครั้งเดียวตอนสร้าง และไม่เปลี่ยน)
+    bit_position = models.PositiveIntegerField(unique=True, null=True, blank=True, editable=False)
     
     class Meta:
         db_table = 'core_permission'
@@ -161,6 +261,27 @@ class Permission(models.Model):
     def __str__(self):
         return self.name
 
+    # จำนวนครั้งที่ลองจอง bit_position ใหม่เมื่อชนกับ permission ที่ถูกสร้างพร้อมกัน
+    BIT_POSITION_ATTEMPTS = 5
+
+    def save(self, *args, **kwargs):
+        if self.bit_position is not None:
+            return super().save(*args, **kwargs)
+        # bit ถัดไปคือ Max + 1 ถ้าสร้างพร้อมกันอาจได้ค่าเดียวกัน ให้ลองใหม่เมื่อชน unique constraint
+        for attempt in range(self.BIT_POSITION_ATTEMPTS):
+            last_position = Permission.objects.aggregate(
+                last_position=models.Max('bit_position')
+            )['last_position']
+            self.bit_position = 0 if last_position is None else last_position + 1
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = Permission.objects.filter(bit_position=self.bit_position).exists()
+                self.bit_position = None
+                if not taken or attempt == self.BIT_POSITION_ATTEMPTS - 1:
+                    raise
+
     def get_django_permission(self):
         """
         สร้างหรือดึง Django Permission ที่ตรงกับ Permission นี้
@@ -186,6 +307,18 @@ class UserRole(models.Model):
         db_table = 'core_user_role'
         unique_together = ['user', 'role']
         ordering = ['-assigned_at']
+        indexes = [
+            # ลำดับของ keyset pagination ใน UserRoleViewSet
+            models.Index(fields=['-assigned_at', 'id'], name='user_role_assigned_at_id_idx'),
+            # กรองผู้ใช้ตาม role (unique_together นำด้วย user จึงใช้ไม่ได้)
+            models.Index(fields=['role', 'user'], name='user_role_role_user_idx'),
+            # ใช้โดย sweep_expired_roles (เฉพาะแถวที่ยัง active จึงเล็กและถูก)
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(is_active=True),
+                name='user_role_expiring_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.role.name}"
@@ -208,24 +341,78 @@ class RolePermission(models.Model):
         db_table = 'core_role_permission'
         unique_together = ['role', 'permission']
         ordering = ['-granted_at']
+        indexes = [
+            # ลำดับของ keyset pagination ใน RolePermissionViewSet
+            models.Index(fields=['-granted_at', 'id'], name='role_perm_granted_at_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.role.name} - {self.permission.name}"
 
+class EffectivePermission(models.Model):
+    """
+    ตาราง denormalized ของ permissions ที่ผู้ใช้ได้รับจากแต่ละ role
+    ถูกอัปเดตเมื่อ UserRole/RolePermission/Role/Permission เปลี่ยน (ดู core/effective_permissions.py)
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='effective_permissions')
+    permission = models.ForeignKey(Permission, on_delete=models.CASCADE, related_name='effective_permissions')
+    source_role = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='effective_permissions')
+    expires_at = models.DateTimeField(null=True, blank=True)  # มาจาก UserRole.expires_at
+
+    class Meta:
+        db_table = 'core_effective_permission'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'permission', 'source_role'],
+                name='unique_effective_permission'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['permission', 'user'], name='effective_perm_permission_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.permission_id} (role {self.source_role_id})"
+
+class UserPermissionMask(models.Model):
+    """
+    bitmask ของ permissions ทั้งหมดของผู้ใช้ (OR ของ roles ที่ active และยังไม่หมดอายุ)
+    แถวจะถูกลบเมื่อ roles ของผู้ใช้เปลี่ยน และคำนวณใหม่เมื่อมีการใช้งาน (ดู core/permission_index.py)
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='permission_mask')
+    mask = models.BinaryField(default=b'')
+    valid_until = models.DateTimeField(null=True, blank=True)  # เวลาที่ role ถัดไปของผู้ใช้จะหมดอายุ
+
+    class Meta:
+        db_table = 'core_user_permission_mask'
+
+    def __str__(self):
+        return f"{self.user_id} - permission mask"
+
 class Project(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # จำนวนผู้ใช้ที่ active ในโครงการ อัปเดตโดย signals (ดู core/counters.py)
+    user_count = models.PositiveIntegerField(default=0, editable=False)
+    COUNTER_FIELDS = ('user_count',)
     
     class Meta:
         db_table = 'core_project'
         ordering = ['-created_at']
+        indexes = [
+            # ลำดับของ keyset pagination ใน ProjectViewSet
+            models.Index(fields=['-created_at', 'id'], name='project_created_at_id_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **without_counter_fields(self, kwargs, self.COUNTER_FIELDS))
+
 class AgentProjectAssignment(models.Model):
     agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='project_assignments', default=1, null=True, blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='agent_assignments')
@@ -238,4 +425,87 @@ class AgentProjectAssignment(models.Model):
         ordering = ['-assigned_at']
     
     def __str__(self):
-        return f"{self.agent.username} - {self.project.name}"
\ No newline at end of file
+        return f"{self.agent.username} - {self.project.name}"
+
+class DepartmentSummary(models.Model):
+    """
+    จำนวนผู้ใช้ในแต่ละแผนก อัปเดตโดย signals (ดู core/counters.py)
+    ผู้ใช้ที่ไม่ได้ระบุแผนกนับรวมใน department = ''
+    """
+    department = models.CharField(max_length=100, unique=True)
+    total_users = models.PositiveIntegerField(default=0)
+    active_users = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_department_summary'
+        ordering = ['department']
+
+    def __str__(self):
+        return f"{self.department or '-'}: {self.active_users}/{self.total_users}"
+
+class TableVersion(models.Model):
+    """
+    version ของแต่ละตารางที่เพิ่มขึ้นทุกครั้งที่ข้อมูลในตารางเปลี่ยน (ดู core/change_tracking.py)
+    ใช้สร้าง ETag ของ API ได้โดยไม่ต้อง query และ serialize ข้อมูลจริง
+    """
+    table = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'core_table_version'
+
+    def __str__(self):
+        return f"{self.table}: {self.version}"
+
+class PermissionVersion(models.Model):
+    """
+    version ของข้อมูลใน cache ของ permissions เช่น 'perm:gv' (ทุกผู้ใช้) และ 'perm:uv:<user_id>'
+    (ดู core/permission_cache.py) เก็บในฐานข้อมูลเพื่อให้ทุก process เห็นค่าเดียวกัน
+    และค่าไม่เปลี่ยนเมื่อ cache ถูกล้างหรือ restart (token ที่มี perm_ver จึงยังใช้ได้)
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_permission_version'
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
+
+class ChangeLog(models.Model):
+    """
+    บันทึกการเปลี่ยนแปลงของแถวในตารางหลัก (เขียนโดย signals ดู core/change_tracking.py)
+    ใช้ตอบ ?updated_since= ของ API (core/delta_sync.py) รวมถึงแถวที่ถูกลบ (deleted = True)
+    id ที่เพิ่มขึ้นเรื่อยๆ ใช้เป็น cursor
+    """
+    table = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'core_change_log'
+        indexes = [
+            models.Index(fields=['table', 'id'], name='change_log_table_id_idx'),
+            models.Index(fields=['table', 'changed_at'], name='change_log_table_time_idx'),
+            models.Index(fields=['changed_at'], name='change_log_changed_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.table} {self.object_id} {'deleted' if self.deleted else 'changed'}"
+
+
+class GroupSyncJob(models.Model):
+    """
+    Role ที่รอซิงค์กับ Django Group (core/group_sync.py) มีได้หนึ่งแถวต่อ role
+    การขอซิงค์ role เดิมซ้ำก่อนถูกประมวลผลจะรวมเป็นงานเดียว และซิงค์ตามข้อมูลล่าสุดตอนประมวลผล
+    """
+    role = models.OneToOneField(Role, on_delete=models.CASCADE, related_name='group_sync_job')
+    requested_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'core_group_sync_job'
+
+    def __str__(self):
+        return f"sync {self.role_id} ({self.requested_at})"
@@ -0,0 +1,36 @@
+# aams_backend/core/pagination.py
+
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination ขนาดหน้าคงที่ ไม่ใช้ OFFSET/COUNT จึงเร็วเท่ากันทุกหน้า
+    ปรับขนาดหน้าได้ด้วย ?page_size= (ไม่เกิน max_page_size)
+    ใช้ลำดับจาก view.ordering ถ้ามี (ต้องมี field ที่ไม่ซ้ำกันปิดท้าย เช่น 'id')
+    """
+    page_size = getattr(settings, 'AAMS_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'AAMS_MAX_PAGE_SIZE', 500)
+    ordering = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'ordering', None)
+        if ordering:
+            return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        return super().get_ordering(request, queryset, view)
+
+
+class OptionalKeysetPagination(KeysetPagination):
+    """
+    KeysetPagination ที่ client ขอรายการทั้งหมดแบบไม่แบ่งหน้าได้ด้วย ?paginate=false
+    (สำหรับหน้าจอเดิมระหว่างย้ายไปใช้ cursor ปิดได้ด้วย AAMS_ALLOW_UNPAGINATED_LISTS = False)
+    """
+    paginate_query_param = 'paginate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        allow_unpaginated = getattr(settings, 'AAMS_ALLOW_UNPAGINATED_LISTS', True)
+        if allow_unpaginated and request.query_params.get(self.paginate_query_param, '').lower() == 'false':
+            return None
+        return super().paginate_queryset(queryset, request, view)
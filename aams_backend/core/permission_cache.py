@@ -0,0 +1,226 @@
+# aams_backend/core/permission_cache.py
+
+"""
+Cache ของ effective permissions (ชื่อ permission ทั้งหมดที่ผู้ใช้ได้รับจาก roles)
+
+- ใช้ Django cache framework ผ่าน alias ใน settings.AAMS_PERMISSION_CACHE_ALIAS
+  (ค่าเริ่มต้นเป็น local-memory, เปลี่ยนเป็น Redis/Memcached ได้โดยแก้ CACHES)
+- key ของชุด permission ผูกกับ version แบบ global, แบบรายผู้ใช้ และผลรวม version ของ roles ที่ผู้ใช้มี
+  เมื่อข้อมูลเปลี่ยน signals จะเพิ่ม version ทำให้ key เดิมใช้ไม่ได้ทันที
+- version เก็บในตาราง core_permission_version (ทุก process เห็นค่าเดียวกันและไม่หายเมื่อ cache ถูกล้าง)
+  และ cache ไว้ไม่เกิน AAMS_PERMISSION_VERSION_CACHE_TIMEOUT วินาที
+- การเปลี่ยน permissions ของ role เพิ่มเฉพาะ version ของ role นั้น (invalidate_roles) หนึ่งแถวต่อ role
+  ไม่ขึ้นกับจำนวนสมาชิก ผู้ใช้ที่ไม่มี role นั้นยังใช้ cache และ token เดิมได้
+  (id ของ roles ที่ผู้ใช้มี cache ไว้ใน key ที่ผูกกับ version ของผู้ใช้ ซึ่งเพิ่มทุกครั้งที่ UserRole เปลี่ยน)
+  version แบบ global ใช้กับงานที่สร้างข้อมูลใหม่ทั้งหมดเท่านั้น
+- อายุของ cache จะไม่เกินเวลาที่ role ถัดไปของผู้ใช้จะหมดอายุ (UserRole.expires_at)
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EffectivePermission, PermissionVersion, UserRole
+
+GLOBAL_VERSION_KEY = 'perm:gv'
+USER_VERSION_KEY = 'perm:uv:{user_id}'
+ROLE_VERSION_KEY = 'perm:rv:{role_id}'
+USER_ROLES_KEY = 'perm:roles:{user_id}:{user_version}'
+PERMISSION_SET_KEY = 'perm:set:{user_id}:{global_version}:{user_version}:{role_version}'
+
+# จำนวน keys สูงสุดต่อคำสั่ง INSERT ของ bump_versions
+VERSION_BATCH_SIZE = 1000
+
+
+def get_cache():
+    """ดึง cache backend ที่ใช้เก็บ permissions"""
+    return caches[getattr(settings, 'AAMS_PERMISSION_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    """อายุสูงสุด (วินาที) ของข้อมูลที่เก็บใน cache ของ permissions"""
+    return getattr(settings, 'AAMS_PERMISSION_CACHE_TIMEOUT', 300)
+
+
+def get_version_timeout():
+    """
+    อายุ (วินาที) ของ version ที่เก็บใน cache (ค่าจริงอยู่ในตาราง core_permission_version)
+    ถ้า cache ไม่ได้ใช้ร่วมกันทุก process (local-memory) process อื่นจะเห็น version ใหม่ช้าได้ไม่เกินเวลานี้
+    """
+    return getattr(settings, 'AAMS_PERMISSION_VERSION_CACHE_TIMEOUT', 10)
+
+
+def _load_versions(keys, refresh=False):
+    """
+    ดึง version ของ keys จาก cache ถ้าไม่มี (หรือ refresh=True) อ่านจากฐานข้อมูลแล้วเก็บใน cache
+    key ที่ยังไม่เคยถูกเพิ่ม version มี version เป็น 0
+    """
+    cache = get_cache()
+    versions = {} if refresh else cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        stored = dict(PermissionVersion.objects.filter(key__in=missing).values_list('key', 'version'))
+        loaded = {key: stored.get(key, 0) for key in missing}
+        cache.set_many(loaded, get_version_timeout())
+        versions.update(loaded)
+    return versions
+
+
+def _increment(keys):
+    """เพิ่ม version ของ keys ในฐานข้อมูลด้วย INSERT ... ON CONFLICT DO UPDATE (ครั้งละ VERSION_BATCH_SIZE keys)"""
+    quote = connection.ops.quote_name
+    table = quote(PermissionVersion._meta.db_table)
+    key_column, version_column = quote('key'), quote('version')
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), VERSION_BATCH_SIZE):
+            batch = keys[start:start + VERSION_BATCH_SIZE]
+            values = ', '.join(['(%s, 1)'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} ({key_column}, {version_column}) VALUES {values} '
+                f'ON CONFLICT ({key_column}) DO UPDATE SET {version_column} = {table}.{version_column} + 1',
+                batch
+            )
+
+
+def bump_versions(keys):
+    """
+    เพิ่ม version ของ keys ทำให้ข้อมูลใน cache ที่ผูกกับ version เดิมใช้ไม่ได้
+    (เขียนใน transaction เดียวกับการเปลี่ยนข้อมูล ถ้า transaction ถูก rollback version ก็ไม่เปลี่ยน)
+    """
+    # เรียง keys เพื่อให้ transaction ที่เพิ่มหลาย keys ล็อกแถวตามลำดับเดียวกัน
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    _increment(keys)
+    # ลบ version ใน cache ทันที และอีกครั้งหลัง commit เพื่อกันกรณีมี request อื่นอ่าน version เดิม
+    # จากฐานข้อมูลไปใส่ cache ระหว่างที่ transaction ยังไม่ commit
+    cache = get_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def bump_version(key):
+    """เพิ่ม version ของ key เดียว (ดู bump_versions)"""
+    bump_versions([key])
+
+
+def get_version(key):
+    """ดึง version ของ key (ใช้สร้าง key ของข้อมูลใน cache)"""
+    return _load_versions([key])[key]
+
+
+def _load_role_ids(user_id, user_version, refresh=False):
+    """
+    id ของ roles ที่ active ของผู้ใช้ (cache ไว้ใน key ที่ผูกกับ user_version
+    การกำหนด/ยกเลิก role เพิ่ม version ของผู้ใช้ key เดิมจึงใช้ไม่ได้ทันที)
+    """
+    cache = get_cache()
+    key = USER_ROLES_KEY.format(user_id=user_id, user_version=user_version)
+    role_ids = None if refresh else cache.get(key)
+    if role_ids is None:
+        role_ids = sorted(
+            UserRole.objects.filter(user_id=user_id, is_active=True).values_list('role_id', flat=True)
+        )
+        cache.set(key, role_ids, get_timeout())
+    return role_ids
+
+
+def get_versions(user_id, refresh=False):
+    """
+    ดึง (global_version, user_version, role_version) ของผู้ใช้
+    role_version คือผลรวม version ของ roles ที่ผู้ใช้มี (version เพิ่มขึ้นอย่างเดียว ผลรวมจึงเปลี่ยนทุกครั้ง
+    ที่ role ใด role หนึ่งเปลี่ยน และชุดของ roles เปลี่ยนได้พร้อมกับ user_version เท่านั้น)
+    refresh=True อ่านจากฐานข้อมูลโดยตรง (เช่น เมื่อ version ใน token ไม่ตรงกับค่าใน cache)
+    """
+    user_key = USER_VERSION_KEY.format(user_id=user_id)
+    versions = _load_versions([GLOBAL_VERSION_KEY, user_key], refresh=refresh)
+    role_keys = [
+        ROLE_VERSION_KEY.format(role_id=role_id)
+        for role_id in _load_role_ids(user_id, versions[user_key], refresh=refresh)
+    ]
+    role_version = sum(_load_versions(role_keys, refresh=refresh).values()) if role_keys else 0
+    return versions[GLOBAL_VERSION_KEY], versions[user_key], role_version
+
+
+def _load_permission_names(user_id):
+    """
+    โหลดชื่อ permission ของผู้ใช้จากตาราง core_effective_permission (query เดียว)
+    พร้อมเวลาหมดอายุของ role ที่ใกล้ที่สุด
+    """
+    now = timezone.now()
+    rows = EffectivePermission.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        user_id=user_id,
+    ).values_list('permission__name', 'expires_at')
+
+    names = set()
+    next_expiry = None
+    for name, expires_at in rows:
+        names.add(name)
+        if expires_at and (next_expiry is None or expires_at < next_expiry):
+            next_expiry = expires_at
+
+    return frozenset(names), next_expiry
+
+
+def get_user_permissions(user):
+    """
+    ดึงชุดชื่อ permission ทั้งหมดของผู้ใช้ (จาก roles ที่ active และยังไม่หมดอายุ)
+    ถ้ามีใน cache จะไม่มีการ query ฐานข้อมูลเลย
+    """
+    # ถ้า authenticate ด้วย token ที่มี permission claims ใช้ค่าจาก token ได้เลย
+    permission_claims = getattr(user, 'permission_claims', None)
+    if permission_claims is not None:
+        return permission_claims
+
+    user_id = getattr(user, 'pk', user)
+    if user_id is None:
+        return frozenset()
+
+    cache = get_cache()
+    global_version, user_version, role_version = get_versions(user_id)
+    key = PERMISSION_SET_KEY.format(
+        user_id=user_id,
+        global_version=global_version,
+        user_version=user_version,
+        role_version=role_version,
+    )
+
+    permission_names = cache.get(key)
+    if permission_names is not None:
+        return permission_names
+
+    permission_names, next_expiry = _load_permission_names(user_id)
+
+    timeout = get_timeout()
+    if next_expiry is not None:
+        seconds_left = (next_expiry - timezone.now()).total_seconds()
+        timeout = max(1, min(timeout, int(seconds_left)))
+
+    cache.set(key, permission_names, timeout)
+    return permission_names
+
+
+def invalidate_user(user_id):
+    """ล้าง cache permissions ของผู้ใช้คนเดียว"""
+    invalidate_users([user_id])
+
+
+def invalidate_users(user_ids):
+    """ล้าง cache permissions ของผู้ใช้หลายคน (คำสั่ง SQL เดียวต่อ VERSION_BATCH_SIZE คน)"""
+    bump_versions(USER_VERSION_KEY.format(user_id=user_id) for user_id in user_ids if user_id is not None)
+
+
+def invalidate_roles(role_ids):
+    """
+    ล้าง cache permissions ของผู้ใช้ที่มี roles เหล่านี้ (เช่น เมื่อ permissions ของ role เปลี่ยน)
+    เพิ่ม version ของ role (หนึ่งแถวต่อ role ไม่ขึ้นกับจำนวนสมาชิก) ผู้ใช้คนอื่นยังใช้ cache และ token เดิมได้
+    """
+    bump_versions(ROLE_VERSION_KEY.format(role_id=role_id) for role_id in role_ids if role_id is not None)
+
+
+def invalidate_all():
+    """ล้าง cache permissions ของผู้ใช้ทุกคน (ใช้กับงานที่สร้างข้อมูลใหม่ทั้งหมด เช่น rebuild commands)"""
+    bump_version(GLOBAL_VERSION_KEY)
@@ -0,0 +1,152 @@
+# aams_backend/core/permission_index.py
+
+"""
+Bitmask index ของ permissions สำหรับตรวจสอบสิทธิ์ผู้ใช้จำนวนมากพร้อมกัน
+
+- Permission แต่ละตัวมี bit_position คงที่
+- Role.permission_mask คือ OR ของ bit ของ permissions ที่ active ใน role และ roles แม่
+- UserPermissionMask คือ OR ของ mask ของ roles ที่ active และยังไม่หมดอายุของผู้ใช้
+  ถูกลบเมื่อ roles ของผู้ใช้เปลี่ยน (ผ่าน signals) และคำนวณใหม่เป็นชุดเมื่อมีการใช้งาน
+"""
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Permission, Role, RoleClosure, User, UserPermissionMask, UserRole
+
+
+def mask_to_bytes(mask):
+    return mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+
+
+def bytes_to_mask(data):
+    return int.from_bytes(bytes(data or b''), 'little')
+
+
+def rebuild_role_masks(role_ids=None):
+    """
+    คำนวณ permission_mask ของ roles ใหม่ รวม permissions ที่สืบทอดจาก role แม่
+    (ถ้าไม่ระบุ role_ids จะคำนวณทุก role)
+    """
+    roles = Role.objects.all()
+    inherited_permissions = RoleClosure.objects.filter(
+        ancestor__is_active=True,
+        ancestor__role_permissions__is_active=True,
+        ancestor__role_permissions__permission__is_active=True,
+        ancestor__role_permissions__permission__bit_position__isnull=False,
+    )
+    if role_ids is not None:
+        roles = roles.filter(id__in=role_ids)
+        inherited_permissions = inherited_permissions.filter(descendant_id__in=role_ids)
+
+    masks = {}
+    rows = inherited_permissions.order_by().values_list(
+        'descendant_id', 'ancestor__role_permissions__permission__bit_position'
+    )
+    for role_id, bit_position in rows:
+        masks[role_id] = masks.get(role_id, 0) | (1 << bit_position)
+
+    roles = list(roles.only('id'))
+    for role in roles:
+        role.permission_mask = mask_to_bytes(masks.get(role.id, 0))
+    Role.objects.bulk_update(roles, ['permission_mask'])
+
+
+def invalidate_user_masks(user_ids=None, role_ids=None):
+    """
+    ลบ mask ของผู้ใช้ให้ถูกคำนวณใหม่ในการใช้งานครั้งถัดไป
+    ระบุได้ทั้ง user_ids หรือ role_ids (ผู้ใช้ทุกคนที่มี role นั้น) ถ้าไม่ระบุจะลบทั้งหมด
+    """
+    masks = UserPermissionMask.objects.all()
+    if user_ids is not None:
+        masks = masks.filter(user_id__in=user_ids)
+    if role_ids is not None:
+        masks = masks.filter(user_id__in=UserRole.objects.filter(role_id__in=role_ids).values('user_id'))
+    masks.delete()
+
+
+def _compute_user_masks(user_ids, now):
+    """คำนวณ mask ของผู้ใช้จาก roles ใน query เดียว และบันทึกลง UserPermissionMask"""
+    masks = {user_id: 0 for user_id in user_ids}
+    valid_until = {}
+
+    user_roles = UserRole.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        user_id__in=user_ids,
+        is_active=True,
+        role__is_active=True,
+    ).order_by().values_list('user_id', 'role__permission_mask', 'expires_at')
+
+    for user_id, role_mask, expires_at in user_roles:
+        masks[user_id] |= bytes_to_mask(role_mask)
+        if expires_at and (user_id not in valid_until or expires_at < valid_until[user_id]):
+            valid_until[user_id] = expires_at
+
+    UserPermissionMask.objects.bulk_create(
+        [
+            UserPermissionMask(user_id=user_id, mask=mask_to_bytes(mask), valid_until=valid_until.get(user_id))
+            for user_id, mask in masks.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['mask', 'valid_until'],
+    )
+    return masks
+
+
+def get_user_masks(user_ids):
+    """
+    ดึง permission mask ของผู้ใช้หลายคน {user_id: mask} (user_ids ต้องเป็นผู้ใช้ที่มีอยู่จริง)
+    mask ที่ยังไม่มีหรือหมดอายุแล้วจะถูกคำนวณใหม่พร้อมกันทั้งชุด
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+
+    now = timezone.now()
+    stored = UserPermissionMask.objects.filter(
+        Q(valid_until__isnull=True) | Q(valid_until__gt=now),
+        user_id__in=user_ids,
+    ).values_list('user_id', 'mask')
+    masks = {user_id: bytes_to_mask(mask) for user_id, mask in stored}
+
+    missing = user_ids - masks.keys()
+    if missing:
+        masks.update(_compute_user_masks(missing, now))
+
+    return masks
+
+
+def check_permissions(pairs):
+    """
+    ตรวจสอบ (user_id, permission_name) หลายคู่พร้อมกัน คืนค่า list ของ bool ตามลำดับเดิม
+    ใช้กฎเดียวกับ permission classes: ผู้ใช้ที่ไม่ active ไม่มีสิทธิ์, staff/superuser มีทุกสิทธิ์
+    """
+    pairs = list(pairs)
+    user_ids = {user_id for user_id, _ in pairs}
+    permission_names = {name for _, name in pairs}
+
+    bits = dict(
+        Permission.objects.filter(name__in=permission_names, bit_position__isnull=False)
+        .order_by().values_list('name', 'bit_position')
+    )
+    flags = {
+        user_id: (is_active, is_staff or is_superuser)
+        for user_id, is_active, is_staff, is_superuser in User.objects.filter(id__in=user_ids)
+        .values_list('id', 'is_active', 'is_staff', 'is_superuser')
+    }
+    masks = get_user_masks(user_id for user_id, (is_active, _) in flags.items() if is_active)
+
+    results = []
+    for user_id, name in pairs:
+        is_active, is_admin = flags.get(user_id, (False, False))
+        if not is_active:
+            results.append(False)
+        elif is_admin:
+            results.append(True)
+        else:
+            bit_position = bits.get(name)
+            results.append(
+                bit_position is not None and bool(masks.get(user_id, 0) >> bit_position & 1)
+            )
+    return results
@@ -1,69 +1,85 @@
 from rest_framework import permissions
 from django.contrib.auth.models import Permission as DjangoPermission
 from django.contrib.contenttypes.models import ContentType
-from .models import User, Role, Permission, UserRole, RolePermission
+from django.db.models import Q
+from .models import Role, RoleClosure, Permission, RolePermission
+from . import bulk_roles, permission_cache, role_hierarchy, upserts
 
-class HasRolePermission(permissions.BasePermission):
+def get_request_permissions(request):
     """
-    Custom permission ที่ตรวจสอบว่าผู้ใช้มี role ที่มี permission นี้หรือไม่
+    ดึงชุดชื่อ permission ของผู้ใช้ใน request นี้
+    โหลดครั้งเดียว (claims ใน token, cache หรือ query เดียว) แล้วเก็บไว้ที่ request
+    """
+    permission_names = getattr(request, '_custom_permissions', None)
+    if permission_names is None:
+        permission_names = permission_cache.get_user_permissions(request.user)
+        request._custom_permissions = permission_names
+    return permission_names
+
+def request_has_permissions(request, permission_names):
+    """
+    ตรวจสอบว่าผู้ใช้ใน request มีทุก permission ที่ระบุหรือไม่ (รองรับรูปแบบ 'app_label.codename')
+    """
+    if isinstance(permission_names, str):
+        permission_names = (permission_names,)
+    user_permissions = get_request_permissions(request)
+    return all(name.split('.', 1)[-1] in user_permissions for name in permission_names)
+
+class HasActionPermission(permissions.BasePermission):
+    """
+    Permission ที่กำหนดได้ตาม action ของ viewset ผ่าน view.required_permissions เช่น
+        required_permissions = {'create': 'project_management', 'destroy': ('project_management', 'user_management')}
+    - partial_update ใช้ค่าของ update ถ้าไม่ได้ระบุแยก, action ที่ไม่ได้ระบุต้องการแค่ login
+    - view.permission_denied_messages ใช้กำหนดข้อความเมื่อไม่มีสิทธิ์ตาม action
+    - ตรวจสอบจากชุด permission ที่โหลดครั้งเดียวต่อ request (รวมถึง has_object_permission)
     """
     
+    def get_required_permissions(self, view):
+        required_permissions = getattr(view, 'required_permissions', None) or {}
+        action = getattr(view, 'action', None)
+        if action == 'partial_update' and action not in required_permissions:
+            action = 'update'
+        return required_permissions.get(action)
+    
     def has_permission(self, request, view):
-        # ตรวจสอบว่าผู้ใช้ login อยู่หรือไม่
         if not request.user.is_authenticated:
             return False
         
-        # ถ้าเป็น superuser หรือ staff ให้ผ่าน
         if request.user.is_superuser or request.user.is_staff:
             return True
         
-        # ดึง permission ที่ต้องการจาก view
-        required_permission = getattr(view, 'required_permission', None)
-        if not required_permission:
+        required_permissions = self.get_required_permissions(view)
+        if not required_permissions:
             return True
         
-        # ตรวจสอบ Django built-in permissions ก่อน
-        if request.user.has_perm(required_permission):
+        if request_has_permissions(request, required_permissions):
             return True
         
-        # ตรวจสอบ custom permissions จาก roles
-        return self._has_custom_permission(request.user, required_permission)
+        messages = getattr(view, 'permission_denied_messages', None) or {}
+        message = messages.get(getattr(view, 'action', None))
+        if message:
+            self.message = message
+        return False
     
-    def _has_custom_permission(self, user, permission_name):
-        """
-        ตรวจสอบว่าผู้ใช้มี custom permission หรือไม่
-        """
-        # แยก app_label และ codename
-        if '.' in permission_name:
-            app_label, codename = permission_name.split('.', 1)
-        else:
-            app_label = 'core'
-            codename = permission_name
-        
-        # ตรวจสอบจาก user roles
-        user_roles = UserRole.objects.filter(
-            user=user,
-            is_active=True,
-            role__is_active=True
-        )
-        
-        for user_role in user_roles:
-            # ตรวจสอบว่า role หมดอายุหรือไม่
-            if user_role.is_expired:
-                continue
-            
-            # ตรวจสอบ permissions ของ role นี้
-            role_permissions = RolePermission.objects.filter(
-                role=user_role.role,
-                is_active=True,
-                permission__is_active=True
-            )
-            
-            for role_perm in role_permissions:
-                if role_perm.permission.name == codename:
-                    return True
+    def has_object_permission(self, request, view, obj):
+        return self.has_permission(request, view)
+
+class HasRolePermission(HasActionPermission):
+    """
+    Custom permission ที่ตรวจสอบว่าผู้ใช้มี role ที่มี permission นี้หรือไม่
+    ใช้ view.required_permission ตัวเดียวกับทุก action (ตรวจสอบ Django permissions ด้วยถ้าไม่มี custom permission)
+    """
+    
+    def get_required_permissions(self, view):
+        return getattr(view, 'required_permission', None)
+    
+    def has_permission(self, request, view):
+        if super().has_permission(request, view):
+            return True
         
-        return False
+        # ตรวจสอบ Django built-in permissions
+        required_permission = self.get_required_permissions(view)
+        return request.user.is_authenticated and request.user.has_perm(required_permission)
 
 class IsAdminUser(permissions.BasePermission):
     """
@@ -90,49 +106,7 @@ class HasProjectPermission(permissions.BasePermission):
             return True
         
         # ตรวจสอบ permission สำหรับ project management
-        return self._has_custom_permission(request.user, 'project_management')
-    
-    def has_object_permission(self, request, view, obj):
-        if not request.user.is_authenticated:
-            return False
-        
-        if request.user.is_superuser or request.user.is_staff:
-            return True
-        
-        # ตรวจสอบว่าผู้ใช้เป็นเจ้าของโปรเจคหรือมีสิทธิ์ในโปรเจคนี้
-        if hasattr(obj, 'agent_assignments'):
-            return obj.agent_assignments.filter(
-                agent=request.user,
-                is_active=True
-            ).exists()
-        
-        return False
-    
-    def _has_custom_permission(self, user, permission_name):
-        """
-        ตรวจสอบ custom permission
-        """
-        user_roles = UserRole.objects.filter(
-            user=user,
-            is_active=True,
-            role__is_active=True
-        )
-        
-        for user_role in user_roles:
-            if user_role.is_expired:
-                continue
-            
-            role_permissions = RolePermission.objects.filter(
-                role=user_role.role,
-                is_active=True,
-                permission__is_active=True,
-                permission__name=permission_name
-            )
-            
-            if role_permissions.exists():
-                return True
-        
-        return False
+        return request_has_permissions(request, 'project_management')
 
 class HasUserManagementPermission(permissions.BasePermission):
     """
@@ -146,33 +120,7 @@ class HasUserManagementPermission(permissions.BasePermission):
         if request.user.is_superuser or request.user.is_staff:
             return True
         
-        return self._has_custom_permission(request.user, 'user_management')
-    
-    def _has_custom_permission(self, user, permission_name):
-        """
-        ตรวจสอบ custom permission
-        """
-        user_roles = UserRole.objects.filter(
-            user=user,
-            is_active=True,
-            role__is_active=True
-        )
-        
-        for user_role in user_roles:
-            if user_role.is_expired:
-                continue
-            
-            role_permissions = RolePermission.objects.filter(
-                role=user_role.role,
-                is_active=True,
-                permission__is_active=True,
-                permission__name=permission_name
-            )
-            
-            if role_permissions.exists():
-                return True
-        
-        return False
+        return request_has_permissions(request, 'user_management')
 
 class HasRoleManagementPermission(permissions.BasePermission):
     """
@@ -186,33 +134,7 @@ class HasRoleManagementPermission(permissions.BasePermission):
         if request.user.is_superuser or request.user.is_staff:
             return True
         
-        return self._has_custom_permission(request.user, 'role_management')
-    
-    def _has_custom_permission(self, user, permission_name):
-        """
-        ตรวจสอบ custom permission
-        """
-        user_roles = UserRole.objects.filter(
-            user=user,
-            is_active=True,
-            role__is_active=True
-        )
-        
-        for user_role in user_roles:
-            if user_role.is_expired:
-                continue
-            
-            role_permissions = RolePermission.objects.filter(
-                role=user_role.role,
-                is_active=True,
-                permission__is_active=True,
-                permission__name=permission_name
-            )
-            
-            if role_permissions.exists():
-                return True
-        
-        return False
+        return request_has_permissions(request, 'role_management')
 
 # Utility functions สำหรับจัดการ permissions
 def create_django_permission_from_custom(custom_permission):
@@ -227,48 +149,128 @@ def create_django_permission_from_custom(custom_permission):
     )
     return django_perm
 
-def sync_role_with_django_group(role):
+def get_django_permission_ids(custom_permissions):
+    """
+    ดึง id ของ Django Permission ที่ตรงกับ custom permissions (สร้างที่ยังไม่มีด้วย bulk insert)
+    custom_permissions เป็น list ของ (name, description) คืนค่า dict {codename: id}
     """
-    ซิงค์ Role กับ Django Group
+    names = dict(custom_permissions)
+    if not names:
+        return {}
+    # get_for_model ถูก cache ไว้ใน process จึงไม่ query ซ้ำ
+    content_type = ContentType.objects.get_for_model(Permission)
+    django_perms = DjangoPermission.objects.filter(content_type=content_type)
+    ids = dict(django_perms.filter(codename__in=names).values_list('codename', 'id'))
+    missing = [codename for codename in names if codename not in ids]
+    if missing:
+        DjangoPermission.objects.bulk_create(
+            [
+                DjangoPermission(codename=codename, name=names[codename] or codename, content_type=content_type)
+                for codename in missing
+            ],
+            ignore_conflicts=True
+        )
+        ids.update(django_perms.filter(codename__in=missing).values_list('codename', 'id'))
+    return ids
+
+def sync_roles_with_django_groups(roles):
+    """
+    ซิงค์หลาย Role กับ Django Group พร้อมกัน (รวม permissions ที่สืบทอดจาก role แม่)
+    เปรียบเทียบ permissions ปัจจุบันของแต่ละ group กับที่ควรมี แล้วเพิ่ม/ลบเฉพาะส่วนต่าง
+    จำนวน query คงที่ไม่ขึ้นกับจำนวน roles และ permissions
     """
     from django.contrib.auth.models import Group
-    
-    if not role.django_group:
-        role.django_group, created = Group.objects.get_or_create(name=f"role_{role.name}")
-    
-    # อัปเดต permissions ใน Django Group
-    role.django_group.permissions.clear()
-    for role_perm in role.role_permissions.filter(is_active=True):
-        django_perm = create_django_permission_from_custom(role_perm.permission)
-        role.django_group.permissions.add(django_perm)
-    
+
+    roles = list(roles)
+    for role in roles:
+        if not role.django_group:
+            role.django_group, created = Group.objects.get_or_create(name=f"role_{role.name}")
+            # บันทึกการเชื่อมโยงด้วย update() เพื่อไม่ให้ save() เขียนทับ fields อื่นของ role
+            Role.objects.filter(pk=role.pk).update(django_group=role.django_group)
+    if not roles:
+        return roles
+
+    # ancestors ของแต่ละ role (รวมตัวเอง)
+    role_ids = [role.pk for role in roles]
+    ancestors = {role_id: {role_id} for role_id in role_ids}
+    for ancestor_id, descendant_id in RoleClosure.objects.filter(
+        descendant_id__in=role_ids
+    ).values_list('ancestor_id', 'descendant_id'):
+        ancestors[descendant_id].add(ancestor_id)
+
+    # permissions ที่กำหนดตรงให้ ancestors ทั้งหมด
+    all_ancestor_ids = set().union(*ancestors.values())
+    granted = {}
+    custom_permissions = {}
+    for role_id, name, description in RolePermission.objects.filter(
+        role_id__in=all_ancestor_ids,
+        role__is_active=True,
+        is_active=True
+    ).values_list('role_id', 'permission__name', 'permission__description'):
+        granted.setdefault(role_id, set()).add(name)
+        custom_permissions[name] = description
+    django_perm_ids = get_django_permission_ids(custom_permissions.items())
+
+    # เปรียบเทียบกับ permissions ปัจจุบันของแต่ละ group
+    through = Group.permissions.through
+    group_ids = {role.django_group_id for role in roles}
+    current = {group_id: set() for group_id in group_ids}
+    for group_id, permission_id in through.objects.filter(
+        group_id__in=group_ids
+    ).values_list('group_id', 'permission_id'):
+        current[group_id].add(permission_id)
+
+    to_add = []
+    to_remove = {}
+    for role in roles:
+        names = set().union(*(granted.get(ancestor_id, set()) for ancestor_id in ancestors[role.pk]))
+        desired = {django_perm_ids[name] for name in names if name in django_perm_ids}
+        existing = current[role.django_group_id]
+        to_add.extend((role.django_group_id, permission_id) for permission_id in desired - existing)
+        if existing - desired:
+            to_remove.setdefault(role.django_group_id, set()).update(existing - desired)
+        # roles หลายตัวอาจใช้ group เดียวกัน
+        current[role.django_group_id] = desired
+
+    if to_remove:
+        remove_filter = Q()
+        for group_id, permission_ids in to_remove.items():
+            remove_filter |= Q(group_id=group_id, permission_id__in=permission_ids)
+        through.objects.filter(remove_filter).delete()
+    if to_add:
+        through.objects.bulk_create(
+            [through(group_id=group_id, permission_id=permission_id) for group_id, permission_id in to_add],
+            ignore_conflicts=True
+        )
+    return roles
+
+def sync_role_with_django_group(role):
+    """
+    ซิงค์ Role กับ Django Group (รวม permissions ที่สืบทอดจาก role แม่)
+    """
+    sync_roles_with_django_groups([role])
     return role.django_group
 
-def assign_role_to_user(user, role, assigned_by=None):
+def sync_role_tree_with_django_groups(role):
+    """
+    ซิงค์ Role และทุก role ที่สืบทอดจาก role นี้กับ Django Group
+    """
+    descendants = Role.objects.filter(
+        id__in=role_hierarchy.get_descendant_ids([role.pk])
+    ).select_related('django_group')
+    sync_roles_with_django_groups(descendants)
+    return role
+
+def assign_role_to_user(user, role, assigned_by=None, expires_at=None):
     """
     กำหนด role ให้กับผู้ใช้
     """
-    user_role, created = UserRole.objects.get_or_create(
-        user=user,
-        role=role,
-        defaults={
-            'assigned_by': assigned_by,
-            'is_active': True
-        }
-    )
-    
-    # เพิ่มผู้ใช้เข้า Django Group
-    if role.django_group:
-        user.groups.add(role.django_group)
-    
-    return user_role
+    # upsert คำสั่งเดียว (เปิดใช้ใหม่ถ้าเคยถูกยกเลิก) และเพิ่มผู้ใช้เข้า Django Group
+    return upserts.upsert_user_role(user, role, assigned_by=assigned_by, expires_at=expires_at)
 
 def remove_role_from_user(user, role):
     """
     ลบ role ออกจากผู้ใช้
     """
-    UserRole.objects.filter(user=user, role=role).update(is_active=False)
-    
-    # ลบผู้ใช้ออกจาก Django Group
-    if role.django_group:
-        user.groups.remove(role.django_group) 
\ No newline at end of file
+    # UPDATE เดียวพร้อมอัปเดตตัวนับ, change log, effective permissions, cache และ Django Group
+    bulk_roles.revoke_role(role, [user.pk])
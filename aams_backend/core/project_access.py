@@ -0,0 +1,68 @@
+# aams_backend/core/project_access.py
+
+"""
+ชุด id ของโปรเจคที่ผู้ใช้เข้าถึงได้ (จาก AgentProjectAssignment ที่ active)
+
+- เก็บใน cache เดียวกับ permissions (core/permission_cache.py) โดยผูกกับ version รายผู้ใช้
+  ที่ signals จะเพิ่มเมื่อ AgentProjectAssignment ของผู้ใช้เปลี่ยน
+- ใน request เดียวกันจะโหลดเพียงครั้งเดียว แล้วใช้ซ้ำทั้งการกรองรายการโปรเจค (ProjectViewSet)
+  และการตรวจสอบ object permission
+"""
+
+from django.db.models import Exists, OuterRef
+
+from .models import AgentProjectAssignment
+from .permission_cache import bump_version, get_cache, get_timeout, get_version
+
+PROJECT_VERSION_KEY = 'perm:pv:{user_id}'
+PROJECT_IDS_KEY = 'perm:projects:{user_id}:{version}'
+
+
+def get_accessible_project_ids(user):
+    """
+    ดึง frozenset ของ id โปรเจคที่ผู้ใช้ได้รับมอบหมาย (ไม่มีการ query ถ้า cache hit)
+    """
+    user_id = getattr(user, 'pk', user)
+    if user_id is None:
+        return frozenset()
+
+    cache = get_cache()
+    key = PROJECT_IDS_KEY.format(
+        user_id=user_id, version=get_version(PROJECT_VERSION_KEY.format(user_id=user_id))
+    )
+    project_ids = cache.get(key)
+    if project_ids is None:
+        project_ids = frozenset(
+            AgentProjectAssignment.objects.filter(agent_id=user_id, is_active=True)
+            .order_by().values_list('project_id', flat=True)
+        )
+        cache.set(key, project_ids, get_timeout())
+    return project_ids
+
+
+def get_request_project_ids(request):
+    """ชุด id โปรเจคของผู้ใช้ใน request นี้ (โหลดครั้งเดียวต่อ request)"""
+    project_ids = getattr(request, '_accessible_project_ids', None)
+    if project_ids is None:
+        project_ids = get_accessible_project_ids(request.user)
+        request._accessible_project_ids = project_ids
+    return project_ids
+
+
+def accessible_projects_filter(user):
+    """
+    เงื่อนไข EXISTS สำหรับกรอง Project ที่ผู้ใช้เข้าถึงได้ (ไม่ต้อง JOIN + DISTINCT)
+    """
+    return Exists(
+        AgentProjectAssignment.objects.filter(
+            project_id=OuterRef('pk'),
+            agent_id=getattr(user, 'pk', user),
+            is_active=True
+        )
+    )
+
+
+def invalidate_user(user_id):
+    """ล้าง cache โปรเจคของผู้ใช้"""
+    if user_id is not None:
+        bump_version(PROJECT_VERSION_KEY.format(user_id=user_id))
@@ -0,0 +1,80 @@
+# aams_backend/core/role_expiry.py
+
+"""
+ปิดการใช้งาน UserRole ที่หมดอายุแล้ว (expires_at ผ่านไปแล้วแต่ยัง is_active=True)
+
+ทำงานเป็นชุดๆ ละ batch_size แถว แต่ละชุดอยู่ใน transaction ของตัวเอง:
+ปิด UserRole ด้วย UPDATE เดียว, ลบผู้ใช้ออกจาก Django Group ของ role นั้นด้วย DELETE เดียว
+แล้วคำนวณ effective permissions ใหม่และล้าง cache ของผู้ใช้ที่ได้รับผลกระทบ
+(ใช้ partial index user_role_expiring_idx บน expires_at WHERE is_active)
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import change_tracking, counters, effective_permissions, permission_cache, permission_index
+from .models import User, UserRole
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def expired_user_roles(now=None):
+    """UserRole ที่ยัง active แต่หมดอายุแล้ว"""
+    return UserRole.objects.filter(is_active=True, expires_at__lte=now or timezone.now())
+
+
+def _remove_group_memberships(pairs):
+    """ลบผู้ใช้ออกจาก Django Group ตามคู่ (user_id, group_id)"""
+    pairs = {(user_id, group_id) for user_id, group_id in pairs if group_id is not None}
+    if not pairs:
+        return 0
+
+    memberships = User.groups.through.objects.filter(
+        user_id__in={user_id for user_id, _ in pairs},
+        group_id__in={group_id for _, group_id in pairs},
+    ).values_list('id', 'user_id', 'group_id')
+    membership_ids = [
+        membership_id for membership_id, user_id, group_id in memberships
+        if (user_id, group_id) in pairs
+    ]
+    deleted, _ = User.groups.through.objects.filter(id__in=membership_ids).delete()
+    return deleted
+
+
+def sweep_expired_roles(batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    ปิดการใช้งาน UserRole ที่หมดอายุทั้งหมด คืนค่า (จำนวน UserRole, จำนวนผู้ใช้) ที่ได้รับผลกระทบ
+    """
+    now = now or timezone.now()
+    role_count = 0
+    user_ids = set()
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                expired_user_roles(now)
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('expires_at', 'id')
+                .values_list('id', 'user_id', 'role_id', 'role__django_group_id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            # update() ไม่ผ่าน signals จึงต้องอัปเดตตารางที่เกี่ยวข้องเอง
+            UserRole.objects.filter(id__in=[row[0] for row in batch]).update(is_active=False)
+            _remove_group_memberships((user_id, group_id) for _, user_id, _, group_id in batch)
+            counters.refresh_role_counts({role_id for _, _, role_id, _ in batch})
+
+            batch_user_ids = {user_id for _, user_id, _, _ in batch}
+            change_tracking.mark_changed(UserRole, [row[0] for row in batch])
+            change_tracking.mark_changed(User, batch_user_ids)
+            effective_permissions.refresh_users(batch_user_ids)
+            permission_cache.invalidate_users(batch_user_ids)
+            permission_index.invalidate_user_masks(user_ids=batch_user_ids)
+
+        role_count += len(batch)
+        user_ids |= batch_user_ids
+        if len(batch) < batch_size:
+            break
+
+    return role_count, len(user_ids)
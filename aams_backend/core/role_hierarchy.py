@@ -0,0 +1,105 @@
+# aams_backend/core/role_hierarchy.py
+
+"""
+ดูแลตาราง core_role_closure ของลำดับชั้น role (Role.parent)
+
+- แถว (ancestor, descendant, depth) หมายถึง descendant สืบทอด permissions ของ ancestor
+- อัปเดตเมื่อสร้าง role หรือเปลี่ยน parent (ผ่าน signals)
+- rebuild_closure() คำนวณใหม่ทั้งหมดด้วย recursive CTE (ใช้ใน management command)
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .models import Role, RoleClosure
+
+REBUILD_CLOSURE_SQL = """
+    WITH RECURSIVE chain (ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM core_role
+        UNION ALL
+        SELECT r.parent_id, chain.descendant_id, chain.depth + 1
+        FROM chain
+        INNER JOIN core_role r ON r.id = chain.ancestor_id
+        WHERE r.parent_id IS NOT NULL AND chain.depth < %s
+    )
+    INSERT INTO core_role_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, MIN(depth) FROM chain
+    GROUP BY ancestor_id, descendant_id
+"""
+
+
+def get_descendant_ids(role_ids):
+    """id ของ roles ที่สืบทอดจาก role_ids (รวม role_ids เอง)"""
+    return set(
+        RoleClosure.objects.filter(ancestor_id__in=role_ids).values_list('descendant_id', flat=True)
+    ) | set(role_ids)
+
+
+def get_ancestor_ids(role_id):
+    """id ของ roles ที่ role นี้สืบทอด permissions มา (รวมตัวเอง)"""
+    return set(
+        RoleClosure.objects.filter(descendant_id=role_id).values_list('ancestor_id', flat=True)
+    ) | {role_id}
+
+
+def attach(role):
+    """
+    อัปเดต closure ของ role และ roles ที่สืบทอดจาก role นี้หลังสร้าง role หรือเปลี่ยน parent
+    คืนค่า id ของ roles ที่ได้รับผลกระทบ
+    """
+    with transaction.atomic():
+        RoleClosure.objects.get_or_create(ancestor=role, descendant=role, defaults={'depth': 0})
+
+        subtree = list(RoleClosure.objects.filter(ancestor=role).values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, _ in subtree]
+
+        # ตัดความสัมพันธ์กับ ancestors เดิมที่อยู่นอก subtree
+        RoleClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+        if role.parent_id:
+            ancestors = RoleClosure.objects.filter(descendant_id=role.parent_id).values_list('ancestor_id', 'depth')
+            RoleClosure.objects.bulk_create([
+                RoleClosure(
+                    ancestor_id=ancestor_id,
+                    descendant_id=descendant_id,
+                    depth=ancestor_depth + descendant_depth + 1
+                )
+                for ancestor_id, ancestor_depth in ancestors
+                for descendant_id, descendant_depth in subtree
+            ])
+
+    return subtree_ids
+
+
+def find_cyclic_roles():
+    """หาชื่อ roles ที่อยู่ในวงจรของ Role.parent (ข้อมูลที่แก้ไขตรงในฐานข้อมูล)"""
+    parents = dict(Role.objects.values_list('id', 'parent_id'))
+    names = dict(Role.objects.values_list('id', 'name'))
+    cyclic = set()
+    for role_id in parents:
+        seen = set()
+        current = role_id
+        while current is not None and current not in seen:
+            seen.add(current)
+            current = parents.get(current)
+        if current == role_id:
+            cyclic.add(names[role_id])
+    return sorted(cyclic)
+
+
+def rebuild_closure():
+    """
+    สร้าง core_role_closure ใหม่ทั้งหมดจาก Role.parent ด้วย recursive CTE คืนค่าจำนวนแถว
+    ถ้าพบวงจรในข้อมูลจะ raise ValidationError โดยไม่แก้ไขตาราง
+    """
+    cyclic_roles = find_cyclic_roles()
+    if cyclic_roles:
+        raise ValidationError(f"พบวงจรในลำดับชั้นของ role: {', '.join(cyclic_roles)}")
+
+    max_depth = Role.objects.count()
+    with transaction.atomic():
+        RoleClosure.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_CLOSURE_SQL, [max_depth])
+
+    return RoleClosure.objects.count()
@@ -2,7 +2,7 @@
 
 from rest_framework import serializers
 from django.contrib.auth.models import Group
-from .models import Project, User, AgentProjectAssignment, Role, Permission, UserRole, RolePermission # Import Model ทั้งหมดที่เกี่ยวข้อง
+from .models import Project, User, AgentProjectAssignment, Role, Permission, UserRole, RolePermission, ROLE_CYCLE_MESSAGE # Import Model ทั้งหมดที่เกี่ยวข้อง
 
 # 1. Serializer สำหรับ Group (Role)
 # ใช้สำหรับอ่านข้อมูล Group เพื่อไปแสดงเป็นตัวเลือกใน Frontend
@@ -14,18 +14,13 @@ class GroupSerializer(serializers.ModelSerializer):
 
 # 2. Serializer สำหรับ Project
 class ProjectSerializer(serializers.ModelSerializer):
-    user_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = Project
         # ระบุฟิลด์ทั้งหมดที่ต้องการให้ API ส่งออกไป
         fields = ['id', 'name', 'description', 'is_active', 'created_at', 'updated_at', 'user_count']
         # กำหนดให้ฟิลด์ 'created_at' เป็นแบบอ่านอย่างเดียว (Frontend แก้ไขไม่ได้)
+        # user_count เป็นตัวนับที่ signals อัปเดตไว้ (ดู core/counters.py)
         read_only_fields = ['id', 'created_at', 'updated_at', 'user_count']
-    
-    def get_user_count(self, obj):
-        """นับจำนวนผู้ใช้ที่อยู่ในโครงการนี้"""
-        return obj.agent_assignments.filter(is_active=True, agent__is_active=True).count()
 
 
 # 3. Serializer สำหรับ User
@@ -41,16 +36,22 @@ class UserSerializer(serializers.ModelSerializer):
             'id', 'username', 'email', 'first_name', 'last_name',
             'employee_id', 'position', 'department', 'phone', 'address',
             'date_of_birth', 'hire_date', 'termination_date', 'is_active', 'is_staff', 'is_superuser',
-            'date_joined', 'groups', 'user_roles', 'password'
+            'date_joined', 'updated_at', 'groups', 'user_roles', 'password'
         ]
-        read_only_fields = ['id', 'date_joined']
+        read_only_fields = ['id', 'date_joined', 'updated_at']
     
     def get_groups(self, obj):
+        # ใช้ข้อมูลที่ prefetch ไว้ใน UserViewSet (ไม่มีการ query เพิ่ม)
         return [group.name for group in obj.groups.all()]
     
     def get_user_roles(self, obj):
         try:
-            active_roles = obj.user_roles.filter(is_active=True, role__is_active=True)
+            # ใช้ active_user_roles ที่ prefetch ไว้ (ดู prefetch_user_relations ใน views.py) ถ้ามี
+            active_roles = getattr(obj, 'active_user_roles', None)
+            if active_roles is None:
+                active_roles = obj.user_roles.filter(
+                    is_active=True, role__is_active=True
+                ).select_related('role')
             return [
                 {
                     'id': user_role.id,
@@ -148,26 +149,34 @@ class UserSerializer(serializers.ModelSerializer):
 
 # 4. Serializer สำหรับ Role
 class RoleSerializer(serializers.ModelSerializer):
-    permission_count = serializers.SerializerMethodField()
-    user_count = serializers.SerializerMethodField()
     permissions = serializers.SerializerMethodField()
+    parent_name = serializers.CharField(source='parent.name', read_only=True)
     
     class Meta:
         model = Role
         fields = [
-            'id', 'name', 'description', 'color', 'is_active',
+            'id', 'name', 'description', 'color', 'is_active', 'parent', 'parent_name',
             'created_at', 'updated_at', 'permission_count', 'user_count', 'permissions'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        # permission_count และ user_count เป็นตัวนับที่ signals อัปเดตไว้ (ดู core/counters.py)
+        read_only_fields = ['id', 'created_at', 'updated_at', 'permission_count', 'user_count']
     
-    def get_permission_count(self, obj):
-        return obj.role_permissions.filter(is_active=True, permission__is_active=True).count()
+    def validate_parent(self, value):
+        if self.instance and self.instance.would_create_cycle(value):
+            raise serializers.ValidationError(ROLE_CYCLE_MESSAGE)
+        return value
     
-    def get_user_count(self, obj):
-        return obj.user_roles.filter(is_active=True, user__is_active=True).count()
+    # ค่า active_role_permissions มาจาก prefetch_role_permissions ใน views.py
+    def _get_active_role_permissions(self, obj):
+        active_role_permissions = getattr(obj, 'active_role_permissions', None)
+        if active_role_permissions is None:
+            active_role_permissions = obj.role_permissions.filter(
+                is_active=True, permission__is_active=True
+            ).select_related('permission')
+        return active_role_permissions
     
     def get_permissions(self, obj):
-        active_permissions = obj.role_permissions.filter(is_active=True, permission__is_active=True)
+        active_permissions = self._get_active_role_permissions(obj)
         return [
             {
                 'id': role_perm.permission.id,
@@ -234,4 +243,14 @@ class AgentProjectAssignmentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'assigned_at']
 
+# 9. Serializer สำหรับข้อมูลผู้ใช้แบบย่อ (ใช้ในรายการผู้ใช้ที่มี role/permission)
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = [
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'employee_id', 'position', 'department', 'is_active'
+        ]
+        read_only_fields = fields
+
 # (อาจจะมี Serializer อื่นๆ ในอนาคต เช่น AgentProjectAssignmentSerializer)
\ No newline at end of file
@@ -0,0 +1,273 @@
+# aams_backend/core/signals.py
+
+"""
+Signals สำหรับล้าง cache ของ permissions และโปรเจคที่เข้าถึงได้, อัปเดต bitmask index,
+closure ของลำดับชั้น role, ตาราง core_effective_permission, ตัวนับสรุป (core/counters.py)
+และ version ของตาราง (core/change_tracking.py) เมื่อข้อมูล role/permission/ผู้ใช้/โปรเจคเปลี่ยน
+(ถูก import ใน CoreConfig.ready)
+"""
+
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import change_tracking, counters, effective_permissions, permission_cache, permission_index, project_access, role_hierarchy
+from .authentication import deactivated_users
+from .models import AgentProjectAssignment, Permission, Project, Role, RolePermission, User, UserRole
+
+# ฟิลด์ที่ถ้าเปลี่ยนแล้วมีผลกับ effective permissions ของผู้ใช้หรือตัวนับสรุป
+# (ฟิลด์สิทธิ์ของ User ถูกฝังอยู่ใน JWT permission claims ด้วย)
+USER_PERMISSION_FIELDS = ('is_active', 'is_staff', 'is_superuser')
+
+TRACKED_FIELDS = {
+    Role: ('is_active', 'parent_id'),
+    Permission: ('is_active', 'name'),
+    User: USER_PERMISSION_FIELDS + ('department',),
+    UserRole: ('user_id', 'role_id', 'is_active'),
+    RolePermission: ('role_id', 'permission_id', 'is_active'),
+    AgentProjectAssignment: ('agent_id', 'project_id', 'is_active'),
+}
+
+
+@receiver(post_init, sender=Role)
+@receiver(post_init, sender=Permission)
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=UserRole)
+@receiver(post_init, sender=RolePermission)
+@receiver(post_init, sender=AgentProjectAssignment)
+def remember_tracked_fields(sender, instance, **kwargs):
+    """เก็บค่าเดิมของฟิลด์ที่ติดตามไว้ เพื่อเทียบตอน save"""
+    # ฟิลด์ที่ถูก defer (เช่น User ที่สร้างจาก token claims) จะไม่มีค่าเดิม
+    instance._tracked_initial = {
+        field: instance.__dict__[field] for field in TRACKED_FIELDS[sender] if field in instance.__dict__
+    }
+
+
+def tracked_fields_changed(instance, fields=None):
+    initial = getattr(instance, '_tracked_initial', {})
+    return any(
+        initial.get(field) != getattr(instance, field)
+        for field in fields or TRACKED_FIELDS[type(instance)]
+    )
+
+
+def counter_values(instance, created=False, deleted=False):
+    """
+    คืนค่า (ค่าเดิม, ค่าใหม่) ของฟิลด์ที่ติดตามเป็น tuple สำหรับ core/counters.py
+    (None หมายถึงไม่มีแถวนั้น เช่น ก่อนสร้างหรือหลังลบ)
+    """
+    fields = TRACKED_FIELDS[type(instance)]
+    initial = getattr(instance, '_tracked_initial', {})
+    old = None if created else tuple(initial.get(field) for field in fields)
+    new = None if deleted else tuple(getattr(instance, field) for field in fields)
+    return old, new
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+@receiver(post_save, sender=RolePermission)
+@receiver(post_delete, sender=RolePermission)
+@receiver(post_save, sender=AgentProjectAssignment)
+@receiver(post_delete, sender=AgentProjectAssignment)
+def table_changed(sender, instance, update_fields=None, **kwargs):
+    # last_login ถูกบันทึกทุกครั้งที่ login และไม่ได้แสดงใน API
+    if sender is User and update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    # (receiver นี้ต้องอยู่ก่อน receivers อื่นที่เรียก remember_tracked_fields เพื่อให้ยังเห็นค่าเดิม)
+    initial = getattr(instance, '_tracked_initial', {})
+    # ผู้ใช้ที่ได้รับ event (แถวที่ถูกลบแล้วหาจากฐานข้อมูลไม่ได้ จึงระบุเอง)
+    audience = None
+    if sender is UserRole:
+        audience = [instance.user_id, initial.get('user_id')]
+    elif sender is AgentProjectAssignment:
+        audience = [instance.agent_id, initial.get('agent_id')]
+    change_tracking.mark_changed(
+        sender, [instance.pk], deleted=kwargs['signal'] is post_delete, audience=audience
+    )
+
+    # แถวที่แสดงข้อมูลนี้ซ้อนอยู่ (หรือการมองเห็นขึ้นกับข้อมูลนี้) ถือว่าเปลี่ยนด้วย
+    if sender is UserRole:
+        change_tracking.mark_changed(User, [instance.user_id, initial.get('user_id')])
+    elif sender is RolePermission:
+        change_tracking.mark_changed(Role, [instance.role_id, initial.get('role_id')])
+    elif sender is AgentProjectAssignment:
+        change_tracking.mark_changed(
+            Project, [instance.project_id, initial.get('project_id')], audience=audience
+        )
+    elif sender is Permission and kwargs['signal'] is post_save:
+        change_tracking.mark_changed(
+            Role, instance.role_permissions.values_list('role_id', flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # group.user_set.clear(): ต้องจำผู้ใช้ไว้ก่อนถูกลบออก
+        instance._cleared_user_ids = list(instance.user_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            user_ids = [instance.pk]
+        elif action == 'post_clear':
+            user_ids = getattr(instance, '_cleared_user_ids', [])
+        else:
+            user_ids = pk_set or []
+        change_tracking.mark_changed(User, user_ids)
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def user_role_changed(sender, instance, created=False, **kwargs):
+    counters.apply_user_role_change(
+        *counter_values(instance, created=created, deleted=kwargs['signal'] is post_delete)
+    )
+    effective_permissions.refresh_users([instance.user_id])
+    permission_cache.invalidate_user(instance.user_id)
+    permission_index.invalidate_user_masks(user_ids=[instance.user_id])
+    remember_tracked_fields(sender, instance)
+
+
+def invalidate_role_subtree(role_ids):
+    """ล้าง cache และคำนวณ masks ของ roles และ roles ที่สืบทอดจาก roles เหล่านั้นใหม่"""
+    role_ids = role_hierarchy.get_descendant_ids(role_ids)
+    permission_cache.invalidate_roles(role_ids)
+    permission_index.rebuild_role_masks(role_ids)
+    permission_index.invalidate_user_masks(role_ids=role_ids)
+
+
+def refresh_role_subtree(role_ids):
+    """คำนวณ effective permissions และ masks ของ roles และ roles ที่สืบทอดจาก roles เหล่านั้นใหม่"""
+    effective_permissions.refresh_roles(role_hierarchy.get_descendant_ids(role_ids))
+    invalidate_role_subtree(role_ids)
+
+
+def role_permissions_changed(role_id, granted=(), revoked=()):
+    """
+    อัปเดตเฉพาะแถวของ permissions ที่เพิ่ม/นำออกจาก role ใน core_effective_permission
+    (ไม่สร้างแถวของสมาชิกทุกคนใน roles ที่สืบทอดใหม่) แล้วล้าง cache และ masks
+    """
+    effective_permissions.revoke_role_permissions(role_id, revoked)
+    effective_permissions.grant_role_permissions(role_id, granted)
+    invalidate_role_subtree([role_id])
+
+
+@receiver(post_save, sender=RolePermission)
+@receiver(post_delete, sender=RolePermission)
+def role_permission_changed(sender, instance, created=False, **kwargs):
+    deleted = kwargs['signal'] is post_delete
+    counters.apply_role_permission_change(*counter_values(instance, created=created, deleted=deleted))
+
+    initial = instance._tracked_initial
+    old = None
+    if not created and initial.get('is_active'):
+        old = (initial['role_id'], initial['permission_id'])
+    new = None if deleted or not instance.is_active else (instance.role_id, instance.permission_id)
+    if old != new:
+        if old is not None:
+            role_permissions_changed(old[0], revoked=[old[1]])
+        if new is not None:
+            role_permissions_changed(new[0], granted=[new[1]])
+    remember_tracked_fields(sender, instance)
+
+
+@receiver(post_save, sender=Role)
+def role_saved(sender, instance, created, **kwargs):
+    if created:
+        role_hierarchy.attach(instance)
+        if instance.parent_id:
+            permission_index.rebuild_role_masks([instance.pk])
+    elif tracked_fields_changed(instance):
+        if instance._tracked_initial.get('parent_id') != instance.parent_id:
+            role_hierarchy.attach(instance)
+        refresh_role_subtree([instance.pk])
+    remember_tracked_fields(sender, instance)
+
+
+@receiver(pre_delete, sender=Role)
+def remember_role_children(sender, instance, **kwargs):
+    # children จะถูกตั้ง parent เป็น NULL (SET_NULL) โดยไม่ผ่าน save()
+    instance._children_ids = list(instance.children.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Role)
+def role_deleted(sender, instance, **kwargs):
+    children = list(Role.objects.filter(id__in=getattr(instance, '_children_ids', [])))
+    for child in children:
+        role_hierarchy.attach(child)
+    change_tracking.mark_changed(Role, [child.pk for child in children])
+    if children:
+        refresh_role_subtree([child.pk for child in children])
+    # UserRole ของ role นี้ถูกลบแบบ cascade ก่อนหน้า (signals ของ UserRole ล้าง cache ของสมาชิกแล้ว)
+
+
+@receiver(post_save, sender=Permission)
+def permission_saved(sender, instance, created, **kwargs):
+    if not created and tracked_fields_changed(instance):
+        if instance._tracked_initial.get('is_active') != instance.is_active:
+            counters.apply_permission_activation(instance.pk, instance.is_active)
+        effective_permissions.refresh_permissions([instance.pk])
+        role_ids = role_hierarchy.get_descendant_ids(
+            list(instance.role_permissions.values_list('role_id', flat=True))
+        )
+        permission_cache.invalidate_roles(role_ids)
+        permission_index.rebuild_role_masks(role_ids)
+        permission_index.invalidate_user_masks(role_ids=role_ids)
+    remember_tracked_fields(sender, instance)
+
+
+def initial_user_counter_values(instance):
+    """(is_active, department) เดิมของผู้ใช้ หรือ None ถ้าไม่ได้โหลดฟิลด์เหล่านี้มา"""
+    initial = getattr(instance, '_tracked_initial', {})
+    if 'is_active' not in initial or 'department' not in initial:
+        return None
+    return initial['is_active'], initial['department']
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.apply_user_change(None, (instance.is_active, instance.department))
+    else:
+        old = initial_user_counter_values(instance)
+        if old is not None:
+            counters.apply_user_change(old, (instance.is_active, instance.department))
+            if old[0] != instance.is_active:
+                counters.apply_user_activation(instance.pk, instance.is_active)
+    if not created and tracked_fields_changed(instance, USER_PERMISSION_FIELDS):
+        permission_cache.invalidate_user(instance.pk)
+        if instance.is_active:
+            deactivated_users.discard(instance.pk)
+        else:
+            deactivated_users.add(instance.pk)
+    remember_tracked_fields(sender, instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    old = initial_user_counter_values(instance)
+    if old is not None:
+        counters.apply_user_change(old, None)
+    # token ของผู้ใช้ที่ถูกลบต้องใช้ไม่ได้ทันที
+    permission_cache.invalidate_user(instance.pk)
+    deactivated_users.add(instance.pk)
+
+
+@receiver(post_save, sender=AgentProjectAssignment)
+@receiver(post_delete, sender=AgentProjectAssignment)
+def project_assignment_changed(sender, instance, created=False, **kwargs):
+    counters.apply_project_assignment_change(
+        *counter_values(instance, created=created, deleted=kwargs['signal'] is post_delete)
+    )
+    project_access.invalidate_user(instance.agent_id)
+    # ถ้าย้าย assignment ไปให้ผู้ใช้อื่น ต้องล้าง cache ของผู้ใช้เดิมด้วย
+    previous_agent_id = getattr(instance, '_tracked_initial', {}).get('agent_id')
+    if previous_agent_id != instance.agent_id:
+        project_access.invalidate_user(previous_agent_id)
+    remember_tracked_fields(sender, instance)
@@ -1,3 +1,1383 @@
-from django.test import TestCase
+import asyncio
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import (
+    User, Role, RoleClosure, Permission, UserRole, RolePermission, Project, AgentProjectAssignment, GroupSyncJob,
+    PermissionVersion, EffectivePermission, DepartmentSummary, RoleCycleError,
+)
+from . import (
+    change_tracking, counters, dashboard, effective_permissions, events, group_sync, permission_cache, permissions,
+    project_access, role_expiry, role_hierarchy,
+)
+from .authentication import StatelessJWTAuthentication, deactivated_users
+from .event_stream import event_stream
+from .permissions import (
+    assign_role_to_user, remove_role_from_user, sync_role_tree_with_django_groups, sync_role_with_django_group,
+)
+from .serializers import RoleSerializer
+from .tokens import add_permission_claims
+
+
+class BaseTestCase(TestCase):
+    """TestCase ที่ล้าง cache ทุกตัวก่อนแต่ละ test (cache ไม่ถูก rollback ไปพร้อมฐานข้อมูล)"""
+
+    def setUp(self):
+        for backend in caches.all():
+            backend.clear()
+
+
+class PermissionCacheTest(BaseTestCase):
+    """ชุด permissions ของผู้ใช้มาจาก cache และถูกล้างเมื่อ roles หรือ permissions เปลี่ยน"""
+
+    def setUp(self):
+        super().setUp()
+        self.permission = Permission.objects.create(name='project_view')
+        self.role = Role.objects.create(name='Agent')
+        RolePermission.objects.create(role=self.role, permission=self.permission)
+        self.user = User.objects.create(username='agent')
+
+    def get_permissions(self):
+        return permission_cache.get_user_permissions(self.user)
+
+    def test_cached_permissions_need_no_queries(self):
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.assertEqual(self.get_permissions(), {'project_view'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_permissions(), {'project_view'})
+
+    def test_role_assignment_invalidates(self):
+        self.assertEqual(self.get_permissions(), set())
+        user_role = UserRole.objects.create(user=self.user, role=self.role)
+        self.assertEqual(self.get_permissions(), {'project_view'})
+        user_role.is_active = False
+        user_role.save()
+        self.assertEqual(self.get_permissions(), set())
+
+    def test_role_permission_changes_invalidate_members(self):
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.assertEqual(self.get_permissions(), {'project_view'})
+        RolePermission.objects.create(role=self.role, permission=Permission.objects.create(name='user_management'))
+        self.assertEqual(self.get_permissions(), {'project_view', 'user_management'})
+        RolePermission.objects.filter(role=self.role, permission=self.permission).delete()
+        self.assertEqual(self.get_permissions(), {'user_management'})
+
+    def test_permission_and_role_deactivation_invalidate(self):
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.assertEqual(self.get_permissions(), {'project_view'})
+        self.permission.is_active = False
+        self.permission.save()
+        self.assertEqual(self.get_permissions(), set())
+
+        self.permission.is_active = True
+        self.permission.save()
+        self.assertEqual(self.get_permissions(), {'project_view'})
+        self.role.is_active = False
+        self.role.save()
+        self.assertEqual(self.get_permissions(), set())
+
+
+class PermissionClaimsTest(BaseTestCase):
+    """access token มี permission claims และถูกปฏิเสธเมื่อสิทธิ์ของผู้ใช้เปลี่ยน"""
+
+    def setUp(self):
+        super().setUp()
+        self.role = Role.objects.create(name='Agent')
+        RolePermission.objects.create(role=self.role, permission=Permission.objects.create(name='project_view'))
+        self.user = User.objects.create(username='agent')
+        UserRole.objects.create(user=self.user, role=self.role)
+
+    def issue_token(self):
+        return add_permission_claims(RefreshToken.for_user(self.user).access_token, self.user)
+
+    def test_claims(self):
+        access = self.issue_token()
+        self.assertEqual(access['perms'], ['project_view'])
+        self.assertEqual(access['roles'], [self.role.pk])
+        self.assertFalse(access['is_staff'])
+
+    def test_token_does_not_outlive_next_expiring_role(self):
+        expires_at = timezone.now() + timedelta(minutes=5)
+        UserRole.objects.filter(user=self.user).update(expires_at=expires_at)
+        self.assertLessEqual(self.issue_token()['exp'], int(expires_at.timestamp()))
+
+    def test_stale_token_is_rejected(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.issue_token()}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+        RolePermission.objects.create(role=self.role, permission=Permission.objects.create(name='user_management'))
+        response = client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'permission_version_stale')
+
+
+class StatelessAuthenticationTest(BaseTestCase):
+    """token ที่มี claims ไม่ต้อง SELECT ผู้ใช้ แต่ผู้ใช้ที่ถูกปิดการใช้งานต้องถูกปฏิเสธ"""
+
+    def setUp(self):
+        super().setUp()
+        deactivated_users.clear()
+        self.addCleanup(deactivated_users.clear)
+        self.user = User.objects.create(username='agent')
+        access = RefreshToken.for_user(self.user).access_token
+        add_permission_claims(access, self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_user_is_built_from_claims(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=self.client._credentials['HTTP_AUTHORIZATION'])
+        authentication = StatelessJWTAuthentication()
+        authentication.authenticate(request)  # โหลด version และรายชื่อผู้ใช้ที่ถูกปิดเข้า cache
+        with self.assertNumQueries(0):
+            user, _ = authentication.authenticate(request)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, 'agent', True))
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deactivation_without_signals_is_seen_after_reload(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        # ปิดการใช้งานจาก process อื่น (ไม่ผ่าน signals ของ process นี้) แล้วรายชื่อใน cache หมดอายุ
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        deactivated_users.clear()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'user_inactive')
+
+
+class PermissionBitmaskTest(BaseTestCase):
+    """POST /api/permissions/check/ ตรวจสอบสิทธิ์ด้วย bitmask ของ roles และผู้ใช้"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.view, self.edit = (Permission.objects.create(name=name) for name in ('project_view', 'project_edit'))
+        self.agent = Role.objects.create(name='Agent')
+        self.lead = Role.objects.create(name='Team Lead', parent=self.agent)
+        RolePermission.objects.create(role=self.agent, permission=self.view)
+        RolePermission.objects.create(role=self.lead, permission=self.edit)
+        self.agent_user = User.objects.create(username='agent')
+        self.lead_user = User.objects.create(username='lead')
+        UserRole.objects.create(user=self.agent_user, role=self.agent)
+        UserRole.objects.create(user=self.lead_user, role=self.lead)
+
+    def check(self, *pairs):
+        response = self.client.post('/api/permissions/check/', {
+            'checks': [{'user_id': user.pk, 'permission': name} for user, name in pairs]
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [item['allowed'] for item in response.data['results']]
+
+    def test_check_uses_inherited_permissions(self):
+        self.assertEqual(self.check(
+            (self.agent_user, 'project_view'), (self.agent_user, 'project_edit'),
+            (self.lead_user, 'project_view'), (self.lead_user, 'project_edit'),
+            (self.lead_user, 'unknown'),
+        ), [True, False, True, True, False])
+
+    def test_check_follows_revoke_and_expiry(self):
+        role_permission = RolePermission.objects.get(role=self.agent, permission=self.view)
+        role_permission.is_active = False
+        role_permission.save()
+        UserRole.objects.filter(user=self.lead_user).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.check((self.agent_user, 'project_view'), (self.lead_user, 'project_edit')), [False, False])
+
+    def test_check_rejects_invalid_input(self):
+        response = self.client.post('/api/permissions/check/', {'permission': 'project_view'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(self.agent_user)
+        response = self.client.post('/api/permissions/check/', {
+            'permission': 'project_view', 'user_ids': [self.agent_user.pk]
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_role_save_keeps_permission_mask(self):
+        stale = Role.objects.get(pk=self.agent.pk)
+        RolePermission.objects.create(role=self.agent, permission=self.edit)
+        stale.description = 'updated'
+        stale.save()
+        self.assertEqual(self.check((self.agent_user, 'project_edit')), [True])
+
+    def test_bit_position_retries_on_conflict(self):
+        # จำลอง permission อื่นที่จอง bit เดียวกันไปก่อน (Max ที่อ่านได้ครั้งแรกยังเป็นค่าเก่า)
+        last_position = self.edit.bit_position
+        stale_max = [{'last_position': last_position - 1}, {'last_position': last_position}]
+        with mock.patch.object(Permission.objects, 'aggregate', side_effect=stale_max):
+            permission = Permission.objects.create(name='report_view')
+        self.assertEqual(permission.bit_position, last_position + 1)
+
+
+class EffectivePermissionTest(BaseTestCase):
+    """แถวของ core_effective_permission หลังกำหนด/ยกเลิก roles และ permissions"""
+
+    def setUp(self):
+        super().setUp()
+        self.basic = Role.objects.create(name='Basic User')
+        self.agent = Role.objects.create(name='Agent', parent=self.basic)
+        self.view = Permission.objects.create(name='project_view')
+        self.manage = Permission.objects.create(name='project_management')
+        RolePermission.objects.create(role=self.basic, permission=self.view)
+        self.user = User.objects.create(username='agent')
+
+    def rows(self):
+        return set(EffectivePermission.objects.values_list('user__username', 'permission__name', 'source_role__name'))
+
+    def test_grant_and_revoke(self):
+        expires_at = timezone.now() + timedelta(days=1)
+        user_role = UserRole.objects.create(user=self.user, role=self.agent, expires_at=expires_at)
+        # permission ที่สืบทอดจาก role แม่มี source_role เป็น role ที่ผู้ใช้ได้รับโดยตรง
+        self.assertEqual(self.rows(), {('agent', 'project_view', 'Agent')})
+        self.assertEqual(EffectivePermission.objects.get().expires_at, expires_at)
+
+        grant = RolePermission.objects.create(role=self.agent, permission=self.manage)
+        self.assertEqual(self.rows(), {('agent', 'project_view', 'Agent'), ('agent', 'project_management', 'Agent')})
+
+        grant.is_active = False
+        grant.save()
+        self.assertEqual(self.rows(), {('agent', 'project_view', 'Agent')})
+
+        user_role.is_active = False
+        user_role.save()
+        self.assertEqual(self.rows(), set())
+
+    def test_inactive_roles_and_permissions_grant_nothing(self):
+        UserRole.objects.create(user=self.user, role=self.agent)
+        self.view.is_active = False
+        self.view.save()
+        self.assertEqual(self.rows(), set())
+
+        self.view.is_active = True
+        self.view.save()
+        self.basic.is_active = False
+        self.basic.save()
+        self.assertEqual(self.rows(), set())
+
+    def test_rebuild_matches_incremental_rows(self):
+        UserRole.objects.create(user=self.user, role=self.agent)
+        RolePermission.objects.create(role=self.agent, permission=self.manage)
+        before = self.rows()
+        self.assertEqual(effective_permissions.rebuild_all(), 2)
+        self.assertEqual(self.rows(), before)
+
+    def test_revoke_keeps_permission_granted_by_another_ancestor(self):
+        UserRole.objects.create(user=self.user, role=self.agent)
+        grant = RolePermission.objects.create(role=self.agent, permission=self.view)
+        grant.delete()
+        self.assertEqual(self.rows(), {('agent', 'project_view', 'Agent')})
+
+        RolePermission.objects.create(role=self.agent, permission=self.view)
+        RolePermission.objects.filter(role=self.basic, permission=self.view).delete()
+        self.assertEqual(self.rows(), {('agent', 'project_view', 'Agent')})
+
+    def test_role_permission_queries_do_not_grow_with_members(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                grant = RolePermission.objects.create(role=self.basic, permission=self.manage)
+                grant.delete()
+            return len(ctx.captured_queries)
+
+        UserRole.objects.create(user=self.user, role=self.agent)
+        expected = count_queries()
+        for i in range(20):
+            UserRole.objects.create(user=User.objects.create(username=f'user{i}'), role=self.agent)
+        self.assertEqual(count_queries(), expected)
+        self.assertEqual(EffectivePermission.objects.filter(permission=self.view).count(), 21)
+
+
+class ReverseLookupTest(BaseTestCase):
+    """รายชื่อผู้ใช้ที่มี permission หรือ role แบ่งหน้าแบบ cursor และกรองได้"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.role = Role.objects.create(name='Agent')
+        self.permission = Permission.objects.create(name='project_view')
+        RolePermission.objects.create(role=self.role, permission=self.permission)
+        self.users = [
+            User.objects.create(username=f'user{i}', department='Support' if i % 2 else 'Sales') for i in range(5)
+        ]
+        for user in self.users[:4]:
+            UserRole.objects.create(user=user, role=self.role)
+
+    def usernames(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['results']], response.data['next']
+
+    def test_holders_and_members(self):
+        for url in (f'/api/permissions/{self.permission.pk}/holders/', f'/api/roles/{self.role.pk}/users/'):
+            self.assertEqual(self.usernames(url)[0], ['user0', 'user1', 'user2', 'user3'])
+            self.assertEqual(self.usernames(f'{url}?department=Support')[0], ['user1', 'user3'])
+            self.assertEqual(self.usernames(f'{url}?q=user2')[0], ['user2'])
+
+    def test_excludes_expired_and_inactive(self):
+        user_role = UserRole.objects.get(user=self.users[0])
+        user_role.expires_at = timezone.now() - timedelta(minutes=1)
+        user_role.save()
+        self.users[1].is_active = False
+        self.users[1].save()
+        for url in (f'/api/permissions/{self.permission.pk}/holders/', f'/api/roles/{self.role.pk}/users/'):
+            self.assertEqual(self.usernames(url)[0], ['user2', 'user3'])
+
+    def test_keyset_pages(self):
+        url = f'/api/roles/{self.role.pk}/users/?page_size=3'
+        first, next_url = self.usernames(url)
+        self.assertEqual(first, ['user0', 'user1', 'user2'])
+        self.assertEqual(self.usernames(next_url), (['user3'], None))
+
+
+class RoleHierarchyTest(BaseTestCase):
+    """การป้องกันวงจรของ Role.parent และแถวของ core_role_closure หลังเปลี่ยน parent"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.basic = Role.objects.create(name='Basic User')
+        self.agent = Role.objects.create(name='Agent', parent=self.basic)
+        self.lead = Role.objects.create(name='Team Lead', parent=self.agent)
+
+    def closure(self):
+        return set(RoleClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def test_closure_rows(self):
+        self.assertEqual(self.closure(), {
+            ('Basic User', 'Basic User', 0), ('Agent', 'Agent', 0), ('Team Lead', 'Team Lead', 0),
+            ('Basic User', 'Agent', 1), ('Agent', 'Team Lead', 1), ('Basic User', 'Team Lead', 2),
+        })
+
+    def test_rejects_cycles(self):
+        before = self.closure()
+        for role, parent in ((self.basic, self.basic), (self.basic, self.lead)):
+            role.parent = parent
+            with self.assertRaises(ValidationError):
+                role.full_clean()
+            with self.assertRaises(RoleCycleError):
+                role.save()
+            role.refresh_from_db()
+
+            response = self.client.patch(f'/api/roles/{role.pk}/', {'parent': parent.pk}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('parent', response.data)
+        self.assertIsNone(Role.objects.get(pk=self.basic.pk).parent_id)
+        self.assertEqual(self.closure(), before)
+
+    def test_cycle_found_at_save_is_a_bad_request(self):
+        # role อื่นถูกแก้ไขพร้อมกันหลัง validate_parent ผ่านไปแล้ว
+        with mock.patch.object(RoleSerializer, 'validate_parent', side_effect=lambda value: value):
+            response = self.client.patch(f'/api/roles/{self.basic.pk}/', {'parent': self.lead.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.data)
+        self.assertIsNone(Role.objects.get(pk=self.basic.pk).parent_id)
+
+    def test_reparent_moves_subtree(self):
+        supervisor = Role.objects.create(name='Supervisor')
+        response = self.client.patch(f'/api/roles/{self.agent.pk}/', {'parent': supervisor.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.closure(), {
+            ('Basic User', 'Basic User', 0), ('Agent', 'Agent', 0), ('Team Lead', 'Team Lead', 0),
+            ('Supervisor', 'Supervisor', 0), ('Supervisor', 'Agent', 1), ('Agent', 'Team Lead', 1),
+            ('Supervisor', 'Team Lead', 2),
+        })
+
+        self.agent.parent = None
+        self.agent.save()
+        self.assertEqual(
+            set(RoleClosure.objects.filter(descendant=self.lead).values_list('ancestor__name', flat=True)),
+            {'Agent', 'Team Lead'}
+        )
+
+    def test_closure_lookups(self):
+        with self.assertNumQueries(1):
+            descendants = role_hierarchy.get_descendant_ids([self.agent.pk])
+        self.assertEqual(descendants, {self.agent.pk, self.lead.pk})
+        with self.assertNumQueries(1):
+            ancestors = role_hierarchy.get_ancestor_ids(self.lead.pk)
+        self.assertEqual(ancestors, {self.basic.pk, self.agent.pk, self.lead.pk})
+        self.assertEqual(role_hierarchy.get_ancestor_ids(self.basic.pk), {self.basic.pk})
+
+    def test_permissions_are_inherited_through_closure(self):
+        user = User.objects.create(username='lead')
+        UserRole.objects.create(user=user, role=self.lead)
+        RolePermission.objects.create(role=self.basic, permission=Permission.objects.create(name='project_view'))
+        self.assertEqual(permission_cache.get_user_permissions(user), {'project_view'})
+
+        # ย้าย Agent ออกจาก Basic User: Team Lead ไม่ได้รับ permissions ของ Basic User แล้ว
+        self.agent.parent = None
+        self.agent.save()
+        self.assertEqual(permission_cache.get_user_permissions(user), set())
+
+
+class ActionPermissionTest(BaseTestCase):
+    """HasActionPermission ตรวจสอบ permission ตาม action ของ viewset ไม่ใช่แค่ login"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='user0')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.role = Role.objects.create(name='Admin')
+        self.permission = Permission.objects.create(name='user_management')
+
+    def test_action_requires_permission(self):
+        project = Project.objects.create(name='Project')
+        AgentProjectAssignment.objects.create(agent=self.user, project=project)
+        self.assertEqual(self.client.get(f'/api/projects/{project.pk}/').status_code, 200)
+        response = self.client.patch(f'/api/projects/{project.pk}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.data['detail'], 'คุณไม่มีสิทธิ์แก้ไขโปรเจค')
+
+        RolePermission.objects.create(role=self.role, permission=Permission.objects.create(name='project_management'))
+        UserRole.objects.create(user=self.user, role=self.role)
+        response = self.client.patch(f'/api/projects/{project.pk}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_permissions_are_loaded_once_per_request(self):
+        project = Project.objects.create(name='Project')
+        AgentProjectAssignment.objects.create(agent=self.user, project=project)
+        with mock.patch.object(
+            permission_cache, 'get_user_permissions', wraps=permission_cache.get_user_permissions
+        ) as get_user_permissions:
+            self.client.patch(f'/api/projects/{project.pk}/', {'name': 'Renamed'}, format='json')
+        get_user_permissions.assert_called_once()
+
+    def test_regular_user_cannot_change_roles(self):
+        requests = [
+            (f'/api/roles/{self.role.pk}/assign_permission/', {'permission_id': self.permission.pk}),
+            (f'/api/roles/{self.role.pk}/remove_permission/', {'permission_id': self.permission.pk}),
+            (f'/api/users/{self.user.pk}/assign_role/', {'role_id': self.role.pk}),
+            (f'/api/users/{self.user.pk}/remove_role/', {'role_id': self.role.pk}),
+        ]
+        for url, data in requests:
+            response = self.client.post(url, data, format='json')
+            self.assertEqual(response.status_code, 403, url)
+        self.assertFalse(UserRole.objects.filter(user=self.user).exists())
+        self.assertFalse(RolePermission.objects.filter(role=self.role).exists())
+
+    def test_role_management_permission_allows_assign_permission(self):
+        manager = Role.objects.create(name='Manager')
+        RolePermission.objects.create(role=manager, permission=Permission.objects.create(name='role_management'))
+        UserRole.objects.create(user=self.user, role=manager)
+        response = self.client.post(
+            f'/api/roles/{self.role.pk}/assign_permission/', {'permission_id': self.permission.pk}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ProjectAccessTest(BaseTestCase):
+    """รายการโปรเจคของผู้ใช้ทั่วไปกรองด้วยชุด id โปรเจคใน cache (core/project_access.py)"""
+
+    def setUp(self):
+        super().setUp()
+        self.agent = User.objects.create(username='agent')
+        self.client = APIClient()
+        self.client.force_authenticate(self.agent)
+        self.assigned = Project.objects.create(name='assigned')
+        self.other = Project.objects.create(name='other')
+        self.assignment = AgentProjectAssignment.objects.create(agent=self.agent, project=self.assigned)
+
+    def project_names(self):
+        response = self.client.get('/api/projects/')
+        self.assertEqual(response.status_code, 200)
+        return [project['name'] for project in response.data['results']]
+
+    def test_list_uses_cached_project_ids(self):
+        self.assertEqual(self.project_names(), ['assigned'])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.project_names(), ['assigned'])
+        self.assertFalse(any(
+            'FROM "core_agent_project_assignment"' in query['sql'] for query in ctx.captured_queries
+        ))
+        self.assertEqual(self.client.get(f'/api/projects/{self.other.pk}/').status_code, 404)
+
+        self.assignment.is_active = False
+        self.assignment.save()
+        self.assertEqual(self.project_names(), [])
+
+    def test_accessible_project_ids_are_cached(self):
+        self.assertEqual(project_access.get_accessible_project_ids(self.agent), {self.assigned.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(project_access.get_accessible_project_ids(self.agent), {self.assigned.pk})
+
+        AgentProjectAssignment.objects.create(agent=self.agent, project=self.other)
+        self.assertEqual(project_access.get_accessible_project_ids(self.agent), {self.assigned.pk, self.other.pk})
+
+
+class RoleExpiryTest(BaseTestCase):
+    """sweep_expired_roles ปิด UserRole ที่หมดอายุเป็นชุดๆ และอัปเดตข้อมูลที่เกี่ยวข้อง"""
+
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name='role_Agent')
+        self.role = Role.objects.create(name='Agent', django_group=self.group)
+        RolePermission.objects.create(role=self.role, permission=Permission.objects.create(name='project_view'))
+        self.expires_at = timezone.now() + timedelta(minutes=1)
+        self.users = [User.objects.create(username=f'user{i}') for i in range(4)]
+        for i, user in enumerate(self.users):
+            # user3 ไม่มีวันหมดอายุ
+            UserRole.objects.create(user=user, role=self.role, expires_at=self.expires_at if i < 3 else None)
+            user.groups.add(self.group)
+
+    def test_sweep_in_batches(self):
+        self.assertEqual(Role.objects.get(pk=self.role.pk).user_count, 4)
+        later = self.expires_at + timedelta(minutes=1)
+        self.assertEqual(role_expiry.sweep_expired_roles(batch_size=2, now=later), (3, 3))
+
+        self.assertEqual(
+            set(UserRole.objects.filter(is_active=True).values_list('user__username', flat=True)), {'user3'}
+        )
+        self.assertEqual(set(self.group.user_set.values_list('username', flat=True)), {'user3'})
+        self.assertEqual(Role.objects.get(pk=self.role.pk).user_count, 1)
+        self.assertEqual(
+            set(EffectivePermission.objects.values_list('user__username', flat=True)), {'user3'}
+        )
+        self.assertEqual(role_expiry.sweep_expired_roles(now=later), (0, 0))
+
+    def test_nothing_expires_early(self):
+        self.assertEqual(role_expiry.sweep_expired_roles(), (0, 0))
+        self.assertEqual(UserRole.objects.filter(is_active=True).count(), 4)
+
+    def test_command_dry_run(self):
+        UserRole.objects.filter(user=self.users[0]).update(expires_at=timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+        call_command('sweep_expired_roles', '--dry-run', stdout=out)
+        self.assertIn('1', out.getvalue())
+        self.assertEqual(UserRole.objects.filter(is_active=True).count(), 4)
+
+
+class DashboardStatsTest(BaseTestCase):
+    """สถิติของ Dashboard อ่านจาก cache แยกตามขอบเขต และคำนวณใหม่ครั้งละ request เดียว"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.user = User.objects.create(username='agent')
+
+    def test_stats_are_cached_per_scope(self):
+        admin_stats = dashboard.get_stats(self.admin)
+        self.assertEqual(admin_stats['total_users'], 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(dashboard.get_stats(self.admin), admin_stats)
+        self.assertEqual(dashboard.get_stats(self.user)['total_users'], 1)
+
+    def test_waits_for_request_holding_the_lock(self):
+        scope = dashboard.get_scope(self.admin)
+        cache.add(dashboard.LOCK_KEY.format(scope=scope), True)
+        computed = {'total_users': 99}
+        timer = threading.Timer(0.1, cache.set, [dashboard.STATS_KEY.format(scope=scope), computed])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with mock.patch.object(dashboard, 'compute_stats') as compute_stats:
+            self.assertEqual(dashboard.get_stats(self.admin), computed)
+        compute_stats.assert_not_called()
+
+    def test_computes_when_lock_is_released_without_result(self):
+        lock_key = dashboard.LOCK_KEY.format(scope=dashboard.get_scope(self.admin))
+        cache.add(lock_key, True)
+        timer = threading.Timer(0.1, cache.delete, [lock_key])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with mock.patch.object(dashboard, 'compute_stats', return_value={'total_users': 1}) as compute_stats:
+            self.assertEqual(dashboard.get_stats(self.admin), {'total_users': 1})
+        compute_stats.assert_called_once_with(self.admin)
+
+
+class CounterDriftTest(BaseTestCase):
+    """ตัวนับที่ signals อัปเดตต้องตรงกับข้อมูลจริงหลังลบ ปิด และเปิดใช้งานใหม่"""
+
+    def setUp(self):
+        super().setUp()
+        self.role = Role.objects.create(name='Agent')
+        self.project = Project.objects.create(name='Project')
+        self.permissions = [Permission.objects.create(name=f'perm{i}') for i in range(2)]
+        for permission in self.permissions:
+            RolePermission.objects.create(role=self.role, permission=permission)
+        self.users = [User.objects.create(username=f'user{i}', department='Support') for i in range(3)]
+        for user in self.users:
+            UserRole.objects.create(user=user, role=self.role)
+            AgentProjectAssignment.objects.create(agent=user, project=self.project)
+
+    def counts(self):
+        role = Role.objects.get(pk=self.role.pk)
+        summary = DepartmentSummary.objects.get(department='Support')
+        return (
+            role.user_count, role.permission_count, Project.objects.get(pk=self.project.pk).user_count,
+            summary.total_users, summary.active_users,
+        )
+
+    def test_no_drift_after_delete_and_reactivate(self):
+        self.assertEqual(self.counts(), (3, 2, 3, 3, 3))
+
+        user = self.users[0]
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.counts(), (2, 2, 2, 3, 2))
+        user.is_active = True
+        user.save()
+        self.assertEqual(self.counts(), (3, 2, 3, 3, 3))
+
+        self.permissions[0].is_active = False
+        self.permissions[0].save()
+        self.assertEqual(self.counts()[1], 1)
+        self.permissions[0].is_active = True
+        self.permissions[0].save()
+
+        UserRole.objects.filter(user=self.users[1]).delete()
+        RolePermission.objects.filter(permission=self.permissions[1]).delete()
+        self.users[2].delete()
+        self.assertEqual(self.counts(), (1, 1, 2, 2, 2))
+        self.assertEqual(counters.reconcile(apply=False), [])
+
+    def test_reconcile_repairs_drift(self):
+        Role.objects.filter(pk=self.role.pk).update(user_count=7)
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('user_count', out.getvalue())
+        self.assertEqual(self.counts()[0], 7)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.counts()[0], 3)
+        self.assertEqual(counters.reconcile(apply=False), [])
+
+
+class UserListQueryCountTest(BaseTestCase):
+    """จำนวน query ของ GET /api/users/ ต้องคงที่ไม่ว่าจะมีผู้ใช้กี่คน"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.role = Role.objects.create(name='Agent')
+        self.group = Group.objects.create(name='role_Agent')
+
+    def create_users(self, count):
+        for i in range(count):
+            user = User.objects.create(username=f'user{User.objects.count()}')
+            UserRole.objects.create(user=user, role=self.role)
+            user.groups.add(self.group)
+
+    def test_query_count_is_constant(self):
+        # รวม query อ่าน version ของตารางสำหรับ ETag (core/conditional.py) 1 query
+        self.create_users(3)
+        # โหลด version ของ permissions ของผู้เรียกเข้า cache (ไม่นับ)
+        self.client.get('/api/users/')
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+
+        self.create_users(20)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+
+        user_data = next(u for u in response.data['results'] if u['username'] == 'user1')
+        self.assertEqual(user_data['groups'], ['role_Agent'])
+        self.assertEqual([r['role_name'] for r in user_data['user_roles']], ['Agent'])
+
+
+class UserFilterTest(BaseTestCase):
+    """ตัวกรองของ GET /api/users/ ที่หน้า UsersPage ส่งไปให้ server กรอง"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        User.objects.create(username='somchai', first_name='Somchai', email='a@example.com', department='IT')
+        User.objects.create(username='anong', first_name='Anong', email='somchai@example.com', department='HR')
+
+    def usernames(self, query):
+        response = self.client.get(f'/api/users/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(user['username'] for user in response.data['results'])
+
+    def test_search_by_limits_fields(self):
+        self.assertEqual(self.usernames('q=somchai'), ['anong', 'somchai'])
+        self.assertEqual(self.usernames('q=somchai&search_by=name'), ['somchai'])
+        self.assertEqual(self.usernames('q=somchai&search_by=email'), ['anong'])
+        self.assertEqual(self.usernames('department=HR'), ['anong'])
+
+    def test_invalid_date_is_bad_request(self):
+        for value in ('2024-02-30', 'yesterday'):
+            response = self.client.get(f'/api/users/?date_joined_from={value}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('date_joined_from', response.data['error'])
+
+
+class RoleProjectAssignmentQueryCountTest(BaseTestCase):
+    """
+    จำนวน query ของรายการ roles, projects, user-roles และ role-permissions ต้องคงที่
+    (จำนวนที่ระบุรวม query อ่าน version ของตารางสำหรับ ETag แล้ว)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.permissions = [Permission.objects.create(name=f'perm{i}') for i in range(3)]
+
+    def create_data(self, count):
+        offset = Role.objects.count()
+        for i in range(offset, offset + count):
+            role = Role.objects.create(name=f'role{i}')
+            project = Project.objects.create(name=f'project{i}')
+            for permission in self.permissions:
+                RolePermission.objects.create(role=role, permission=permission, granted_by=self.admin)
+            for j in range(2):
+                user = User.objects.create(username=f'user{i}_{j}')
+                UserRole.objects.create(user=user, role=role, assigned_by=self.admin)
+                AgentProjectAssignment.objects.create(agent=user, project=project)
+
+    def assert_constant_queries(self, url, num):
+        self.create_data(2)
+        # โหลด version ของ permissions ของผู้เรียกเข้า cache (ไม่นับ)
+        self.client.get(url)
+        with self.assertNumQueries(num):
+            self.client.get(url)
+        self.create_data(5)
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_role_list(self):
+        response = self.assert_constant_queries('/api/roles/', 3)
+        role = next(r for r in response.data if r['name'] == 'role0')
+        self.assertEqual(role['user_count'], 2)
+        self.assertEqual(role['permission_count'], 3)
+        self.assertEqual(len(role['permissions']), 3)
+
+    def test_project_list(self):
+        response = self.assert_constant_queries('/api/projects/', 2)
+        project = next(p for p in response.data['results'] if p['name'] == 'project0')
+        self.assertEqual(project['user_count'], 2)
+
+    def test_user_role_list(self):
+        self.assert_constant_queries('/api/user-roles/', 2)
+
+    def test_role_permission_list(self):
+        self.assert_constant_queries('/api/role-permissions/', 2)
+
+    def test_role_permission_list_for_regular_user(self):
+        self.create_data(1)
+        user = User.objects.get(username='user0_0')
+        self.client.force_authenticate(user)
+        # request แรกโหลด version ของ permissions ผู้ใช้จากฐานข้อมูลเข้า cache
+        self.client.get('/api/role-permissions/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/role-permissions/')
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class PermissionVersionTest(BaseTestCase):
+    """perm_ver ใน token อ่านจากฐานข้อมูล และเปลี่ยนเฉพาะผู้ใช้ที่สิทธิ์เปลี่ยนจริง"""
+
+    def setUp(self):
+        super().setUp()
+        self.permission = Permission.objects.create(name='project_view')
+        self.agent_role = Role.objects.create(name='Agent')
+        self.qa_role = Role.objects.create(name='QA')
+        self.agent = User.objects.create(username='agent')
+        self.qa = User.objects.create(username='qa')
+        UserRole.objects.create(user=self.agent, role=self.agent_role)
+        UserRole.objects.create(user=self.qa, role=self.qa_role)
+
+    def get_me(self, user):
+        access = RefreshToken.for_user(user).access_token
+        add_permission_claims(access, user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return lambda: client.get('/api/users/me/').status_code
+
+    def test_token_survives_cache_clear(self):
+        get_me = self.get_me(self.agent)
+        permission_cache.get_cache().clear()
+        self.assertEqual(get_me(), 200)
+
+    def test_role_permission_change_only_affects_members(self):
+        get_agent, get_qa = self.get_me(self.agent), self.get_me(self.qa)
+        RolePermission.objects.create(role=self.agent_role, permission=self.permission)
+        self.assertEqual(get_agent(), 401)
+        self.assertEqual(get_qa(), 200)
+
+    def test_stale_cached_version_is_checked_against_database(self):
+        # token ออกโดย process อื่นหลังเพิ่ม version แต่ cache ของ process นี้ยังเป็นค่าเดิม
+        key = f'perm:uv:{self.agent.pk}'
+        _, cached_version, _ = permission_cache.get_versions(self.agent.pk)
+        PermissionVersion.objects.filter(key=key).update(version=cached_version + 1)
+        permission_cache.get_cache().delete(key)
+        get_me = self.get_me(self.agent)
+        permission_cache.get_cache().set(key, cached_version)
+        self.assertEqual(get_me(), 200)
+
+    def test_new_token_uses_database_version(self):
+        # process อื่นเพิ่ม version ไปแล้ว แต่ cache ของ process นี้ยังเป็นค่าเดิม
+        key = f'perm:uv:{self.agent.pk}'
+        global_version, cached_version, role_version = permission_cache.get_versions(self.agent.pk)
+        PermissionVersion.objects.update_or_create(key=key, defaults={'version': cached_version + 1})
+        access = add_permission_claims(RefreshToken.for_user(self.agent).access_token, self.agent)
+        self.assertEqual(access['perm_ver'], f'{global_version}.{cached_version + 1}.{role_version}')
+
+
+class ConditionalGetTest(BaseTestCase):
+    """GET ที่ส่ง If-None-Match ตรงกับ ETag ปัจจุบันต้องได้ 304 โดยไม่ query ข้อมูลจริง"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.role = Role.objects.create(name='Agent')
+
+    def test_not_modified_until_data_changes(self):
+        etag = self.client.get('/api/roles/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/roles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # user_count ของ role เปลี่ยนเมื่อมีการกำหนด role ให้ผู้ใช้ (version เพิ่มหลัง commit)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserRole.objects.create(user=User.objects.create(username='user0'), role=self.role)
+        response = self.client.get('/api/roles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_table_version_is_bumped_after_commit(self):
+        before = change_tracking.get_versions([Role])
+        with self.captureOnCommitCallbacks() as callbacks:
+            Role.objects.create(name='QA')
+            # ระหว่าง transaction ไม่มีการ UPDATE แถว version ของตาราง
+            self.assertEqual(change_tracking.get_versions([Role]), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(change_tracking.get_versions([Role]), before)
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get('/api/users/me/')['ETag']
+        self.client.force_authenticate(User.objects.create(username='user0'))
+        response = self.client.get('/api/users/me/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(AAMS_SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTest(BaseTestCase):
+    """?updated_since= ส่งเฉพาะแถวที่เปลี่ยน และ tombstone ของแถวที่ถูกลบหรือมองไม่เห็นแล้ว"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        # บันทึกการเปลี่ยนแปลงถูกเขียนหลัง commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roles = [Role.objects.create(name=f'role{i}') for i in range(3)]
+
+    def test_changes_since_cursor(self):
+        response = self.client.get('/api/roles/?updated_since=0')
+        self.assertEqual(len(response.data['results']), 3)
+        cursor = response.data['next_cursor']
+
+        deleted_id = self.roles[2].pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roles[2].delete()
+            RolePermission.objects.create(
+                role=self.roles[0], permission=Permission.objects.create(name='perm0'), granted_by=self.admin
+            )
+        response = self.client.get(f'/api/roles/?updated_since={cursor}')
+        self.assertEqual([r['name'] for r in response.data['results']], ['role0'])
+        self.assertEqual(response.data['results'][0]['permission_count'], 1)
+        self.assertEqual(response.data['deleted'], [deleted_id])
+
+    def test_deactivated_rows_are_tombstones_for_regular_users(self):
+        self.client.force_authenticate(User.objects.create(username='user0'))
+        cursor = self.client.get('/api/roles/?updated_since=0').data['next_cursor']
+        self.roles[1].is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roles[1].save()
+        response = self.client.get(f'/api/roles/?updated_since={cursor}')
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['deleted'], [self.roles[1].pk])
+
+    def test_latest_cursor(self):
+        cursor = self.client.get('/api/roles/?updated_since=latest').data['next_cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roles[1].description = 'changed'
+            self.roles[1].save()
+        response = self.client.get(f'/api/roles/?updated_since={cursor}')
+        self.assertEqual([r['name'] for r in response.data['results']], ['role1'])
+
+    def test_late_commit_is_not_skipped(self):
+        # transaction ที่เริ่มก่อนแต่ commit หลังจาก cursor ของ client ผ่านการเปลี่ยนแปลงอื่นไปแล้ว
+        with self.captureOnCommitCallbacks() as slow_transaction:
+            self.roles[0].description = 'slow'
+            self.roles[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.roles[1].description = 'fast'
+            self.roles[1].save()
+        response = self.client.get('/api/roles/?updated_since=0')
+        self.assertEqual(
+            [r['name'] for r in response.data['results']], ['role0', 'role1', 'role2']
+        )
+        cursor = response.data['next_cursor']
+
+        for callback in slow_transaction:
+            callback()
+        response = self.client.get(f'/api/roles/?updated_since={cursor}')
+        self.assertEqual([r['description'] for r in response.data['results']], ['slow'])
+
+
+class EventPublishTest(BaseTestCase):
+    """event ที่ใหญ่เกิน payload ของ NOTIFY ถูกแทนด้วย refetch และการส่งที่ล้มเหลวไม่กระทบ request"""
+
+    def setUp(self):
+        super().setUp()
+        self.backend = mock.Mock()
+        patcher = mock.patch.object(events, 'get_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self):
+        return [call.args[0] for call in self.backend.publish.call_args_list]
+
+    def test_small_event_keeps_ids_and_audience(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            events.publish(Project, [1, 2], audience=[5, 3])
+        self.assertEqual(
+            self.published(),
+            [{'resource': 'projects', 'type': 'changed', 'ids': [1, 2], 'audience': [3, 5]}]
+        )
+
+    def test_oversized_event_becomes_refetch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            events.publish(Project, list(range(1, 401)), audience=range(100000, 102000))
+        self.assertEqual(self.published(), [{'resource': 'projects', 'type': 'refetch'}])
+
+    def test_publish_failure_is_logged(self):
+        self.backend.publish.side_effect = RuntimeError('payload string too long')
+        with self.assertLogs('core.events', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                events.publish(Project, [1], audience=[1])
+
+
+class EventStreamTest(BaseTestCase):
+    """/api/events/ เปิดด้วย ticket ที่ใช้ได้ครั้งเดียว และลงทะเบียน subscriber เมื่อเริ่มส่ง stream เท่านั้น"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='agent')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.factory = AsyncRequestFactory()
+
+    def get_ticket(self):
+        response = self.client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['ticket']
+
+    def open_stream(self, ticket):
+        return async_to_sync(event_stream)(self.factory.get('/api/events/', {'ticket': ticket}))
+
+    def test_ticket_opens_stream_once(self):
+        ticket = self.get_ticket()
+        self.assertEqual(self.open_stream(ticket).status_code, 200)
+        self.assertEqual(self.open_stream(ticket).status_code, 401)
+
+    def test_access_token_is_not_a_ticket(self):
+        access = str(RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(self.open_stream(access).status_code, 401)
+
+    def test_subscribes_only_while_streaming(self):
+        ticket = self.get_ticket()
+        before = events.broadcaster.subscriber_count()
+
+        async def stream():
+            response = await event_stream(self.factory.get('/api/events/', {'ticket': ticket}))
+            # client ตัดการเชื่อมต่อก่อนเริ่มส่ง stream: ต้องไม่มี subscriber ค้าง
+            counts = [events.broadcaster.subscriber_count()]
+            content = response.streaming_content
+            await content.__anext__()
+            counts.append(events.broadcaster.subscriber_count())
+            # client ตัดการเชื่อมต่อระหว่างรอ event: ASGI handler ยกเลิก task ที่ส่ง stream
+            task = asyncio.ensure_future(content.__anext__())
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            counts.append(events.broadcaster.subscriber_count())
+            return counts
+
+        self.assertEqual(async_to_sync(stream)(), [before, before + 1, before])
+
+
+class KeysetPaginationTest(BaseTestCase):
+    """รายการผู้ใช้แบ่งหน้าแบบ cursor และขอทั้งหมดได้ด้วย ?paginate=false"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        for i in range(6):
+            User.objects.create(username=f'user{i}')
+
+    def test_cursor_pages(self):
+        response = self.client.get('/api/users/?page_size=4')
+        first_page = [u['username'] for u in response.data['results']]
+        self.assertEqual(len(first_page), 4)
+
+        response = self.client.get(response.data['next'])
+        second_page = [u['username'] for u in response.data['results']]
+        self.assertEqual(len(second_page), 3)
+        self.assertIsNone(response.data['next'])
+        self.assertFalse(set(first_page) & set(second_page))
+
+    def test_unpaginated_opt_out(self):
+        response = self.client.get('/api/users/?paginate=false')
+        self.assertEqual(len(response.data), 7)
+
+
+class DjangoGroupSyncTest(BaseTestCase):
+    """การซิงค์ Django Group เพิ่ม/ลบเฉพาะส่วนต่าง ด้วยจำนวน query คงที่"""
+
+    def setUp(self):
+        super().setUp()
+        self.parent = Role.objects.create(name='Supervisor')
+        self.role = Role.objects.create(name='Agent', parent=self.parent)
+        self.permissions = [Permission.objects.create(name=f'perm_{i}') for i in range(50)]
+        RolePermission.objects.bulk_create(
+            [RolePermission(role=self.parent, permission=permission) for permission in self.permissions[:10]]
+            + [RolePermission(role=self.role, permission=permission) for permission in self.permissions[10:]]
+        )
+        sync_role_tree_with_django_groups(self.parent)
+        self.role = Role.objects.select_related('django_group').get(pk=self.role.pk)
+
+    def test_group_includes_inherited_permissions(self):
+        self.assertEqual(self.role.django_group.permissions.count(), 50)
+
+    def test_toggle_one_permission(self):
+        RolePermission.objects.filter(role=self.role, permission=self.permissions[-1]).update(is_active=False)
+        # ancestors, permissions ที่ควรมี, Django Permissions, permissions ปัจจุบันของ group, ลบ
+        with self.assertNumQueries(5):
+            sync_role_with_django_group(self.role)
+        self.assertFalse(
+            self.role.django_group.permissions.filter(codename=self.permissions[-1].name).exists()
+        )
+        self.assertEqual(self.role.django_group.permissions.count(), 49)
+
+
+class GroupSyncQueueTest(BaseTestCase):
+    """การแก้ไข permissions ของ role บันทึกงานซิงค์ไว้ในคิว และ drain_group_sync ซิงค์ตามข้อมูลล่าสุด"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True, is_superuser=True))
+        self.role = Role.objects.create(name='Agent')
+        self.permissions = [Permission.objects.create(name=f'perm_{i}') for i in range(3)]
+
+    def test_repeated_edits_are_coalesced(self):
+        for permission in self.permissions:
+            response = self.client.post(
+                f'/api/roles/{self.role.pk}/assign_permission/', {'permission_id': permission.pk}
+            )
+            self.assertEqual(response.status_code, 200)
+        self.client.post(f'/api/roles/{self.role.pk}/remove_permission/', {'permission_id': self.permissions[0].pk})
+        self.assertEqual(GroupSyncJob.objects.filter(role=self.role).count(), 1)
+
+        call_command('drain_group_sync', stdout=StringIO())
+        self.assertFalse(GroupSyncJob.objects.exists())
+        self.role.refresh_from_db()
+        self.assertEqual(
+            set(self.role.django_group.permissions.values_list('codename', flat=True)),
+            {'perm_1', 'perm_2'}
+        )
+
+    def test_request_during_sync_is_kept(self):
+        group_sync.request_sync([self.role.pk])
+        sync = permissions.sync_roles_with_django_groups
+
+        def sync_then_edit(roles):
+            sync(roles)
+            # admin อีกคนแก้ permissions ของ role หลังซิงค์อ่านข้อมูลไปแล้ว แต่ก่อนลบงาน
+            with mock.patch.object(group_sync.timezone, 'now', return_value=timezone.now() + timedelta(seconds=1)):
+                group_sync.request_sync([self.role.pk])
+
+        with mock.patch.object(permissions, 'sync_roles_with_django_groups', side_effect=sync_then_edit):
+            self.assertEqual(group_sync.drain_batch(), 1)
+        self.assertTrue(GroupSyncJob.objects.filter(role=self.role).exists())
+
+        self.assertEqual(group_sync.drain_batch(), 1)
+        self.assertFalse(GroupSyncJob.objects.exists())
+
+
+class BulkUserRoleTest(BaseTestCase):
+    """POST /api/user-roles/bulk/ กำหนด/ยกเลิก role ให้ผู้ใช้หลายคนด้วยจำนวน query คงที่"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.role = Role.objects.create(name='Agent', django_group=Group.objects.create(name='role_Agent'))
+        self.users = [
+            User.objects.create(username=f'user{i}', department='Sales' if i % 2 else 'QA')
+            for i in range(20)
+        ]
+
+    def bulk(self, **data):
+        return self.client.post('/api/user-roles/bulk/', {'role_id': self.role.pk, **data}, format='json')
+
+    def test_assign_and_revoke(self):
+        UserRole.objects.create(user=self.users[0], role=self.role, is_active=False)
+        response = self.bulk(operation='assign', user_ids=[self.users[0].pk, self.users[1].pk, 999999])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], {
+            self.users[0].pk: 'reactivated', self.users[1].pk: 'assigned', 999999: 'not_found'
+        })
+        self.role.refresh_from_db()
+        self.assertEqual(self.role.user_count, 2)
+        self.assertEqual(self.role.django_group.user_set.count(), 2)
+
+        response = self.bulk(operation='revoke', filter={'department': 'Sales'})
+        self.assertEqual(response.data['counts'], {'revoked': 1, 'not_assigned': 9})
+        self.assertEqual(
+            list(self.role.django_group.user_set.values_list('id', flat=True)), [self.users[0].pk]
+        )
+        self.assertFalse(UserRole.objects.get(user=self.users[1], role=self.role).is_active)
+
+    def test_query_count_does_not_depend_on_user_count(self):
+        # ครั้งแรกสร้างแถว version ของตาราง (core_table_version)
+        self.bulk(operation='assign', user_ids=[self.users[0].pk])
+        with CaptureQueriesContext(connection) as few:
+            self.bulk(operation='assign', user_ids=[user.pk for user in self.users[1:2]])
+        with CaptureQueriesContext(connection) as many:
+            self.bulk(operation='assign', user_ids=[user.pk for user in self.users[2:]])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_invalid_operation(self):
+        self.assertEqual(self.bulk(operation='toggle', user_ids=[1]).status_code, 400)
+
+    def test_invalid_input(self):
+        for data in (
+            {'role_id': 'abc', 'user_ids': [1]},
+            {'role_id': [1], 'user_ids': [1]},
+            {'user_ids': '123'},
+            {'user_ids': [True]},
+            {'user_ids': [1], 'expires_at': '2026-02-30T00:00:00'},
+        ):
+            response = self.client.post(
+                '/api/user-roles/bulk/', {'role_id': self.role.pk, 'operation': 'assign', **data}, format='json'
+            )
+            self.assertEqual(response.status_code, 400, data)
+
+
+class ReplaceRolePermissionsTest(BaseTestCase):
+    """PUT /api/roles/{id}/permissions/ แทนที่ permissions ของ role ด้วยจำนวน query คงที่"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.role = Role.objects.create(name='Agent')
+        self.permissions = [Permission.objects.create(name=f'perm_{i}') for i in range(30)]
+        RolePermission.objects.bulk_create([
+            RolePermission(role=self.role, permission=self.permissions[0], is_active=False),
+            RolePermission(role=self.role, permission=self.permissions[1]),
+            RolePermission(role=self.role, permission=self.permissions[2]),
+        ])
+
+    def put(self, permissions, role=None):
+        return self.client.put(
+            f'/api/roles/{(role or self.role).pk}/permissions/',
+            {'permission_ids': [permission.pk for permission in permissions]},
+            format='json'
+        )
+
+    def test_replace(self):
+        response = self.put(self.permissions[:2] + self.permissions[3:5])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(item['name'] for item in response.data),
+            ['perm_0', 'perm_1', 'perm_3', 'perm_4']
+        )
+        self.assertFalse(RolePermission.objects.get(role=self.role, permission=self.permissions[2]).is_active)
+        self.role.refresh_from_db()
+        self.assertEqual(self.role.permission_count, 4)
+        self.assertTrue(GroupSyncJob.objects.filter(role=self.role).exists())
+
+    def test_query_count_does_not_depend_on_permission_count(self):
+        # ครั้งแรกสร้างแถว version ของตาราง (core_table_version)
+        self.put(self.permissions[:1])
+        with CaptureQueriesContext(connection) as few:
+            self.put(self.permissions[1:3])
+        with CaptureQueriesContext(connection) as many:
+            self.put(self.permissions[3:])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_query_count_does_not_depend_on_member_count(self):
+        large = Role.objects.create(name='Large')
+        UserRole.objects.create(user=User.objects.create(username='agent'), role=self.role)
+        UserRole.objects.bulk_create([
+            UserRole(user=User.objects.create(username=f'member{i}'), role=large) for i in range(50)
+        ])
+        # ครั้งแรกสร้างแถว version ของตาราง (core_table_version) และของ role
+        self.put(self.permissions[:1])
+        self.put(self.permissions[:1], role=large)
+        for role in (self.role, large):
+            with self.assertNumQueries(23):
+                self.put(self.permissions[1:3], role=role)
+        self.assertEqual(
+            EffectivePermission.objects.filter(source_role=large, permission=self.permissions[2]).count(), 50
+        )
+        # เพิ่ม version ของ role ไม่ใช่ของสมาชิกแต่ละคน
+        self.assertFalse(PermissionVersion.objects.filter(
+            key__in=[f'perm:uv:{user_id}' for user_id in large.user_roles.values_list('user_id', flat=True)]
+        ).exists())
+
+    def test_unknown_permission(self):
+        response = self.client.put(
+            f'/api/roles/{self.role.pk}/permissions/', {'permission_ids': [999999]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class UpsertAssignmentTest(BaseTestCase):
+    """การกำหนด role/permission ใช้ upsert คำสั่งเดียวต่อการกำหนด"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.user = User.objects.create(username='user0')
+        self.role = Role.objects.create(name='Agent', django_group=Group.objects.create(name='role_Agent'))
+
+    def test_assign_role_is_one_statement(self):
+        previous = UserRole.objects.create(user=self.user, role=self.role, is_active=False)
+        # จำนวนทั้งหมด: savepoint 2 คู่, upsert 1, Django Group 1, ตัวนับ 1,
+        # effective permissions 2, version ของ permissions 1 และ permission mask 1
+        # (change log และ version ของตารางถูกเขียนหลัง commit)
+        with self.assertNumQueries(11):
+            user_role = assign_role_to_user(self.user, self.role, assigned_by=self.admin)
+        self.assertEqual(user_role.pk, previous.pk)
+        self.assertEqual(user_role.assigned_at, previous.assigned_at)
+        self.assertTrue(user_role.is_active)
+        self.role.refresh_from_db()
+        self.assertEqual(self.role.user_count, 1)
+        self.assertTrue(self.user.groups.filter(pk=self.role.django_group_id).exists())
+
+    def test_reassign_resets_expiry_and_keeps_assigned_by(self):
+        UserRole.objects.create(
+            user=self.user, role=self.role, assigned_by=self.admin, is_active=False,
+            expires_at=timezone.now() - timedelta(days=1)
+        )
+        user_role = assign_role_to_user(self.user, self.role)
+        self.assertIsNone(user_role.expires_at)
+        self.assertFalse(user_role.is_expired)
+        self.assertEqual(user_role.assigned_by_id, self.admin.pk)
+
+        expires_at = timezone.now() + timedelta(days=7)
+        user_role = assign_role_to_user(self.user, self.role, expires_at=expires_at)
+        self.assertEqual(user_role.expires_at, expires_at)
+
+    def test_remove_role_updates_counts_and_group(self):
+        assign_role_to_user(self.user, self.role)
+        remove_role_from_user(self.user, self.role)
+        self.assertFalse(UserRole.objects.get(user=self.user, role=self.role).is_active)
+        self.role.refresh_from_db()
+        self.assertEqual(self.role.user_count, 0)
+        self.assertFalse(self.user.groups.filter(pk=self.role.django_group_id).exists())
+
+    def test_assign_permission_reactivates(self):
+        permission = Permission.objects.create(name='perm_0')
+        RolePermission.objects.create(role=self.role, permission=permission, is_active=False)
+        response = self.client.post(
+            f'/api/roles/{self.role.pk}/assign_permission/', {'permission_id': permission.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RolePermission.objects.filter(role=self.role, is_active=True).count(), 1)
+        self.role.refresh_from_db()
+        self.assertEqual(self.role.permission_count, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'ต้องใช้ PostgreSQL (SQLite ล็อกทั้งฐานข้อมูล)')
+class ConcurrentAssignmentTest(TransactionTestCase):
+    """admin หลายคนกำหนด role เดียวกันพร้อมกันต้องไม่เกิด IntegrityError"""
+
+    def test_concurrent_assign_role(self):
+        user = User.objects.create(username='user0')
+        permission = Permission.objects.create(name='perm_0')
+        roles = [Role.objects.create(name=f'role_{i}') for i in range(2)]
+        for role in roles:
+            RolePermission.objects.create(role=role, permission=permission)
+        thread_count = 8
+        barrier = threading.Barrier(thread_count)
+        errors = []
+
+        def assign(role):
+            try:
+                barrier.wait()
+                assign_role_to_user(user, role)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        # กำหนดทั้ง role เดียวกันและคนละ role ให้ผู้ใช้คนเดียวกันพร้อมกัน
+        threads = [threading.Thread(target=assign, args=(roles[i % 2],)) for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for role in roles:
+            self.assertEqual(UserRole.objects.filter(user=user, role=role, is_active=True).count(), 1)
+            role.refresh_from_db()
+            self.assertEqual(role.user_count, 1)
+        self.assertEqual(user.effective_permissions.count(), 2)
+
+
+class UserExportTest(BaseTestCase):
+    """ข้อความที่ผู้ใช้กรอกต้องไม่ถูกตีความเป็นสูตรเมื่อเปิดไฟล์ที่ส่งออกใน Excel"""
+
+    def test_csv_escapes_formulas(self):
+        admin = User.objects.create(username='admin', is_staff=True, first_name='=HYPERLINK("x")')
+        User.objects.create(username='user0', department='+SUM(A1)', position='-1', last_name='Smith')
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/users/export/?file_type=csv')
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertIn('"\'=HYPERLINK(""x"")"', content)
+        self.assertIn("'+SUM(A1)", content)
+        self.assertIn("'-1", content)
+        self.assertIn('Smith', content)
+        self.assertNotIn("'Smith", content)
+
+    def test_xlsx_without_xlsxwriter_is_not_acceptable(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        with mock.patch.dict('sys.modules', {'xlsxwriter': None}):
+            response = self.client.get('/api/users/export/?file_type=xlsx')
+        self.assertEqual(response.status_code, 406)
+        self.assertIn('error', response.data)
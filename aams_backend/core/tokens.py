@@ -0,0 +1,119 @@
+# aams_backend/core/tokens.py
+
+"""
+JWT serializers ที่ฝัง permission claims ลงใน access token (เปิดใช้ด้วย settings.AAMS_JWT_PERMISSION_CLAIMS)
+
+claims ที่เพิ่ม:
+- roles: id ของ roles ที่ active และยังไม่หมดอายุ
+- perms: ชื่อ permission ทั้งหมดที่ได้จาก roles
+- username / is_staff / is_superuser (ใช้สร้าง user จาก token โดยไม่ต้อง query ดู core/authentication.py)
+- perm_ver: version ของ permissions ตอนออก token (global.user จาก core.permission_cache)
+  ถ้า admin เปลี่ยน RolePermission/UserRole ที่เกี่ยวกับผู้ใช้หลังจากนั้น token จะถูกปฏิเสธและต้อง refresh ใหม่
+  (version เก็บในฐานข้อมูล token ที่ออกโดย process หนึ่งจึงใช้กับ process อื่นได้)
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import datetime_to_epoch
+
+from . import permission_cache
+from .models import User, UserRole
+
+ROLES_CLAIM = 'roles'
+USERNAME_CLAIM = 'username'
+PERMISSIONS_CLAIM = 'perms'
+PERMISSION_VERSION_CLAIM = 'perm_ver'
+
+
+def permission_claims_enabled():
+    return getattr(settings, 'AAMS_JWT_PERMISSION_CLAIMS', False)
+
+
+def current_permission_version(user_id, refresh=False):
+    """
+    version ปัจจุบันของ permissions ผู้ใช้ ในรูปแบบเดียวกับที่เก็บใน token
+    (refresh=True อ่านจากฐานข้อมูลโดยไม่ผ่าน cache)
+    """
+    return '.'.join(str(version) for version in permission_cache.get_versions(user_id, refresh=refresh))
+
+
+def add_permission_claims(token, user):
+    """
+    เพิ่ม permission claims ลงใน access token
+    และตั้งเวลาหมดอายุไม่ให้เกินเวลาที่ role ถัดไปของผู้ใช้จะหมดอายุ
+    """
+    # อ่าน version ก่อนโหลดข้อมูล ถ้ามีการเปลี่ยนแปลงระหว่างนี้ token จะถูกมองว่าเก่าทันที
+    # (อ่านจากฐานข้อมูลโดยตรง: version ใน cache ของ process นี้อาจเก่ากว่าได้ไม่เกิน
+    # AAMS_PERMISSION_VERSION_CACHE_TIMEOUT วินาที ทำให้ token ใหม่ถูกปฏิเสธทันทีที่ใช้)
+    token[PERMISSION_VERSION_CLAIM] = current_permission_version(user.pk, refresh=True)
+
+    now = timezone.now()
+    active_roles = UserRole.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        user_id=user.pk,
+        is_active=True,
+        role__is_active=True,
+    ).values_list('role_id', 'expires_at')
+
+    role_ids = []
+    next_expiry = None
+    for role_id, expires_at in active_roles:
+        role_ids.append(role_id)
+        if expires_at and (next_expiry is None or expires_at < next_expiry):
+            next_expiry = expires_at
+
+    token[ROLES_CLAIM] = sorted(role_ids)
+    token[PERMISSIONS_CLAIM] = sorted(permission_cache.get_user_permissions(user))
+    token[USERNAME_CLAIM] = user.get_username()
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+
+    if next_expiry is not None and datetime_to_epoch(next_expiry) < token['exp']:
+        token['exp'] = datetime_to_epoch(next_expiry)
+
+    return token
+
+
+class PermissionClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    ออก token คู่ปกติ และเพิ่ม permission claims ใน access token เมื่อเปิดใช้งาน
+    (refresh token ไม่มี claims เพื่อไม่ให้ claims เก่าถูกคัดลอกตอน refresh)
+    """
+
+    def validate(self, attrs):
+        data = super(TokenObtainPairSerializer, self).validate(attrs)
+
+        refresh = self.get_token(self.user)
+        access = refresh.access_token
+        if permission_claims_enabled():
+            add_permission_claims(access, self.user)
+
+        data['refresh'] = str(refresh)
+        data['access'] = str(access)
+
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, self.user)
+
+        return data
+
+
+class PermissionClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh token และคำนวณ permission claims ใหม่ให้ access token ที่ออกใหม่
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+
+        if permission_claims_enabled():
+            access = AccessToken(data['access'])
+            user = User.objects.get(**{api_settings.USER_ID_FIELD: access[api_settings.USER_ID_CLAIM]})
+            add_permission_claims(access, user)
+            data['access'] = str(access)
+
+        return data
@@ -0,0 +1,112 @@
+# aams_backend/core/upserts.py
+
+"""
+กำหนด role ให้ผู้ใช้ และ permission ให้ role ด้วย INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+คำสั่งเดียว (แทน get_or_create ตามด้วย save() ที่ใช้ 2-3 round trips และอาจเกิด IntegrityError
+เมื่อ admin หลายคนกำหนดพร้อมกัน) คำสั่งนี้คืนค่าแถวล่าสุดในฐานข้อมูลกลับมาด้วย
+
+คำสั่ง SQL ไม่ผ่าน signals จึงต้องอัปเดตตัวนับ, change log, effective permissions และ cache เอง
+(ฟังก์ชัน user_roles_written / role_permissions_written ใช้ร่วมกับงาน bulk ใน core/bulk_roles.py)
+"""
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import change_tracking, counters, effective_permissions, group_sync, permission_cache, permission_index
+from .models import Role, RolePermission, User, UserRole
+from .signals import role_permissions_changed
+
+
+def upsert(model, values, conflict_fields, update_fields, keep_if_null=()):
+    """
+    INSERT แถวเดียว ถ้าชนกับ unique constraint ของ conflict_fields ให้ UPDATE update_fields แทน
+    values เป็น dict ของชื่อ field และค่า คืนค่า instance ของแถวหลังบันทึก (ทุก field)
+    field ใน keep_if_null จะคงค่าเดิมไว้ถ้าค่าใหม่เป็น NULL (เช่น ผู้กำหนดที่ไม่ได้ระบุ)
+    """
+    meta = model._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    fields = [meta.get_field(name) for name in values]
+    columns = ', '.join(quote(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    conflict = ', '.join(quote(meta.get_field(name).column) for name in conflict_fields)
+
+    def assignment(name):
+        column = quote(meta.get_field(name).column)
+        if name in keep_if_null:
+            return f'{column} = COALESCE(EXCLUDED.{column}, {table}.{column})'
+        return f'{column} = EXCLUDED.{column}'
+
+    updates = ', '.join(assignment(name) for name in update_fields)
+    returning = ', '.join(quote(field.column) for field in meta.concrete_fields)
+    params = [field.get_db_prep_save(values[field.name], connection) for field in fields]
+    sql = (
+        f'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+        f'ON CONFLICT ({conflict}) DO UPDATE SET {updates} RETURNING {returning}'
+    )
+    # raw() แปลงค่าจากฐานข้อมูล (เช่น datetime) และสร้าง instance ให้
+    return list(model.objects.raw(sql, params))[0]
+
+
+def user_roles_written(role_ids, user_role_ids, user_ids):
+    """อัปเดตข้อมูลที่ปกติ signals ของ UserRole ทำให้ หลังเขียน UserRole โดยไม่ผ่าน save()"""
+    role_ids = list(role_ids)
+    user_ids = list(user_ids)
+    counters.update_role_counts(role_ids)
+    change_tracking.mark_many_changed([
+        (Role, role_ids, None),
+        (UserRole, user_role_ids, user_ids),
+        (User, user_ids, None),
+    ])
+    effective_permissions.refresh_users(user_ids)
+    permission_cache.invalidate_users(user_ids)
+    permission_index.invalidate_user_masks(user_ids=user_ids)
+
+
+def role_permissions_written(role, role_permission_ids, granted=(), revoked=()):
+    """
+    อัปเดตข้อมูลที่ปกติ signals ของ RolePermission ทำให้ หลังเขียน RolePermission โดยไม่ผ่าน save()
+    granted/revoked คือ id ของ permissions ที่เพิ่ม/นำออกจาก role (อัปเดต effective permissions เฉพาะส่วนนี้)
+    """
+    counters.refresh_role_counts([role.pk])
+    change_tracking.mark_changed(RolePermission, role_permission_ids)
+    role_permissions_changed(role.pk, granted=granted, revoked=revoked)
+    group_sync.request_tree_sync(role)
+
+
+def upsert_user_role(user, role, assigned_by=None, expires_at=None):
+    """
+    กำหนด role ให้ผู้ใช้ (เปิดใช้ใหม่ถ้าเคยถูกยกเลิก) และเพิ่มผู้ใช้เข้า Django Group ของ role
+    expires_at ของแถวเดิมถูกแทนด้วยค่าที่ระบุเสมอ (None = ไม่หมดอายุ) เพื่อให้ role ที่เคยหมดอายุใช้ได้อีกครั้ง
+    """
+    with transaction.atomic():
+        user_role = upsert(
+            UserRole,
+            {'user': user.pk, 'role': role.pk, 'assigned_by': getattr(assigned_by, 'pk', None),
+             'is_active': True, 'assigned_at': timezone.now(), 'expires_at': expires_at},
+            conflict_fields=['user', 'role'],
+            update_fields=['is_active', 'assigned_by', 'expires_at'],
+            keep_if_null=['assigned_by'],
+        )
+        if role.django_group_id:
+            User.groups.through.objects.bulk_create(
+                [User.groups.through(user_id=user.pk, group_id=role.django_group_id)],
+                ignore_conflicts=True
+            )
+        user_roles_written([role.pk], [user_role.pk], [user.pk])
+    return user_role
+
+
+def upsert_role_permission(role, permission, granted_by=None):
+    """กำหนด permission ให้ role (เปิดใช้ใหม่ถ้าเคยถูกนำออก)"""
+    with transaction.atomic():
+        role_permission = upsert(
+            RolePermission,
+            {'role': role.pk, 'permission': permission.pk, 'granted_by': getattr(granted_by, 'pk', None),
+             'is_active': True, 'granted_at': timezone.now()},
+            conflict_fields=['role', 'permission'],
+            update_fields=['is_active', 'granted_by'],
+            keep_if_null=['granted_by'],
+        )
+        role_permissions_written(role, [role_permission.pk], granted=[permission.pk])
+    return role_permission
@@ -3,6 +3,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
+from .event_stream import event_stream, event_ticket
 
 # สร้าง Router สำหรับ ViewSets
 router = DefaultRouter()
@@ -21,5 +22,9 @@ urlpatterns = [
     # Custom endpoints
     path('api/auth/login/', views.CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/health/', views.health_check, name='health_check'),
+    path('api/dashboard/stats/', views.dashboard_stats, name='dashboard_stats'),
+    # Server-Sent Events ของการเปลี่ยนแปลงข้อมูล (ต้องรันผ่าน ASGI)
+    path('api/events/', event_stream, name='event_stream'),
+    path('api/events/ticket/', event_ticket, name='event_ticket'),
 ]
 
@@ -4,18 +4,26 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import Project, User, Role, Permission, UserRole, RolePermission
+from .models import (
+    Project, User, Role, Permission, UserRole, RolePermission, EffectivePermission, AgentProjectAssignment,
+    RoleCycleError
+)
 from .serializers import (
     ProjectSerializer, UserSerializer, GroupSerializer, RoleSerializer,
-    PermissionSerializer, UserRoleSerializer, RolePermissionSerializer
-)
-from .permissions import (
-    IsAdminUser, HasProjectPermission, HasUserManagementPermission,
-    HasRoleManagementPermission, HasRolePermission
+    PermissionSerializer, UserRoleSerializer, RolePermissionSerializer, UserSummarySerializer
 )
+from .permissions import IsAdminUser, HasUserManagementPermission, HasActionPermission
 from django.contrib.auth.models import Group
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
 from rest_framework import serializers
+from . import bulk_roles, dashboard, exports, group_sync, permission_index, project_access, upserts
+from .conditional import ConditionalGetMixin, conditional_get
+from .delta_sync import DeltaSyncMixin
+from .pagination import KeysetPagination, OptionalKeysetPagination
 
 # Custom Token View ที่ส่งข้อมูลผู้ใช้กลับมาด้วย
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -48,6 +56,137 @@ class CustomTokenObtainPairView(TokenObtainPairView):
         }
         return Response(response_data, status=status.HTTP_200_OK)
 
+def parse_date_param(params, name):
+    """อ่านวันที่รูปแบบ YYYY-MM-DD จาก query params (ไม่มีค่าคืน None)"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        # parse_date คืน None ถ้ารูปแบบผิด และ raise ValueError ถ้าเป็นวันที่ไม่มีจริง (เช่น 2024-02-30)
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise serializers.ValidationError({
+            'error': f'รูปแบบวันที่ของ {name} ไม่ถูกต้อง (ต้องเป็น YYYY-MM-DD)'
+        })
+    return parsed
+
+def is_int_id(value):
+    """ค่าจาก JSON เป็น id ที่ใช้ได้ (จำนวนเต็มหรือข้อความตัวเลข ไม่รับ true/false)"""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    return isinstance(value, str) and value.isdigit()
+
+def start_of_day(value):
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+USER_SEARCH_FIELDS = {
+    'all': ('username', 'first_name', 'last_name', 'email', 'employee_id'),
+    'name': ('first_name', 'last_name'),
+    'email': ('email',),
+    'username': ('username',),
+    'employee_id': ('employee_id',),
+}
+
+def filter_users(queryset, params):
+    """
+    กรองรายชื่อผู้ใช้ด้วย query params (ทุกเงื่อนไขใช้ index ในฐานข้อมูล)
+    - ?q= ค้นหาใน username, ชื่อ, นามสกุล, email และ employee_id (pg_trgm GIN index)
+      จำกัดให้ค้นเฉพาะบาง field ได้ด้วย ?search_by=name/email/username/employee_id
+    - ?role= id หรือชื่อของ role ที่ active
+    - ?is_active=true/false, ?department=, ?position=
+    - ?date_joined_from= / ?date_joined_to=, ?hire_date_from= / ?hire_date_to=,
+      ?termination_date_from= / ?termination_date_to= (YYYY-MM-DD รวมวันสุดท้าย)
+    """
+    q = params.get('q')
+    if q:
+        fields = USER_SEARCH_FIELDS.get(params.get('search_by'), USER_SEARCH_FIELDS['all'])
+        search = Q()
+        for field in fields:
+            search |= Q(**{f'{field}__icontains': q})
+        queryset = queryset.filter(search)
+
+    role = params.get('role')
+    if role:
+        role_filter = Q(role_id=role) if role.isdigit() else Q(role__name=role)
+        queryset = queryset.filter(Exists(
+            UserRole.objects.filter(
+                role_filter,
+                user_id=OuterRef('pk'),
+                is_active=True,
+                role__is_active=True
+            )
+        ))
+
+    is_active = params.get('is_active')
+    if is_active in ('true', 'false'):
+        queryset = queryset.filter(is_active=is_active == 'true')
+
+    department = params.get('department')
+    if department:
+        queryset = queryset.filter(department=department)
+
+    position = params.get('position')
+    if position:
+        queryset = queryset.filter(position=position)
+
+    date_joined_from = parse_date_param(params, 'date_joined_from')
+    if date_joined_from:
+        queryset = queryset.filter(date_joined__gte=start_of_day(date_joined_from))
+    date_joined_to = parse_date_param(params, 'date_joined_to')
+    if date_joined_to:
+        queryset = queryset.filter(date_joined__lt=start_of_day(date_joined_to + timedelta(days=1)))
+
+    for field in ('hire_date', 'termination_date'):
+        date_from = parse_date_param(params, f'{field}_from')
+        if date_from:
+            queryset = queryset.filter(**{f'{field}__gte': date_from})
+        date_to = parse_date_param(params, f'{field}_to')
+        if date_to:
+            queryset = queryset.filter(**{f'{field}__lte': date_to})
+
+    return queryset
+
+def prefetch_user_relations(queryset):
+    """
+    Prefetch groups และ roles ที่ active ของผู้ใช้สำหรับ UserSerializer
+    (รายการผู้ใช้ทั้งหมดใช้ 3 queries ไม่ว่าจะมีผู้ใช้กี่คน)
+    """
+    return queryset.prefetch_related(
+        Prefetch('groups', queryset=Group.objects.only('id', 'name')),
+        Prefetch(
+            'user_roles',
+            queryset=UserRole.objects.filter(is_active=True, role__is_active=True).select_related('role'),
+            to_attr='active_user_roles'
+        ),
+    )
+
+def prefetch_role_permissions(queryset):
+    """
+    prefetch permissions ที่ active สำหรับ RoleSerializer
+    (user_count และ permission_count เป็นคอลัมน์ตัวนับของ Role ไม่ต้องนับใหม่ ดู core/counters.py)
+    """
+    return queryset.select_related('parent').prefetch_related(
+        Prefetch(
+            'role_permissions',
+            queryset=RolePermission.objects.filter(
+                is_active=True, permission__is_active=True
+            ).select_related('permission'),
+            to_attr='active_role_permissions'
+        )
+    )
+
+def paginate_user_summaries(request, queryset):
+    """แบ่งหน้ารายชื่อผู้ใช้แบบ keyset (เรียงตาม id) และส่งข้อมูลแบบย่อกลับไป"""
+    paginator = KeysetPagination()
+    queryset = queryset.only(*UserSummarySerializer.Meta.fields)
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = UserSummarySerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
 # Health Check Endpoint
 @api_view(['GET'])
 @permission_classes([])
@@ -61,13 +200,34 @@ def health_check(request):
         'timestamp': '2024-01-01T00:00:00Z'
     })
 
-class ProjectViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def dashboard_stats(request):
+    """
+    สถิติสำหรับหน้า Dashboard (จำนวนผู้ใช้, โครงการ และผู้ใช้ตาม role) จาก cache อายุสั้น
+    """
+    return Response(dashboard.get_stats(request.user))
+
+class ProjectViewSet(DeltaSyncMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows projects to be viewed or edited.
     """
     queryset = Project.objects.all().order_by('-created_at')
     serializer_class = ProjectSerializer
-    permission_classes = [permissions.IsAuthenticated]  # เปลี่ยนเป็น IsAuthenticated ก่อน
+    etag_models = (Project, AgentProjectAssignment)
+    pagination_class = OptionalKeysetPagination
+    ordering = ('-created_at', 'id')
+    permission_classes = [HasActionPermission]
+    required_permissions = {
+        'create': 'project_management',
+        'update': 'project_management',
+        'destroy': 'project_management',
+    }
+    permission_denied_messages = {
+        'create': "คุณไม่มีสิทธิ์สร้างโปรเจค",
+        'update': "คุณไม่มีสิทธิ์แก้ไขโปรเจค",
+        'partial_update': "คุณไม่มีสิทธิ์แก้ไขโปรเจค",
+        'destroy': "คุณไม่มีสิทธิ์ลบโปรเจค",
+    }
 
     def get_queryset(self):
         """
@@ -77,61 +237,44 @@ class ProjectViewSet(viewsets.ModelViewSet):
         if user.is_superuser or user.is_staff:
             return Project.objects.all()
         
-        # กรองเฉพาะโปรเจคที่ผู้ใช้มีสิทธิ์เข้าถึง
-        return Project.objects.filter(
-            agent_assignments__agent=user,
-            agent_assignments__is_active=True
-        ).distinct()
-
-    def perform_create(self, serializer):
-        """
-        ตรวจสอบสิทธิ์ก่อนสร้างโปรเจค
-        """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            # ตรวจสอบ custom permission
-            from .permissions import HasProjectPermission
-            permission_checker = HasProjectPermission()
-            if not permission_checker._has_custom_permission(user, 'project_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์สร้างโปรเจค")
-        
-        serializer.save()
-
-    def perform_update(self, serializer):
-        """
-        ตรวจสอบสิทธิ์ก่อนอัปเดตโปรเจค
-        """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasProjectPermission
-            permission_checker = HasProjectPermission()
-            if not permission_checker._has_custom_permission(user, 'project_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์แก้ไขโปรเจค")
-        
-        serializer.save()
-
-    def perform_destroy(self, instance):
-        """
-        ตรวจสอบสิทธิ์ก่อนลบโปรเจค
-        """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasProjectPermission
-            permission_checker = HasProjectPermission()
-            if not permission_checker._has_custom_permission(user, 'project_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์ลบโปรเจค")
-        
-        instance.delete()
+        # กรองเฉพาะโปรเจคที่ผู้ใช้ได้รับมอบหมาย (ชุด id จาก cache ไม่ต้อง JOIN ตาราง assignments)
+        return Project.objects.filter(pk__in=project_access.get_request_project_ids(self.request))
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(DeltaSyncMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('-date_joined')
     serializer_class = UserSerializer
-    permission_classes = [permissions.IsAuthenticated]  # เปลี่ยนเป็น IsAuthenticated ก่อน
+    etag_models = (User, UserRole, Role)
+    pagination_class = OptionalKeysetPagination
+    ordering = ('-date_joined', 'id')
+    permission_classes = [HasActionPermission]
+    required_permissions = {
+        'create': 'user_management',
+        'update': 'user_management',
+        'destroy': 'user_management',
+        'export': 'user_management',
+        'assign_role': 'user_management',
+        'remove_role': 'user_management',
+    }
+    permission_denied_messages = {
+        'create': "คุณไม่มีสิทธิ์สร้างผู้ใช้",
+        'update': "คุณไม่มีสิทธิ์แก้ไขผู้ใช้",
+        'partial_update': "คุณไม่มีสิทธิ์แก้ไขผู้ใช้",
+        'destroy': "คุณไม่มีสิทธิ์ลบผู้ใช้",
+        'export': "คุณไม่มีสิทธิ์ส่งออกข้อมูลผู้ใช้",
+        'assign_role': "คุณไม่มีสิทธิ์กำหนด role ให้ผู้ใช้",
+        'remove_role': "คุณไม่มีสิทธิ์ลบ role ของผู้ใช้",
+    }
 
     def get_queryset(self):
         """
         กรองข้อมูลตามสิทธิ์ของผู้ใช้
         """
+        users = self.get_visible_users()
+        if self.action == 'list':
+            users = filter_users(users, self.request.query_params)
+        return prefetch_user_relations(users)
+
+    def get_visible_users(self):
         user = self.request.user
         if user.is_superuser or user.is_staff:
             return User.objects.all()
@@ -139,13 +282,33 @@ class UserViewSet(viewsets.ModelViewSet):
         # ผู้ใช้ทั่วไปเห็นได้เฉพาะข้อมูลของตัวเอง
         return User.objects.filter(id=user.id)
 
-    def list(self, request, *args, **kwargs):
+    @action(detail=False, methods=['get'])
+    def export(self, request):
         """
-        Override list method เพื่อเพิ่ม error handling
+        ส่งออกรายชื่อผู้ใช้ตามตัวกรองเดียวกับรายการผู้ใช้ (?file_type=csv หรือ xlsx)
         """
-        return super().list(request, *args, **kwargs)
+        users = filter_users(self.get_visible_users(), request.query_params)
+        filename = f"users_{timezone.localdate().isoformat()}"
+        
+        file_type = request.query_params.get('file_type', 'csv')
+        if file_type == 'csv':
+            return exports.csv_response(users, filename)
+        if file_type == 'xlsx':
+            try:
+                return exports.xlsx_response(users, filename)
+            except ImportError:
+                # ไม่ได้ติดตั้ง xlsxwriter: ส่งออกได้เฉพาะ csv
+                return Response(
+                    {'error': 'ไม่สามารถส่งออกเป็น xlsx ได้ เนื่องจากยังไม่ได้ติดตั้ง xlsxwriter'},
+                    status=status.HTTP_406_NOT_ACCEPTABLE
+                )
+        return Response(
+            {'error': 'file_type ต้องเป็น csv หรือ xlsx'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     @action(detail=False, methods=['get'])
+    @conditional_get
     def me(self, request):
         """
         ดึงข้อมูลผู้ใช้ปัจจุบัน
@@ -165,14 +328,9 @@ class UserViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """
-        ตรวจสอบสิทธิ์ก่อนสร้างผู้ใช้
+        สร้างผู้ใช้และกำหนด role เริ่มต้น (ตรวจสอบสิทธิ์ใน HasActionPermission)
         """
         user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasUserManagementPermission
-            permission_checker = HasUserManagementPermission()
-            if not permission_checker._has_custom_permission(user, 'user_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์สร้างผู้ใช้")
         
         # สร้าง user
         new_user = serializer.save()
@@ -220,32 +378,6 @@ class UserViewSet(viewsets.ModelViewSet):
         except Exception as e:
             print(f"❌ Error assigning Basic User role to {new_user.username}: {e}")
 
-    def perform_update(self, serializer):
-        """
-        ตรวจสอบสิทธิ์ก่อนอัปเดตผู้ใช้
-        """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasUserManagementPermission
-            permission_checker = HasUserManagementPermission()
-            if not permission_checker._has_custom_permission(user, 'user_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์แก้ไขผู้ใช้")
-        
-        serializer.save()
-
-    def perform_destroy(self, instance):
-        """
-        ตรวจสอบสิทธิ์ก่อนลบผู้ใช้
-        """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasUserManagementPermission
-            permission_checker = HasUserManagementPermission()
-            if not permission_checker._has_custom_permission(user, 'user_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์ลบผู้ใช้")
-        
-        instance.delete()
-
     @action(detail=True, methods=['post'])
     def assign_role(self, request, pk=None):
         """
@@ -256,19 +388,8 @@ class UserViewSet(viewsets.ModelViewSet):
         
         try:
             role = Role.objects.get(id=role_id, is_active=True)
-            user_role, created = UserRole.objects.get_or_create(
-                user=user,
-                role=role,
-                defaults={
-                    'assigned_by': request.user,
-                    'is_active': True
-                }
-            )
-            
-            if not created:
-                user_role.is_active = True
-                user_role.assigned_by = request.user
-                user_role.save()
+            # upsert คำสั่งเดียว ไม่เกิด IntegrityError เมื่อกำหนดพร้อมกัน
+            user_role = upserts.upsert_user_role(user, role, assigned_by=request.user)
             
             serializer = UserRoleSerializer(user_role)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -312,13 +433,31 @@ class GroupViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = GroupSerializer
     permission_classes = [IsAdminUser]
 
-class RoleViewSet(viewsets.ModelViewSet):
+class RoleViewSet(DeltaSyncMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint สำหรับจัดการ Role
     """
     queryset = Role.objects.all().order_by('name')
     serializer_class = RoleSerializer
-    permission_classes = [permissions.IsAuthenticated]  # เปลี่ยนเป็น IsAuthenticated ก่อน
+    etag_models = (Role, RolePermission, Permission)
+    permission_classes = [HasActionPermission]
+    required_permissions = {
+        'create': 'role_management',
+        'update': 'role_management',
+        'destroy': 'role_management',
+        'replace_permissions': 'role_management',
+        'assign_permission': 'role_management',
+        'remove_permission': 'role_management',
+    }
+    permission_denied_messages = {
+        'create': "คุณไม่มีสิทธิ์สร้าง role",
+        'update': "คุณไม่มีสิทธิ์แก้ไข role",
+        'partial_update': "คุณไม่มีสิทธิ์แก้ไข role",
+        'destroy': "คุณไม่มีสิทธิ์ลบ role",
+        'replace_permissions': "คุณไม่มีสิทธิ์แก้ไข permissions ของ role",
+        'assign_permission': "คุณไม่มีสิทธิ์เพิ่ม permission ให้ role",
+        'remove_permission': "คุณไม่มีสิทธิ์นำ permission ออกจาก role",
+    }
 
     def get_queryset(self):
         """
@@ -326,54 +465,40 @@ class RoleViewSet(viewsets.ModelViewSet):
         """
         user = self.request.user
         if user.is_superuser or user.is_staff:
-            return Role.objects.all()
+            return prefetch_role_permissions(Role.objects.all())
         
         # ผู้ใช้ทั่วไปเห็นได้เฉพาะ roles ที่ active
-        return Role.objects.filter(is_active=True)
+        return prefetch_role_permissions(Role.objects.filter(is_active=True))
+
+    def save_role(self, serializer):
+        """
+        บันทึก role (parent ที่ผ่าน validate_parent แล้วอาจเกิดวงจรได้ถ้ามีการแก้ไขพร้อมกัน)
+        """
+        try:
+            return serializer.save()
+        except RoleCycleError as error:
+            raise serializers.ValidationError({'parent': [str(error)]})
 
     def perform_create(self, serializer):
         """
         บันทึกข้อมูลและสร้าง Django Group
         """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasRoleManagementPermission
-            permission_checker = HasRoleManagementPermission()
-            if not permission_checker._has_custom_permission(user, 'role_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์สร้าง role")
-        
-        role = serializer.save()
-        # สร้าง Django Group สำหรับ role นี้
-        from .permissions import sync_role_with_django_group
-        sync_role_with_django_group(role)
+        role = self.save_role(serializer)
+        # สร้าง Django Group สำหรับ role นี้ (หลัง commit)
+        group_sync.request_tree_sync(role)
 
     def perform_update(self, serializer):
         """
         อัปเดตข้อมูลและซิงค์กับ Django Group
         """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasRoleManagementPermission
-            permission_checker = HasRoleManagementPermission()
-            if not permission_checker._has_custom_permission(user, 'role_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์แก้ไข role")
-        
-        role = serializer.save()
-        # อัปเดต Django Group
-        from .permissions import sync_role_with_django_group
-        sync_role_with_django_group(role)
+        role = self.save_role(serializer)
+        # อัปเดต Django Group (หลัง commit)
+        group_sync.request_tree_sync(role)
 
     def perform_destroy(self, instance):
         """
-        ตรวจสอบสิทธิ์และป้องกันการลบ role ที่สำคัญ
+        ป้องกันการลบ role ที่สำคัญ
         """
-        user = self.request.user
-        if not (user.is_superuser or user.is_staff):
-            from .permissions import HasRoleManagementPermission
-            permission_checker = HasRoleManagementPermission()
-            if not permission_checker._has_custom_permission(user, 'role_management'):
-                raise permissions.PermissionDenied("คุณไม่มีสิทธิ์ลบ role")
-        
         # ตรวจสอบว่าเป็น System Role หรือไม่ (ป้องกันการลบ role สำคัญ)
         system_roles = ['System Administrator', 'Basic User']
         if instance.name in system_roles:
@@ -415,13 +540,22 @@ class RoleViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def users(self, request, pk=None):
         """
-        ดึงรายชื่อผู้ใช้ที่มี Role นี้
+        ดึงรายชื่อผู้ใช้ที่มี Role นี้ (แบ่งหน้าแบบ cursor)
+        กรองได้ด้วย ?q= (username/ชื่อ/email) และ ?department=
         """
         role = self.get_object()
-        user_roles = role.user_roles.filter(is_active=True, user__is_active=True)
-        users = [user_role.user for user_role in user_roles]
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        now = timezone.now()
+        active_assignments = UserRole.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+            user=OuterRef('pk'),
+            role=role,
+            is_active=True,
+        )
+        users = filter_users(
+            User.objects.filter(Exists(active_assignments), is_active=True),
+            request.query_params
+        )
+        return paginate_user_summaries(request, users)
 
     @action(detail=True, methods=['get'])
     def permissions(self, request, pk=None):
@@ -429,8 +563,37 @@ class RoleViewSet(viewsets.ModelViewSet):
         ดึงรายการ Permission ของ Role นี้
         """
         role = self.get_object()
-        role_permissions = role.role_permissions.filter(is_active=True, permission__is_active=True)
-        permissions = [rp.permission for rp in role_permissions]
+        permissions = [rp.permission for rp in role.active_role_permissions]
+        serializer = PermissionSerializer(permissions, many=True)
+        return Response(serializer.data)
+
+    @permissions.mapping.put
+    def replace_permissions(self, request, pk=None):
+        """
+        แทนที่ permissions ทั้งหมดของ Role นี้ในครั้งเดียว
+        รูปแบบ request: {"permission_ids": [1, 2, 3]} ตอบกลับรายการ Permission ใหม่ (เหมือน GET)
+        """
+        role = self.get_object()
+        try:
+            permission_ids = {int(permission_id) for permission_id in request.data['permission_ids']}
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {'error': 'ต้องระบุ permission_ids เป็นรายการ id ของ permission'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        active_ids = set(
+            Permission.objects.filter(id__in=permission_ids, is_active=True).values_list('id', flat=True)
+        )
+        if active_ids != permission_ids:
+            return Response(
+                {'error': f'ไม่พบ permission: {sorted(permission_ids - active_ids)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        bulk_roles.replace_role_permissions(role, permission_ids, granted_by=request.user)
+        role = prefetch_role_permissions(Role.objects.filter(pk=role.pk)).get()
+        permissions = [rp.permission for rp in role.active_role_permissions]
         serializer = PermissionSerializer(permissions, many=True)
         return Response(serializer.data)
 
@@ -444,23 +607,8 @@ class RoleViewSet(viewsets.ModelViewSet):
         
         try:
             permission = Permission.objects.get(id=permission_id, is_active=True)
-            role_permission, created = RolePermission.objects.get_or_create(
-                role=role,
-                permission=permission,
-                defaults={
-                    'granted_by': request.user,
-                    'is_active': True
-                }
-            )
-            
-            if not created:
-                role_permission.is_active = True
-                role_permission.granted_by = request.user
-                role_permission.save()
-            
-            # อัปเดต Django Group
-            from .permissions import sync_role_with_django_group
-            sync_role_with_django_group(role)
+            # upsert คำสั่งเดียว (รวมถึงขอซิงค์ Django Group หลัง commit)
+            role_permission = upserts.upsert_role_permission(role, permission, granted_by=request.user)
             
             serializer = RolePermissionSerializer(role_permission)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -488,9 +636,8 @@ class RoleViewSet(viewsets.ModelViewSet):
             role_permission.is_active = False
             role_permission.save()
             
-            # อัปเดต Django Group
-            from .permissions import sync_role_with_django_group
-            sync_role_with_django_group(role)
+            # อัปเดต Django Group (หลัง commit)
+            group_sync.request_tree_sync(role)
             
             return Response({'message': 'Permission removed successfully'})
             
@@ -500,12 +647,13 @@ class RoleViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-class PermissionViewSet(viewsets.ModelViewSet):
+class PermissionViewSet(DeltaSyncMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint สำหรับจัดการ Permission
     """
     queryset = Permission.objects.all().order_by('category', 'name')
     serializer_class = PermissionSerializer
+    etag_models = (Permission,)
     permission_classes = [permissions.IsAuthenticated]  # เปลี่ยนเป็น IsAuthenticated ก่อน
 
     def get_queryset(self):
@@ -527,12 +675,75 @@ class PermissionViewSet(viewsets.ModelViewSet):
         categories = Permission.objects.values_list('category', flat=True).distinct()
         return Response(list(categories))
 
-class UserRoleViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], permission_classes=[HasUserManagementPermission])
+    def holders(self, request, pk=None):
+        """
+        ดึงรายชื่อผู้ใช้ที่มี permission นี้ผ่าน roles (แบ่งหน้าแบบ cursor)
+        กรองได้ด้วย ?q= (username/ชื่อ/email) และ ?department=
+        """
+        permission = self.get_object()
+        now = timezone.now()
+        grants = EffectivePermission.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+            user=OuterRef('pk'),
+            permission=permission,
+        )
+        users = filter_users(
+            User.objects.filter(Exists(grants), is_active=True),
+            request.query_params
+        )
+        return paginate_user_summaries(request, users)
+
+    @action(detail=False, methods=['post'], permission_classes=[HasUserManagementPermission])
+    def check(self, request):
+        """
+        ตรวจสอบสิทธิ์ของผู้ใช้หลายคนในครั้งเดียว (ใช้ bitmask index)
+
+        รูปแบบ request:
+        - {"checks": [{"user_id": 1, "permission": "project_view"}, ...]}
+        - {"permission": "project_view", "user_ids": [1, 2, 3]}
+        """
+        checks = request.data.get('checks')
+        permission_name = request.data.get('permission')
+        user_ids = request.data.get('user_ids')
+
+        try:
+            if checks is not None:
+                pairs = [(int(item['user_id']), str(item['permission'])) for item in checks]
+            elif permission_name and user_ids is not None:
+                pairs = [(int(user_id), str(permission_name)) for user_id in user_ids]
+            else:
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {'error': 'ต้องระบุ checks หรือ permission พร้อม user_ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_items = getattr(settings, 'AAMS_PERMISSION_CHECK_MAX_ITEMS', 10000)
+        if len(pairs) > max_items:
+            return Response(
+                {'error': f'ตรวจสอบได้สูงสุด {max_items} รายการต่อครั้ง'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = permission_index.check_permissions(pairs)
+        return Response({
+            'results': [
+                {'user_id': user_id, 'permission': name, 'allowed': allowed}
+                for (user_id, name), allowed in zip(pairs, results)
+            ]
+        })
+
+class UserRoleViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint สำหรับจัดการ UserRole
     """
     queryset = UserRole.objects.all().order_by('-assigned_at')
     serializer_class = UserRoleSerializer
+    etag_models = (UserRole, User, Role)
+    pagination_class = OptionalKeysetPagination
+    ordering = ('-assigned_at', 'id')
     permission_classes = [permissions.IsAuthenticated]  # เปลี่ยนเป็น IsAuthenticated ก่อน
 
     def get_queryset(self):
@@ -540,11 +751,12 @@ class UserRoleViewSet(viewsets.ModelViewSet):
         กรองข้อมูลตามสิทธิ์
         """
         user = self.request.user
+        user_roles = UserRole.objects.select_related('user', 'role', 'assigned_by')
         if user.is_superuser or user.is_staff:
-            return UserRole.objects.all()
+            return user_roles
         
         # ผู้ใช้ทั่วไปเห็นได้เฉพาะ user roles ของตัวเอง
-        return UserRole.objects.filter(user=user)
+        return user_roles.filter(user=user)
 
     def perform_create(self, serializer):
         """
@@ -578,16 +790,115 @@ class UserRoleViewSet(viewsets.ModelViewSet):
             user=request.user,
             is_active=True,
             role__is_active=True
-        ).order_by('-assigned_at')
+        ).select_related('user', 'role', 'assigned_by').order_by('-assigned_at')
         serializer = self.get_serializer(user_roles, many=True)
         return Response(serializer.data)
 
-class RolePermissionViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], permission_classes=[HasUserManagementPermission])
+    def bulk(self, request):
+        """
+        กำหนด/ยกเลิก role ให้ผู้ใช้หลายคนในครั้งเดียว (ดู core/bulk_roles.py)
+
+        รูปแบบ request:
+        - {"role_id": 3, "operation": "assign", "user_ids": [1, 2, 3], "expires_at": "2026-12-31T00:00:00Z"}
+        - {"role_id": 3, "operation": "revoke", "filter": {"department": "Sales", "is_active": true}}
+          (filter ใช้เงื่อนไขเดียวกับ query params ของรายชื่อผู้ใช้ เช่น q, role, department, position)
+        """
+        operation = request.data.get('operation')
+        if operation not in bulk_roles.OPERATIONS:
+            return Response(
+                {'error': 'operation ต้องเป็น assign หรือ revoke'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        role_id = request.data.get('role_id')
+        if not is_int_id(role_id):
+            return Response(
+                {'error': 'role_id ต้องเป็นตัวเลข'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        roles = Role.objects.filter(id=int(role_id))
+        if operation == bulk_roles.ASSIGN:
+            roles = roles.filter(is_active=True)
+        try:
+            role = roles.get()
+        except Role.DoesNotExist:
+            return Response({'error': 'Role not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        expires_at = request.data.get('expires_at')
+        if expires_at:
+            try:
+                expires_at = parse_datetime(str(expires_at))
+            except ValueError:
+                # รูปแบบถูกแต่เป็นวันที่ที่ไม่มีอยู่จริง เช่น 2026-02-30
+                expires_at = None
+            if expires_at is None:
+                return Response(
+                    {'error': 'รูปแบบ expires_at ไม่ถูกต้อง (ต้องเป็นเวลาแบบ ISO 8601)'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if timezone.is_naive(expires_at):
+                expires_at = timezone.make_aware(expires_at)
+        else:
+            expires_at = None
+
+        max_users = getattr(settings, 'AAMS_BULK_ROLE_MAX_USERS', 10000)
+        user_ids = request.data.get('user_ids')
+        user_filter = request.data.get('filter')
+        try:
+            if user_ids is not None:
+                if not isinstance(user_ids, list) or not all(is_int_id(user_id) for user_id in user_ids):
+                    return Response(
+                        {'error': 'user_ids ต้องเป็นรายการของ id (ตัวเลข)'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                user_ids = [int(user_id) for user_id in user_ids]
+            elif isinstance(user_filter, dict) and user_filter:
+                # ค่าจาก JSON แปลงเป็นข้อความแบบเดียวกับ query params (true/false)
+                params = {
+                    key: str(value).lower() if isinstance(value, bool) else str(value)
+                    for key, value in user_filter.items()
+                }
+                user_ids = list(
+                    filter_users(User.objects.order_by('id'), params)
+                    .values_list('id', flat=True)[:max_users + 1]
+                )
+            else:
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'ต้องระบุ user_ids หรือ filter'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(user_ids) > max_users:
+            return Response(
+                {'error': f'ทำรายการได้สูงสุด {max_users} ผู้ใช้ต่อครั้ง'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = bulk_roles.apply(
+            operation, role, user_ids, assigned_by=request.user, expires_at=expires_at
+        )
+        counts = {}
+        for result in results.values():
+            counts[result] = counts.get(result, 0) + 1
+        return Response({
+            'role_id': role.pk,
+            'operation': operation,
+            'results': results,
+            'counts': counts,
+        })
+
+class RolePermissionViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint สำหรับจัดการ RolePermission
     """
     queryset = RolePermission.objects.all().order_by('-granted_at')
     serializer_class = RolePermissionSerializer
+    etag_models = (RolePermission, Role, Permission, User)
+    pagination_class = OptionalKeysetPagination
+    ordering = ('-granted_at', 'id')
     permission_classes = [permissions.IsAuthenticated]  # เปลี่ยนเป็น IsAuthenticated ก่อน
 
     def get_queryset(self):
@@ -595,13 +906,13 @@ class RolePermissionViewSet(viewsets.ModelViewSet):
         กรองข้อมูลตามสิทธิ์
         """
         user = self.request.user
+        role_permissions = RolePermission.objects.select_related('role', 'permission', 'granted_by')
         if user.is_superuser or user.is_staff:
-            return RolePermission.objects.all()
+            return role_permissions
         
-        # ผู้ใช้ทั่วไปเห็นได้เฉพาะ role permissions ของ roles ที่มี
-        user_roles = UserRole.objects.filter(user=user, is_active=True)
-        role_ids = [ur.role.id for ur in user_roles]
-        return RolePermission.objects.filter(role_id__in=role_ids)
+        # ผู้ใช้ทั่วไปเห็นได้เฉพาะ role permissions ของ roles ที่มี (subquery ไม่ต้องโหลด role ทีละแถว)
+        role_ids = UserRole.objects.filter(user=user, is_active=True).values('role_id')
+        return role_permissions.filter(role_id__in=role_ids)
 
     def perform_create(self, serializer):
         """
@@ -609,9 +920,8 @@ class RolePermissionViewSet(viewsets.ModelViewSet):
         """
         role_permission = serializer.save(granted_by=self.request.user)
         
-        # อัปเดต Django Group
-        from .permissions import sync_role_with_django_group
-        sync_role_with_django_group(role_permission.role)
+        # อัปเดต Django Group (หลัง commit)
+        group_sync.request_tree_sync(role_permission.role)
 
     def perform_update(self, serializer):
         """
@@ -619,9 +929,8 @@ class RolePermissionViewSet(viewsets.ModelViewSet):
         """
         role_permission = serializer.save()
         
-        # อัปเดต Django Group
-        from .permissions import sync_role_with_django_group
-        sync_role_with_django_group(role_permission.role)
+        # อัปเดต Django Group (หลัง commit)
+        group_sync.request_tree_sync(role_permission.role)
 
     def update(self, request, *args, **kwargs):
         try:
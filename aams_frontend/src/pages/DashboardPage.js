@@ -19,92 +19,31 @@ function DashboardPage() {
 
     const loadStatsRef = useRef();
 
-    const loadStats = useCallback(async (userData) => {
+    const loadStats = useCallback(async () => {
+        // สถิติทั้งหมดคำนวณที่ server (ตามสิทธิ์ของผู้ใช้) ใน request เดียว
         try {
-            // ดึงจำนวนผู้ใช้ (สำหรับ Admin/Superuser เท่านั้น)
-            if (userData?.is_superuser || userData?.is_staff) {
-                try {
-                    const token = localStorage.getItem('accessToken');
-                    const response = await fetch('http://localhost:8000/api/users/', {
-                        headers: {
-                            'Authorization': token ? `Bearer ${token}` : undefined,
-                            'Content-Type': 'application/json',
-                        },
-                    });
-                    if (!response.ok) {
-                        throw new Error('ไม่สามารถดึงข้อมูลผู้ใช้ได้');
-                    }
-                    const allUsers = await response.json();
-                    console.log('usersResponse.data', allUsers);
-                    const activeUsers = allUsers.filter(user => user.is_active);
-                    const inactiveUsers = allUsers.filter(user => !user.is_active);
-                    
-                    // นับจำนวนผู้ใช้ตาม Role
-                    const roleStats = {};
-                    allUsers.forEach(user => {
-                        if (user.user_roles && user.user_roles.length > 0) {
-                            user.user_roles.forEach(userRole => {
-                                const roleName = userRole.role_name || 'Unknown';
-                                roleStats[roleName] = (roleStats[roleName] || 0) + 1;
-                            });
-                        }
-                    });
-
-                    setStats(prev => ({
-                        ...prev,
-                        totalUsers: allUsers.length,
-                        activeUsers: activeUsers.length,
-                        inactiveUsers: inactiveUsers.length,
-                        roleStats: roleStats
-                    }));
-                } catch (error) {
-                    console.error('Error loading user stats:', error);
-                    // ถ้าไม่สามารถดึงข้อมูลได้ ให้ใช้ค่าเริ่มต้น
-                    setStats(prev => ({
-                        ...prev,
-                        totalUsers: 0,
-                        activeUsers: 0,
-                        inactiveUsers: 0,
-                        roleStats: {}
-                    }));
-                }
-            }
-
-            // ดึงจำนวนโครงการ
-            try {
-                const token = localStorage.getItem('accessToken');
-                const response = await fetch('http://localhost:8000/api/projects/', {
-                    headers: {
-                        'Authorization': token ? `Bearer ${token}` : undefined,
-                        'Content-Type': 'application/json',
-                    },
-                });
-                if (!response.ok) {
-                    throw new Error('ไม่สามารถดึงข้อมูลโครงการได้');
-                }
-                const allProjects = await response.json();
-                console.log('projectsResponse.data', allProjects);
-                const activeProjects = allProjects.filter(project => project.is_active);
-                const inactiveProjects = allProjects.filter(project => !project.is_active);
-
-                setStats(prev => ({
-                    ...prev,
-                    totalProjects: allProjects.length,
-                    activeProjects: activeProjects.length,
-                    inactiveProjects: inactiveProjects.length
-                }));
-            } catch (error) {
-                console.error('Error loading project stats:', error);
-                setStats(prev => ({
-                    ...prev,
-                    totalProjects: 0,
-                    activeProjects: 0,
-                    inactiveProjects: 0
-                }));
-            }
-
+            const response = await apiClient.get('/api/dashboard/stats/');
+            const data = response.data;
+            setStats({
+                totalUsers: data.total_users,
+                activeUsers: data.active_users,
+                inactiveUsers: data.inactive_users,
+                totalProjects: data.total_projects,
+                activeProjects: data.active_projects,
+                inactiveProjects: data.inactive_projects,
+                roleStats: data.role_stats || {}
+            });
         } catch (error) {
             console.error('Error loading stats:', error);
+            setStats({
+                totalUsers: 0,
+                activeUsers: 0,
+                inactiveUsers: 0,
+                totalProjects: 0,
+                activeProjects: 0,
+                inactiveProjects: 0,
+                roleStats: {}
+            });
         }
     }, []);
 
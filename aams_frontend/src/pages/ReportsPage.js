@@ -16,7 +16,7 @@ function ReportsPage() {
     const fetchUsers = async () => {
       try {
         const token = localStorage.getItem('accessToken');
-        const response = await fetch('http://localhost:8000/api/users/', {
+        const response = await fetch('http://localhost:8000/api/users/?paginate=false', {
           headers: {
             'Authorization': token ? `Bearer ${token}` : undefined,
             'Content-Type': 'application/json',
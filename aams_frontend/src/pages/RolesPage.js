@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import './RolesPage.css';
+import { subscribeToChanges } from '../services/events';
 
 function RolesPage() {
   const [roles, setRoles] = useState([]);
@@ -16,8 +17,11 @@ function RolesPage() {
   const [permissionsLoading, setPermissionsLoading] = useState(false);
 
   useEffect(() => {
-    const fetchRoles = async () => {
-      setLoading(true);
+    // showLoading = false เมื่อดึงใหม่จาก event (ไม่ต้องแสดงหน้าโหลดซ้ำ)
+    const fetchRoles = async (showLoading = true) => {
+      if (showLoading) {
+        setLoading(true);
+      }
       setError('');
       try {
         const token = localStorage.getItem('accessToken');
@@ -39,6 +43,8 @@ function RolesPage() {
       }
     };
     fetchRoles();
+    // ดึงรายการ Role ใหม่เมื่อมีการเปลี่ยน role หรือ permissions ของ role
+    return subscribeToChanges(['roles', 'role-permissions', 'permissions'], () => fetchRoles(false));
   }, []);
 
   // ฟังก์ชันสำหรับดึง Permissions ทั้งหมด
@@ -131,29 +137,18 @@ function RolesPage() {
     try {
       const token = localStorage.getItem('accessToken');
       
-      // ลบ permissions เก่าทั้งหมด
-      const currentPermissions = selectedRole.permissions || [];
-      for (const perm of currentPermissions) {
-        await fetch(`http://localhost:8000/api/roles/${selectedRole.id}/remove_permission/`, {
-          method: 'POST',
-          headers: {
-            'Authorization': token ? `Bearer ${token}` : undefined,
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ permission_id: perm.id }),
-        });
-      }
-
-      // เพิ่ม permissions ใหม่
-      for (const permId of selectedPermissions) {
-        await fetch(`http://localhost:8000/api/roles/${selectedRole.id}/assign_permission/`, {
-          method: 'POST',
-          headers: {
-            'Authorization': token ? `Bearer ${token}` : undefined,
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ permission_id: permId }),
-        });
+      // แทนที่ permissions ทั้งหมดของ role ในครั้งเดียว
+      const saveResponse = await fetch(`http://localhost:8000/api/roles/${selectedRole.id}/permissions/`, {
+        method: 'PUT',
+        headers: {
+          'Authorization': token ? `Bearer ${token}` : undefined,
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ permission_ids: selectedPermissions }),
+      });
+      if (!saveResponse.ok) {
+        const errorData = await saveResponse.json().catch(() => ({}));
+        throw new Error(errorData.error || errorData.detail || 'ไม่สามารถบันทึก Permissions ได้');
       }
 
       // รีเฟรชข้อมูล roles
@@ -233,7 +228,9 @@ function RolesPage() {
       });
       
       if (usersResponse.ok) {
-        const users = await usersResponse.json();
+        // API แบ่งหน้าแล้ว ใช้รายชื่อจากหน้าแรกสำหรับแสดงตัวอย่าง
+        const data = await usersResponse.json();
+        const users = data.results || [];
         
         if (users.length > 0) {
           const userNames = users.map(u => u.username).join(', ');
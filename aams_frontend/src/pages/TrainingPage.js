@@ -23,7 +23,7 @@ function TrainingPage() {
         const token = localStorage.getItem('accessToken');
         
         // ดึงข้อมูลผู้ใช้
-        const usersResponse = await fetch('http://localhost:8000/api/users/', {
+        const usersResponse = await fetch('http://localhost:8000/api/users/?paginate=false', {
           headers: {
             'Authorization': token ? `Bearer ${token}` : undefined,
             'Content-Type': 'application/json',
@@ -1,9 +1,13 @@
-import React, { useEffect, useState, useCallback } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import './UsersPage.css';
+import { subscribeToChanges } from '../services/events';
+
+const USERS_URL = 'http://localhost:8000/api/users/';
+// รอให้พิมพ์ค้นหาเสร็จก่อนส่ง request ไปที่ server
+const FILTER_DEBOUNCE_MS = 300;
 
 function UsersPage() {
     const [users, setUsers] = useState([]);
-  const [filteredUsers, setFilteredUsers] = useState([]);
     const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [searchTerm, setSearchTerm] = useState('');
@@ -17,9 +21,15 @@ function UsersPage() {
   const [selectedUserRoles, setSelectedUserRoles] = useState([]);
   const [rolesLoading, setRolesLoading] = useState(true);
 
-  // Pagination states
+  // Pagination states (server แบ่งหน้าแบบ cursor: มีแค่ลิงก์หน้าถัดไป/ก่อนหน้า)
   const [currentPage, setCurrentPage] = useState(1);
   const [usersPerPage, setUsersPerPage] = useState(20);
+  const [nextPageUrl, setNextPageUrl] = useState(null);
+  const [prevPageUrl, setPrevPageUrl] = useState(null);
+  const pageUrlRef = useRef(null);
+  // cursor ของ ?updated_since= สำหรับดึงเฉพาะผู้ใช้ที่เปลี่ยนหลังโหลดหน้าปัจจุบัน
+  const syncCursorRef = useRef(null);
+  const syncQueueRef = useRef(Promise.resolve());
 
   // Bulk actions states
   const [selectedUsers, setSelectedUsers] = useState([]);
@@ -41,43 +51,92 @@ function UsersPage() {
   const [userToDelete, setUserToDelete] = useState(null);
 
   useEffect(() => {
-    fetchUsers();
+    fetchRoles();
+    // เมื่อมีการเปลี่ยนผู้ใช้หรือ role ของผู้ใช้ ดึงเฉพาะผู้ใช้ที่เปลี่ยน (resync/refetch = ดึงหน้าปัจจุบันใหม่)
+    return subscribeToChanges(['users', 'user-roles'], (events) => {
+      const reload = events.some(event => event.type === 'resync' || event.type === 'refetch');
+      // ทำทีละครั้งตามลำดับ เพื่อไม่ให้ cursor ถอยหลัง
+      syncQueueRef.current = syncQueueRef.current.then(() => (reload ? fetchUsers(false) : syncUsers()));
+    });
   }, []);
 
-    const fetchUsers = async () => {
-        setLoading(true);
+  // ตัวกรองทั้งหมดส่งไปให้ server กรอง (filter_users ใน backend) ไม่ดึงทั้งตารางมากรองเอง
+  const buildFilterParams = () => {
+    const params = new URLSearchParams();
+    if (searchTerm) {
+      params.append('q', searchTerm);
+      if (searchBy !== 'all') params.append('search_by', searchBy);
+    }
+    if (selectedRole) params.append('role', selectedRole);
+    if (selectedStatus) params.append('is_active', selectedStatus === 'active' ? 'true' : 'false');
+    if (departmentFilter) params.append('department', departmentFilter);
+    if (dateJoinedFilter) {
+      params.append('date_joined_from', dateJoinedFilter);
+      params.append('date_joined_to', dateJoinedFilter);
+    }
+    return params;
+  };
+
+  // เปลี่ยนตัวกรองหรือจำนวนต่อหน้า: กลับไปหน้าแรกของผลลัพธ์ใหม่
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      const params = buildFilterParams();
+      params.append('page_size', usersPerPage);
+      setCurrentPage(1);
+      setSelectedUsers([]);
+      setSelectAll(false);
+      fetchUsers(true, `${USERS_URL}?${params.toString()}`);
+    }, FILTER_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [searchTerm, searchBy, selectedRole, selectedStatus, departmentFilter, dateJoinedFilter, usersPerPage]);
+
+    // showLoading = false เมื่อดึงใหม่จาก event (ไม่ต้องแสดงหน้าโหลดซ้ำ)
+    // url = ลิงก์ของหน้าที่ต้องการ (ไม่ระบุ = ดึงหน้าปัจจุบันซ้ำ)
+    const fetchUsers = async (showLoading = true, url = pageUrlRef.current) => {
+      if (!url) {
+        return;
+      }
+      pageUrlRef.current = url;
+        if (showLoading) {
+          setLoading(true);
+        }
       setError('');
       try {
         const token = localStorage.getItem('accessToken');
-        console.log('Token:', token ? 'มี token' : 'ไม่มี token'); // Debug log
+        // ขอ cursor ก่อนดึงหน้า การเปลี่ยนแปลงระหว่างนี้จึงไม่ตกหล่น (อาจได้ซ้ำกับที่อยู่ในหน้าแล้ว)
+        const cursor = await fetchSyncCursor();
         
-        const response = await fetch('http://localhost:8000/api/users/', {
+        const response = await fetch(url, {
           headers: {
             'Authorization': token ? `Bearer ${token}` : undefined,
             'Content-Type': 'application/json',
           },
         });
         
-        console.log('Response status:', response.status); // Debug log
-        
         if (!response.ok) {
           const errorText = await response.text();
           console.error('Error response:', errorText); // Debug log
           
           // ตรวจสอบว่าเป็น JSON error หรือ HTML error
+          let errorJson;
           try {
-            const errorJson = JSON.parse(errorText);
-            throw new Error(errorJson.detail || 'ไม่สามารถดึงข้อมูลผู้ใช้ได้');
+            errorJson = JSON.parse(errorText);
           } catch (parseError) {
             // ถ้าไม่ใช่ JSON ให้แสดงข้อความทั่วไป
             throw new Error(`ไม่สามารถดึงข้อมูลผู้ใช้ได้ (Status: ${response.status})`);
           }
+          throw new Error(errorJson.error || errorJson.detail || 'ไม่สามารถดึงข้อมูลผู้ใช้ได้');
         }
         
         const data = await response.json();
-        console.log('Users data:', data); // Debug log
-        setUsers(data);
-        setFilteredUsers(data);
+        // หน้าที่ดึงมาอาจไม่ใช่หน้าล่าสุดที่ขอแล้ว (ผู้ใช้เปลี่ยนตัวกรองระหว่างรอ)
+        if (pageUrlRef.current !== url) {
+          return;
+        }
+        syncCursorRef.current = cursor;
+        setUsers(data.results);
+        setNextPageUrl(data.next);
+        setPrevPageUrl(data.previous);
       } catch (err) {
         console.error('Fetch users error:', err); // Debug log
         setError(err.message);
@@ -86,6 +145,98 @@ function UsersPage() {
         }
     };
 
+  // ไม่ได้ cursor (null) จะดึงหน้าปัจจุบันใหม่ทั้งหน้าเมื่อมี event แทน
+  const fetchSyncCursor = async () => {
+    try {
+      const token = localStorage.getItem('accessToken');
+      const response = await fetch(`${USERS_URL}?updated_since=latest`, {
+        headers: {
+          'Authorization': token ? `Bearer ${token}` : undefined,
+          'Content-Type': 'application/json',
+        },
+      });
+      if (!response.ok) {
+        return null;
+      }
+      const data = await response.json();
+      return data.next_cursor;
+    } catch (err) {
+      console.error('Fetch sync cursor error:', err);
+      return null;
+    }
+  };
+
+  // ดึงผู้ใช้ที่เปลี่ยนตั้งแต่ cursor (ใช้ตัวกรองเดียวกับหน้าปัจจุบัน) แล้วแก้เฉพาะแถวในหน้าปัจจุบัน
+  const syncUsers = async () => {
+    const pageUrl = pageUrlRef.current;
+    if (!pageUrl || !syncCursorRef.current) {
+      return fetchUsers(false);
+    }
+    const pageParams = new URL(pageUrl).searchParams;
+    const pageSize = Number(pageParams.get('page_size')) || 0;
+    const firstPage = !pageParams.get('cursor');
+    const params = new URLSearchParams(pageParams);
+    params.delete('cursor');
+    params.delete('page_size');
+
+    let cursor = syncCursorRef.current;
+    let hasMore = true;
+    try {
+      const token = localStorage.getItem('accessToken');
+      while (hasMore) {
+        params.set('updated_since', cursor);
+        const response = await fetch(`${USERS_URL}?${params.toString()}`, {
+          headers: {
+            'Authorization': token ? `Bearer ${token}` : undefined,
+            'Content-Type': 'application/json',
+          },
+        });
+        // 410 = cursor เก่าเกินกว่าบันทึกที่ server เก็บไว้ ต้องดึงหน้าปัจจุบันใหม่
+        if (response.status === 410) {
+          return fetchUsers(false);
+        }
+        if (!response.ok) {
+          throw new Error(`ไม่สามารถดึงการเปลี่ยนแปลงของผู้ใช้ได้ (Status: ${response.status})`);
+        }
+        const data = await response.json();
+        // ผู้ใช้เปลี่ยนหน้า/ตัวกรองระหว่างรอ หน้าใหม่มี cursor ของตัวเองแล้ว
+        if (pageUrlRef.current !== pageUrl) {
+          return;
+        }
+        applyUserChanges(data.results, data.deleted, firstPage, pageSize);
+        cursor = data.next_cursor;
+        hasMore = data.has_more;
+        syncCursorRef.current = cursor;
+      }
+    } catch (err) {
+      console.error('Sync users error:', err);
+    }
+  };
+
+  // results = ผู้ใช้ที่เปลี่ยนและยังตรงกับตัวกรอง, deleted = id ที่ถูกลบหรือไม่ตรงกับตัวกรองแล้ว
+  // ผู้ใช้ใหม่ที่ไม่อยู่ในหน้านี้ถูกเพิ่มไว้บนสุดของหน้าแรกเท่านั้น (รายการเรียงผู้ใช้ใหม่ก่อน)
+  const applyUserChanges = (results, deleted, firstPage, pageSize) => {
+    const removed = new Set(deleted);
+    const changed = new Map(results.map(user => [user.id, user]));
+    setUsers(prevUsers => {
+      const updated = prevUsers
+        .filter(user => !removed.has(user.id))
+        .map(user => {
+          const next = changed.get(user.id);
+          changed.delete(user.id);
+          return next || user;
+        });
+      if (!firstPage || changed.size === 0) {
+        return updated;
+      }
+      const added = [...changed.values()].concat(updated);
+      return pageSize ? added.slice(0, pageSize) : added;
+    });
+    if (removed.size) {
+      setSelectedUsers(prevSelected => prevSelected.filter(id => !removed.has(id)));
+    }
+  };
+
   const fetchRoles = async () => {
     setRolesLoading(true);
     try {
@@ -110,7 +261,7 @@ function UsersPage() {
   const fetchUserRoles = async (userId) => {
     try {
       const token = localStorage.getItem('accessToken');
-      const response = await fetch(`http://localhost:8000/api/user-roles/?user=${userId}`, {
+      const response = await fetch(`http://localhost:8000/api/user-roles/?user=${userId}&paginate=false`, {
         headers: {
           'Authorization': token ? `Bearer ${token}` : undefined,
           'Content-Type': 'application/json',
@@ -152,84 +303,6 @@ function UsersPage() {
     }
   };
 
-  // Advanced search functions
-  const performAdvancedSearch = useCallback((user) => {
-      const term = searchTerm.toLowerCase();
-    
-    if (searchBy === 'all') {
-      return (
-        (user.first_name && user.first_name.toLowerCase().includes(term)) ||
-        (user.last_name && user.last_name.toLowerCase().includes(term)) ||
-        (user.email && user.email.toLowerCase().includes(term)) ||
-        (user.username && user.username.toLowerCase().includes(term)) ||
-        (user.employee_id && user.employee_id.toLowerCase().includes(term))
-      );
-    } else if (searchBy === 'name') {
-      return (
-        (user.first_name && user.first_name.toLowerCase().includes(term)) ||
-        (user.last_name && user.last_name.toLowerCase().includes(term))
-      );
-    } else if (searchBy === 'email') {
-      return user.email && user.email.toLowerCase().includes(term);
-    } else if (searchBy === 'username') {
-      return user.username && user.username.toLowerCase().includes(term);
-    } else if (searchBy === 'employee_id') {
-      return user.employee_id && user.employee_id.toLowerCase().includes(term);
-    }
-    
-    return true;
-  }, [searchTerm, searchBy]);
-
-  useEffect(() => {
-    let filtered = users;
-    
-    // Advanced search
-    if (searchTerm) {
-      filtered = filtered.filter(performAdvancedSearch);
-    }
-    
-    // Role filter
-    if (selectedRole) {
-      filtered = filtered.filter(user => {
-        if (user.user_roles && user.user_roles.length > 0) {
-          const validRoles = user.user_roles.filter(ur => ur && ur.role_name);
-          return validRoles.some(role => role.role_name === selectedRole);
-        }
-        return false;
-      });
-    }
-
-    // Status filter
-    if (selectedStatus) {
-      const isActive = selectedStatus === 'active';
-      filtered = filtered.filter(user => user.is_active === isActive);
-    }
-    
-    // Department filter
-    if (departmentFilter) {
-      filtered = filtered.filter(user => 
-        user.department && user.department.toLowerCase().includes(departmentFilter.toLowerCase())
-      );
-    }
-    
-    // Date joined filter (basic implementation)
-    if (dateJoinedFilter) {
-      const filterDate = new Date(dateJoinedFilter);
-      filtered = filtered.filter(user => {
-        if (user.date_joined) {
-          const userDate = new Date(user.date_joined);
-          return userDate.toDateString() === filterDate.toDateString();
-        }
-        return false;
-      });
-    }
-
-    setFilteredUsers(filtered);
-    setCurrentPage(1); // Reset to first page when filtering
-    setSelectedUsers([]);
-    setSelectAll(false);
-  }, [users, searchTerm, selectedRole, selectedStatus, departmentFilter, dateJoinedFilter, searchBy, performAdvancedSearch]);
-
   const getRole = (user) => {
     if (user.user_roles && user.user_roles.length > 0) {
       // กรองข้อมูลที่ถูกต้อง
@@ -242,37 +315,23 @@ function UsersPage() {
   };
 
   const getAllRoles = () => {
-    const roles = new Set();
-    users.forEach(user => {
-      if (user.user_roles && user.user_roles.length > 0) {
-        // กรองข้อมูลที่ถูกต้อง
-        const validRoles = user.user_roles.filter(ur => ur && ur.role_name);
-        validRoles.forEach(role => roles.add(role.role_name));
-      }
-    });
-    return Array.from(roles).sort();
+    return roles.map(role => role.name).sort();
   };
 
   // Pagination functions
-  const getCurrentUsers = () => {
-    const startIndex = (currentPage - 1) * usersPerPage;
-    const endIndex = startIndex + usersPerPage;
-    return filteredUsers.slice(startIndex, endIndex);
-  };
-
-  const totalPages = Math.ceil(filteredUsers.length / usersPerPage);
-
-  const handlePageChange = (page) => {
-    setCurrentPage(page);
+  const handlePageChange = (direction) => {
+    const url = direction === 'next' ? nextPageUrl : prevPageUrl;
+    if (!url) {
+      return;
+    }
+    setCurrentPage(page => (direction === 'next' ? page + 1 : page - 1));
     setSelectedUsers([]);
     setSelectAll(false);
+    fetchUsers(true, url);
   };
 
   const handleUsersPerPageChange = (perPage) => {
     setUsersPerPage(perPage);
-    setCurrentPage(1);
-    setSelectedUsers([]);
-    setSelectAll(false);
   };
 
   // Bulk actions functions
@@ -291,7 +350,7 @@ function UsersPage() {
       setSelectedUsers([]);
       setSelectAll(false);
     } else {
-      const currentUserIds = getCurrentUsers().map(user => user.id);
+      const currentUserIds = users.map(user => user.id);
       setSelectedUsers(currentUserIds);
       setSelectAll(true);
     }
@@ -347,27 +406,25 @@ function UsersPage() {
     }
   };
 
-  // Export functions
-  const exportToCSV = () => {
+  // Export functions (ให้ server สร้างไฟล์ตามตัวกรองปัจจุบัน)
+  const exportToCSV = async () => {
     setExporting(true);
     
     try {
-      const headers = ['Name', 'Username', 'Email', 'Role', 'Status', 'Department', 'Date Joined'];
-      const csvData = filteredUsers.map(user => [
-        `${user.first_name || ''} ${user.last_name || ''}`.trim(),
-        user.username,
-        user.email || '',
-        getRole(user),
-        user.is_active ? 'Active' : 'Inactive',
-        user.department || '',
-        user.date_joined ? new Date(user.date_joined).toLocaleDateString('th-TH') : ''
-      ]);
-
-      const csvContent = [headers, ...csvData]
-        .map(row => row.map(cell => `"${cell}"`).join(','))
-        .join('\n');
-
-      const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
+      const token = localStorage.getItem('accessToken');
+      const params = buildFilterParams();
+      params.append('file_type', 'csv');
+
+      const response = await fetch(`http://localhost:8000/api/users/export/?${params.toString()}`, {
+        headers: {
+          'Authorization': token ? `Bearer ${token}` : undefined,
+        },
+      });
+      if (!response.ok) {
+        throw new Error(`Status: ${response.status}`);
+      }
+
+      const blob = await response.blob();
       const link = document.createElement('a');
       const url = URL.createObjectURL(blob);
       link.setAttribute('href', url);
@@ -376,6 +433,7 @@ function UsersPage() {
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
+      URL.revokeObjectURL(url);
       
       alert('ส่งออกข้อมูลสำเร็จ');
     } catch (err) {
@@ -722,7 +780,7 @@ function UsersPage() {
               </label>
               <input
                 type="text"
-                placeholder="พิมพ์ชื่อแผนก..."
+                placeholder="ชื่อแผนก (ตรงทั้งคำ)"
                 value={departmentFilter}
                 onChange={(e) => setDepartmentFilter(e.target.value)}
               style={{
@@ -770,13 +828,13 @@ function UsersPage() {
           gap: 16
         }}>
           <span style={{ color: '#666', fontSize: 14 }}>
-            แสดง {((currentPage - 1) * usersPerPage) + 1}-{Math.min(currentPage * usersPerPage, filteredUsers.length)} จาก {filteredUsers.length} คน
+            หน้า {currentPage} · แสดง {users.length} คน
           </span>
           
           <div style={{ display: 'flex', gap: 8 }}>
             <button
               onClick={exportToCSV}
-              disabled={exporting || filteredUsers.length === 0}
+              disabled={exporting || users.length === 0}
               style={{
                 padding: '8px 16px',
                 backgroundColor: '#28a745',
@@ -883,7 +941,7 @@ function UsersPage() {
           )}
 
           {/* Users Table */}
-          {filteredUsers.length === 0 ? (
+          {users.length === 0 ? (
             <div style={{ textAlign: 'center', padding: 40, background: '#fff', borderRadius: 12 }}>
               <div style={{ fontSize: 48, marginBottom: 16 }}>🔍</div>
               <p>ไม่พบผู้ใช้ที่ตรงกับเงื่อนไขการค้นหา</p>
@@ -919,7 +977,7 @@ function UsersPage() {
               </div>
 
               {/* Table Body */}
-              {getCurrentUsers().map(user => (
+              {users.map(user => (
               <div 
                 key={user.id} 
                 style={{
@@ -1059,7 +1117,7 @@ function UsersPage() {
           )}
 
           {/* Pagination */}
-          {totalPages > 1 && (
+          {(prevPageUrl || nextPageUrl) && (
             <div style={{
               display: 'flex',
               justifyContent: 'space-between',
@@ -1090,61 +1148,34 @@ function UsersPage() {
 
               <div style={{ display: 'flex', alignItems: 'center', gap: 8 }}>
                 <button
-                  onClick={() => handlePageChange(currentPage - 1)}
-                  disabled={currentPage === 1}
+                  onClick={() => handlePageChange('previous')}
+                  disabled={!prevPageUrl}
                   style={{
                     padding: '8px 12px',
-                    backgroundColor: currentPage === 1 ? '#f8f9fa' : '#007bff',
-                    color: currentPage === 1 ? '#adb5bd' : '#fff',
+                    backgroundColor: !prevPageUrl ? '#f8f9fa' : '#007bff',
+                    color: !prevPageUrl ? '#adb5bd' : '#fff',
                     border: 'none',
                     borderRadius: 4,
-                    cursor: currentPage === 1 ? 'not-allowed' : 'pointer'
+                    cursor: !prevPageUrl ? 'not-allowed' : 'pointer'
                   }}
                 >
                   ← ก่อนหน้า
                 </button>
 
-                {Array.from({ length: Math.min(5, totalPages) }, (_, i) => {
-                  let pageNum;
-                  if (totalPages <= 5) {
-                    pageNum = i + 1;
-                  } else if (currentPage <= 3) {
-                    pageNum = i + 1;
-                  } else if (currentPage >= totalPages - 2) {
-                    pageNum = totalPages - 4 + i;
-                  } else {
-                    pageNum = currentPage - 2 + i;
-                  }
-
-                  return (
-                    <button
-                      key={pageNum}
-                      onClick={() => handlePageChange(pageNum)}
-                      style={{
-                        padding: '8px 12px',
-                        backgroundColor: currentPage === pageNum ? '#007bff' : '#fff',
-                        color: currentPage === pageNum ? '#fff' : '#007bff',
-                        border: '1px solid #007bff',
-                        borderRadius: 4,
-                        cursor: 'pointer',
-                        minWidth: 40
-                      }}
-                    >
-                      {pageNum}
-                    </button>
-                  );
-                })}
+                <span style={{ color: '#666', fontSize: 14, minWidth: 60, textAlign: 'center' }}>
+                  หน้า {currentPage}
+                </span>
 
                 <button
-                  onClick={() => handlePageChange(currentPage + 1)}
-                  disabled={currentPage === totalPages}
+                  onClick={() => handlePageChange('next')}
+                  disabled={!nextPageUrl}
                   style={{
                     padding: '8px 12px',
-                    backgroundColor: currentPage === totalPages ? '#f8f9fa' : '#007bff',
-                    color: currentPage === totalPages ? '#adb5bd' : '#fff',
+                    backgroundColor: !nextPageUrl ? '#f8f9fa' : '#007bff',
+                    color: !nextPageUrl ? '#adb5bd' : '#fff',
                     border: 'none',
                     borderRadius: 4,
-                    cursor: currentPage === totalPages ? 'not-allowed' : 'pointer'
+                    cursor: !nextPageUrl ? 'not-allowed' : 'pointer'
                   }}
                 >
                   ถัดไป →
@@ -49,27 +49,17 @@ apiClient.interceptors.response.use(
         if (error.response?.status === 401 && !originalRequest._retry) {
             originalRequest._retry = true;
 
+            if (!localStorage.getItem('refreshToken')) {
+                // ถ้าไม่มี refreshToken ก็ทำอะไรต่อไม่ได้, ส่งไปหน้า login
+                handleLogout();
+                return Promise.reject(error);
+            }
+
             try {
                 // พยายามขอ accessToken ใหม่ โดยใช้ refreshToken
-                const refreshToken = localStorage.getItem('refreshToken');
-                if (!refreshToken) {
-                    // ถ้าไม่มี refreshToken ก็ทำอะไรต่อไม่ได้, ส่งไปหน้า login
-                    handleLogout();
-                    return Promise.reject(error);
-                }
-
-                const response = await axios.post(`${baseURL}/api/token/refresh/`, {
-                    refresh: refreshToken,
-                });
-                
-                // ได้ accessToken ใหม่มาแล้ว
-                const newAccessToken = response.data.access;
-                
-                // เก็บ Token ใหม่ลง localStorage
-                localStorage.setItem('accessToken', newAccessToken);
+                const newAccessToken = await refreshAccessToken();
                 
                 // อัปเดต Header ของ request เดิมให้ใช้ Token ใหม่
-                apiClient.defaults.headers.common['Authorization'] = `Bearer ${newAccessToken}`;
                 originalRequest.headers['Authorization'] = `Bearer ${newAccessToken}`;
                 
                 // ยิง request เดิมซ้ำอีกครั้งด้วย Token ใหม่
@@ -89,6 +79,49 @@ apiClient.interceptors.response.use(
     }
 );
 
+// ขอ accessToken ใหม่ด้วย refreshToken แล้วเก็บลง localStorage (คืนค่า token ใหม่)
+// request ที่ได้ 401 พร้อมกันหลายตัว และการเชื่อมต่อ events.js ใหม่ ใช้การขอครั้งเดียวกัน
+let refreshPromise = null;
+
+export const refreshAccessToken = () => {
+    if (!refreshPromise) {
+        const refreshToken = localStorage.getItem('refreshToken');
+        refreshPromise = (refreshToken
+            ? axios.post(`${baseURL}/api/token/refresh/`, { refresh: refreshToken })
+            : Promise.reject(new Error('ไม่มี refreshToken'))
+        ).then((response) => {
+            const newAccessToken = response.data.access;
+            localStorage.setItem('accessToken', newAccessToken);
+            apiClient.defaults.headers.common['Authorization'] = `Bearer ${newAccessToken}`;
+            return newAccessToken;
+        }).finally(() => {
+            refreshPromise = null;
+        });
+    }
+    return refreshPromise;
+};
+
+// accessToken หมดอายุแล้ว (หรือจะหมดภายใน marginSeconds) ตามค่า exp ใน token
+export const isAccessTokenExpired = (marginSeconds = 30) => {
+    const token = localStorage.getItem('accessToken');
+    if (!token) {
+        return true;
+    }
+    try {
+        const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+        return !payload.exp || payload.exp * 1000 < Date.now() + marginSeconds * 1000;
+    } catch (err) {
+        return true;
+    }
+};
+
+// ขอ ticket อายุสั้นสำหรับเปิด GET /api/events/ (EventSource ส่ง header Authorization ไม่ได้
+// และไม่ส่ง accessToken ใน URL เพราะจะถูกบันทึกใน access log) ticket ใช้ได้ครั้งเดียว
+export const getEventStreamTicket = async () => {
+    const response = await apiClient.post('/api/events/ticket/');
+    return response.data.ticket;
+};
+
 // ฟังก์ชันสำหรับจัดการ logout
 const handleLogout = () => {
     // ล้าง localStorage ทั้งหมด
@@ -170,7 +203,7 @@ export const getCurrentUser = async () => {
 // ดึงรายการโครงการทั้งหมด
 export const getProjects = async () => {
     try {
-        const response = await apiClient.get('/api/projects/');
+        const response = await apiClient.get('/api/projects/?paginate=false');
         return response.data;
     } catch (error) {
         console.error('Failed to get projects:', error);
@@ -240,7 +273,7 @@ export const toggleProjectStatus = async (projectId, isActive) => {
 // ดึงรายการผู้ใช้ทั้งหมด
 export const getUsers = async () => {
     try {
-        const response = await apiClient.get('/api/users/');
+        const response = await apiClient.get('/api/users/?paginate=false');
         return response.data;
     } catch (error) {
         console.error('Failed to get users:', error);
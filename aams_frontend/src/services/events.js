@@ -0,0 +1,134 @@
+// src/services/events.js
+// รับ event การเปลี่ยนแปลงข้อมูลแบบ real-time จาก GET /api/events/ (Server-Sent Events)
+// ใช้แทนการ poll: เมื่อได้ event ของ resource ที่สนใจ ให้หน้าเว็บดึงข้อมูลใหม่
+
+import { getEventStreamTicket, isAccessTokenExpired, refreshAccessToken } from './api';
+
+const baseURL = process.env.REACT_APP_API_BASE_URL || 'http://localhost:8000';
+
+// รอให้ event ที่มาติดกันหลายตัวรวมเป็นการดึงข้อมูลครั้งเดียว
+const DEBOUNCE_MS = 300;
+// เชื่อมต่อใหม่แบบ exponential backoff: 1, 2, 4, ... วินาที สูงสุด 60 วินาที (เริ่มใหม่เมื่อเชื่อมต่อได้)
+const RECONNECT_DELAY_MS = 1000;
+const MAX_RECONNECT_DELAY_MS = 60000;
+// ขอ token/ticket ใหม่ไม่สำเร็จติดกันเท่านี้ครั้ง (เช่น refreshToken หมดอายุ) ให้หยุดเชื่อมต่อ
+const MAX_REFRESH_FAILURES = 5;
+
+/**
+ * subscribeToChanges(['roles', 'role-permissions'], (events) => fetchRoles())
+ * resources: ชื่อ resource ตาม path ของ API (roles, permissions, role-permissions,
+ *            user-roles, users, projects, project-assignments)
+ * คืนค่าฟังก์ชันสำหรับยกเลิกการติดตาม (ใช้เป็น cleanup ของ useEffect)
+ */
+export function subscribeToChanges(resources, onChange) {
+  if (typeof window === 'undefined' || !window.EventSource) {
+    return () => {};
+  }
+
+  let source = null;
+  let closed = false;
+  let reconnectTimer = null;
+  let debounceTimer = null;
+  let pending = [];
+  let connectedBefore = false;
+  let reconnectDelay = RECONNECT_DELAY_MS;
+  let tokenExpired = false;
+  let refreshFailures = 0;
+
+  const flush = () => {
+    debounceTimer = null;
+    const events = pending;
+    pending = [];
+    onChange(events);
+  };
+
+  const handleChange = (message) => {
+    let event;
+    try {
+      event = JSON.parse(message.data);
+    } catch (err) {
+      return;
+    }
+    // resync = เซิร์ฟเวอร์ส่ง event ไม่ทัน ต้องดึงข้อมูลใหม่ทุก resource
+    // refetch = event ใหญ่เกินกว่าจะส่ง ids ได้ ต้องดึงข้อมูลของ resource นั้นใหม่
+    if (event.type !== 'resync' && !resources.includes(event.resource)) {
+      return;
+    }
+    pending.push(event);
+    if (!debounceTimer) {
+      debounceTimer = setTimeout(flush, DEBOUNCE_MS);
+    }
+  };
+
+  const connect = async () => {
+    reconnectTimer = null;
+    if (closed) {
+      return;
+    }
+    // EventSource ส่ง header Authorization ไม่ได้: ขอ ticket ที่ใช้ได้ครั้งเดียวผ่าน api.js ทุกครั้งที่เชื่อมต่อ
+    // (การเชื่อมต่อจะอยู่ได้ถึงเวลาหมดอายุของ accessToken จึงขอ token ใหม่ก่อนถ้าใกล้หมดอายุ)
+    let ticket;
+    try {
+      if (tokenExpired || isAccessTokenExpired()) {
+        await refreshAccessToken();
+        tokenExpired = false;
+      }
+      ticket = await getEventStreamTicket();
+      refreshFailures = 0;
+    } catch (err) {
+      refreshFailures += 1;
+      if (refreshFailures >= MAX_REFRESH_FAILURES || err.response?.status === 401) {
+        console.error('หยุดรับ event: ขอ token หรือ ticket ใหม่ไม่สำเร็จ', err);
+        return;
+      }
+      scheduleReconnect();
+      return;
+    }
+    if (closed) {
+      return;
+    }
+    source = new EventSource(`${baseURL}/api/events/?ticket=${encodeURIComponent(ticket)}`);
+    source.addEventListener('change', handleChange);
+    source.onopen = () => {
+      reconnectDelay = RECONNECT_DELAY_MS;
+      // อาจพลาด event ระหว่างที่หลุดการเชื่อมต่อ ให้ดึงข้อมูลใหม่หนึ่งครั้ง
+      if (connectedBefore) {
+        handleChange({ data: JSON.stringify({ resource: null, type: 'resync' }) });
+      }
+      connectedBefore = true;
+    };
+    source.addEventListener('token_expired', () => {
+      tokenExpired = true;
+      reconnect();
+    });
+    source.onerror = reconnect;
+  };
+
+  function scheduleReconnect() {
+    if (!closed && !reconnectTimer) {
+      reconnectTimer = setTimeout(connect, reconnectDelay);
+      reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_DELAY_MS);
+    }
+  }
+
+  // การเชื่อมต่อหลุดหรือ token หมดอายุ: ปิดแล้วเชื่อมต่อใหม่เอง (ไม่ใช้การเชื่อมต่อใหม่อัตโนมัติของ EventSource
+  // ซึ่งใช้ ticket เดิมใน URL ที่ใช้ไปแล้ว)
+  function reconnect() {
+    if (source) {
+      source.close();
+      source = null;
+    }
+    scheduleReconnect();
+  }
+
+  connect();
+
+  return () => {
+    closed = true;
+    clearTimeout(reconnectTimer);
+    clearTimeout(debounceTimer);
+    if (source) {
+      source.close();
+    }
+  };
+}